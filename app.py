@@ -6,15 +6,23 @@ Created on Wed Dec  2 11:46:14 2020
 """
 
 import dash
+import flask
 import dash_html_components as html
 import dash_core_components as dcc
 import dash_table
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State, ALL, MATCH
 
-import copy
 import datetime
+import logging
+import os
 import pandas as pd
-import requests, json
+
+from compression import get_config_compression_from_env, init_app as init_compression
+from metadata import MetadataSync, get_config_metadata_from_env
+from metrics import get_logger, init_app as init_metrics
+from session import create_session_store, get_config_session_from_env, get_session_id
+from study import LIST_FORMS_EAGER, Study, get_dict_answers, get_dict_answers_final, get_studies_from_env
+from templates import FormTemplate
 
 
 ###################################################
@@ -56,92 +64,83 @@ STYLE_ROW_LEFT_MAIN = {**STYLE_ROW, **{'width':'80%'}}
 STYLE_ROW_CENTER_MAIN = {**STYLE_ROW, **{'width':'10%'}}
 STYLE_ROW_RIGHT_MAIN = {**STYLE_ROW, **{'width':'90%'}}
 
+# Interval between checks of a submission sent in background (ms)
+INTERVAL_SUBMISSION = 1000
+
+# Text fields with a validation type: type of input, and display format of date pickers
+DICT_INPUT_TYPES = {'integer':'number', 'number':'number', 'email':'email', 'phone_australia':'tel'}
+DICT_DATE_FORMATS = {'date_dmy':'DD/MM/YYYY', 'date_mdy':'MM/DD/YYYY', 'date_ymd':'YYYY-MM-DD'}
+
+# Answers of these types of components are committed on blur/Enter, not on each keystroke
+LIST_TYPES_DEBOUNCE = ['text', 'number']
+# Answers are sent to the server (autosave) in one request, after this idle time (ms)
+COMMIT_INTERVAL = 1000
+
+# Session id of the layout, replaced for each page (see compression.py)
+SESSION_PLACEHOLDER = '__session_id__'
 
-###################################################
-# Functions that interact with Redcap API
-###################################################
 
-def get_dict_answers_final(dict_answers, dict_hide):
+def get_config_input_from_env():
     """
-    Get dictionary of answers without None
+    Return configuration of answer commits from environment variables
+        - types_debounce: types of components committed on blur/Enter (empty string: every keystroke)
+        - commit_interval: idle time before pending answers are sent to the server (ms, 0: sent at once)
     """
-    dict_answers_final = copy.deepcopy(dict_answers)
-    for key in dict_answers:
-        if dict_answers_final[key] is None or dict_hide[key]:
-            del dict_answers_final[key]
-    return dict_answers_final
+    types_debounce = os.environ.get('DELECTABLE_INPUT_DEBOUNCE', ','.join(LIST_TYPES_DEBOUNCE))
+    return dict(
+        types_debounce = [i.strip() for i in types_debounce.split(',') if i.strip()],
+        commit_interval = int(os.environ.get('DELECTABLE_COMMIT_INTERVAL', COMMIT_INTERVAL)),
+    )
 
 
-def send_record_to_redcap(patient_code, dict_answers, dict_hide):
+###################################################
+# Functions that interact with Redcap API
+###################################################
+
+def send_record_to_redcap(study, patient_code, dict_answers, dict_hide):
     """
-    Send data to Redcap
+    Send data to the Redcap project of the study
+    Return two outputs:
+        - output_label: message for the user
+        - submission_id: id to check status of submission in outbox (None if record has not been saved)
     """
+    submission_id = None
     if patient_code is None:
         output_label = 'Error: Please enter patient code'
     else:
-        config = dict(
-            api_super_token = 'ABCD1234ABCD1234ABCD1234ABCD1234ABCD1234ABCD1234ABCD1234ABCD1234',
-            api_token       = 'E35EBAD0BDE751A7B0F154E4B817DF07',
-            api_url         = 'https://redcap.healthinformatics.unimelb.edu.au/api/'
-        )
         record = get_dict_answers_final(dict_answers, dict_hide)
         record['record_id'] = patient_code
-        data = json.dumps([record])
-        fields = {
-            'token': config['api_token'],
-            'content': 'record',
-            'format': 'json',
-            'type': 'flat',
-            'data': data,
-        }
-        r = requests.post(config['api_url'], data=fields)
-        print('HTTP Status: ' + str(r.status_code))
-        print(r.text)
-        output_label = f'Record submitted (id = {patient_code})'
+        submission_id = study.outbox.add([record]) # record is saved before being sent (batches of records)
+        if study.config_redcap['bool_async']: # delivered by background thread, status is checked by interval
+            study.outbox_worker.notify()
+            output_label = f'Record queued (id = {patient_code})'
+        else: # only this record is sent in the callback, the outbox worker sends it later if Redcap is not available
+            study.outbox.send_submission(study.redcap_client, submission_id)
+            status = study.outbox.get_status(submission_id)
+            if status['status'] != 'done':
+                if status['status'] == 'pending':
+                    study.outbox_worker.notify()
+                return status['message'], submission_id
+            output_label = f'Record submitted (id = {patient_code})'
         output_label += f'\nFields completed = {len(record)-1}'
-    return output_label
+    return output_label, submission_id
 
 
-###################################################
-# Functions to populate data table
-###################################################
-        
-def get_question_from_key(field_name):
-    return df_fields[df_fields['Variable / Field Name']==field_name]['Field Label'].iloc[0]
-
-
-def get_choice_label_from_value(field_name, value):
-    string = df_fields[df_fields['Variable / Field Name']==field_name]['Choices, Calculations, OR Slider Labels'].iloc[0]
-    if type(string) is str:
-        for choice in string.split('|'):
-            if value == int(choice.split(',')[0].lstrip().rstrip()):
-                return ','.join(choice.split(',')[1:]).lstrip().rstrip()
-        return ''
-    else:
-        if value is not None:
-            return value
-        return ''
+def get_html_errors(study, dict_errors):
+    """
+    Return report of invalid answers, when a record is not submitted
+    """
+    list_items = []
+    for field_name, message in dict_errors.items():
+        field = study.dict_fields[field_name]
+        list_items.append(html.Li(f'{field.form.upper()} - {str(field.label).strip()}: {message}'))
+    return [html.Div(f'Record not submitted: please correct {len(dict_errors)} answer(s)'), html.Ul(list_items)]
 
 
 ###################################################
 # Functions to add HTML components
 ###################################################
 
-def get_dict_options(choices):
-    """
-    Get dictionary of options from raw string in Redcap dictionary
-    """
-    if pd.isna(choices):
-        return {}
-    else:
-        dict_choices = {}
-        for choice in choices.split('|'):
-            value = int(choice.split(',')[0])
-            label = ','.join(choice.split(',')[1:]).lstrip().rstrip()
-            dict_choices[value] = label
-        return dict_choices
-
-
 def get_form_initial_style(form):
     """
     Return initial style of forms
@@ -150,18 +149,6 @@ def get_form_initial_style(form):
     return initial_style
 
 
-def get_date_from_value(value, format_in="%Y-%m-%d", format_out="%Y-%m-%d"):
-    """
-    Check if value entered is a date
-    Return string or False
-    """
-    try:
-        dt = datetime.datetime.strptime(value, format_in)
-        return dt.strftime(format_out)
-    except:
-        return False
-    
-   
 def get_style_border_from_value(value):
     if value is None:
         return STYLE_BORDER_RED
@@ -169,18 +156,22 @@ def get_style_border_from_value(value):
         return STYLE_BORDER_GREEN
     
     
-def get_type_component(field_name):
+def get_component_id(study, type_id, id_component):
+    """
+    Return id of a component in the row of id_component
+    Fields of the data dictionary use pattern-matching ids ({'type':..., 'name':...}),
+    so that a fixed number of callbacks (MATCH/ALL) serves any number of fields
+    """
+    if id_component in study.dict_fields:
+        return {'type':type_id, 'name':id_component}
+    return type_id+'_'+id_component
+
+
+def get_type_component(study, field_name):
     """
     Return type of component based on field name
     """
-    df = df_fields[df_fields['Variable / Field Name']==field_name]
-    field_type = df['Field Type'].iloc[0]
-    field_type_alt = df['Text Validation Type OR Show Slider Number'].iloc[0]
-    if field_type == 'text':
-        type_component = field_type if pd.isna(field_type_alt) else field_type_alt
-    else:
-        type_component = field_type
-    return type_component
+    return study.dict_fields[field_name].type_component
 
 
 def add_html_left_part(label_children, label_help=None, style_left=STYLE_ROW_LEFT, style_center=STYLE_ROW_CENTER):
@@ -193,21 +184,28 @@ def add_html_left_part(label_children, label_help=None, style_left=STYLE_ROW_LEF
     ])]
 
     
-def add_html_component(type_component, id_component, label_children, label_help=None,
+def add_html_component(study, type_component, id_component, label_children, label_help=None,
                        value_component=None, dict_options={},
                        value_min=None, value_max=None, value_step=1,
                        date_min=DATE_MIN, date_max=DATE_MAX, dict_marks={},
                        width_short=WIDTH_SHORT, width_long=WIDTH_LONG,
                        style_left=STYLE_ROW_LEFT, style_center=STYLE_ROW_CENTER,
                        style_right=STYLE_ROW_RIGHT, style_border=STYLE_BORDER_BLUE,
-                       style_visibility=STYLE_VISIBLE, dict_answers={}, dict_hide={}):
+                       style_visibility=STYLE_VISIBLE):
     """
     Add HTML component, which is a row with 3 columns:
         - left: description (by default: 50% width)
         - center: help text (by default: 10% width)
         - right: widget (by default: 40% width)
+    Rows of fields in the data dictionary also store the last answer entered (delta)
     """
     
+    ###################################################
+    # Fields of the data dictionary use pattern-matching ids
+    id_row = id_component
+    if id_component in study.dict_fields:
+        id_component = get_component_id(study, 'field', id_row)
+    
     ###################################################
     if type_component == 'dropdown':
         component = [dcc.Dropdown(id=id_component, value=value_component,
@@ -221,21 +219,33 @@ def add_html_component(type_component, id_component, label_children, label_help=
         component = [dcc.RadioItems(id=id_component, value=value_component,
                                     options=[{'label':dict_options[i], 'value':i} for i in dict_options])]
     ###################################################
-    elif type_component in ['text','number']:
-        component = [dcc.Input(id=id_component, value=value_component, type=type_component,
-                               min=value_min, max=value_max, style={'width':width_short})]
-        
-    ###################################################
-    elif type_component in ['date_dmy']:
-        component = [dcc.DatePickerSingle(id=id_component, display_format='DD/MM/YYYY', date=None,
+    elif type_component in DICT_DATE_FORMATS:
+        component = [dcc.DatePickerSingle(id=get_component_id(study, 'field_date', id_row), display_format=DICT_DATE_FORMATS[type_component], date=value_component,
                                           min_date_allowed=date_min, max_date_allowed=date_max,
                                           initial_visible_month=datetime.datetime.now(),
                                           style={'width':width_short})]
+        if id_row in study.dict_fields: # date is copied (client side) to a hidden value, like other fields
+            component.append(dcc.Input(id=id_component, value=value_component, style=STYLE_HIDDEN))
+    
+    ###################################################
+    elif type_component in ['calc']: # value is computed (client side) from other answers, see calculations.py
+        component = [dcc.Input(id=get_component_id(study, 'calc', id_row), value=value_component, type='text',
+                               readOnly=True, style={'width':width_short})]
+        style_border = STYLE_NO_BORDER
+
+    ###################################################
+    elif type_component in ['text', 'number'] or (id_row in study.dict_fields and study.dict_fields[id_row].field_type == 'text'):
+        # Other validation types (number_2dp, time, ...) are text inputs, answers are checked by validation rules
+        type_input = DICT_INPUT_TYPES.get(type_component, 'text')
+        component = [dcc.Input(id=id_component, value=value_component, type=type_input,
+                               debounce=type_input in config_input['types_debounce'],
+                               min=value_min, max=value_max, style={'width':width_short})]
     
     ###################################################
     elif type_component in ['slider']:
         component = [dcc.Slider(id=id_component, min=value_min, max=value_max,
-                                value=value_min, step=value_step, marks=dict_marks)]
+                                value=value_min if value_component is None else value_component,
+                                step=value_step, marks=dict_marks)]
     
     ###################################################
     elif type_component in ['descriptive']:
@@ -244,27 +254,32 @@ def add_html_component(type_component, id_component, label_children, label_help=
         
     ###################################################
     else:
-        print(f'Component not added: {id_component}')
+        logger.warning('Component not added: %s', id_component)
         component = []
     
     ###################################################
     children = add_html_left_part(label_children, label_help, style_left, style_center)
     children.append(html.Div(style=STYLE_ROW_RIGHT, children=component))
-    children.append(dcc.Store(id='store_answer_'+id_component, data=convert_dict_to_list(dict_answers)))
-    children.append(dcc.Store(id='store_hide_'+id_component, data=convert_dict_to_list(dict_hide)))
-    return html.Div(id='row_outer_'+id_component, style=style_visibility, children=[
-        html.Div(id='row_inner_'+id_component, style=style_border, children=children)
+    type_row_outer = 'row_outer'
+    if id_row in study.dict_fields and type_component != 'calc': # calc fields are computed again from the record
+        children.append(dcc.Store(id=get_component_id(study, 'store_answer', id_row), data=value_component))
+        if id_row in study.set_sources: # answer is copied (client side) for the branching logic and calc fields callbacks
+            children.append(dcc.Store(id=get_component_id(study, 'store_source', id_row), data=value_component))
+        if study.dict_fields[id_row].branching_logic is not None:
+            type_row_outer = 'row_logic'
+    return html.Div(id=get_component_id(study, type_row_outer, id_row), style=style_visibility, children=[
+        html.Div(id=get_component_id(study, 'row_inner', id_row), style=style_border, children=children)
     ])
 
 
-def add_html_form_home(dict_answers, dict_hide):
+def add_html_form_home(study):
     """
     Add HTML components for "Home" form
     """
     children = []
-    children.append(add_html_component('text', 'home_patient_code', 'Patient code'))
-    children.append(add_html_component('number','home_visit_day', 'Day of visit (1-7)', value_min=1, value_max=7,
-                                       dict_answers=dict_answers, dict_hide=dict_hide))
+    children.append(add_html_component(study, 'text', 'home_patient_code', 'Patient code'))
+    children.append(add_html_component(study, 'number','home_visit_day', f'Day of visit (1-{study.schedule.n_days})',
+                                       value_min=1, value_max=study.schedule.n_days))
     return html.Div(children=children)
     
 
@@ -278,22 +293,27 @@ def add_html_form_review():
                              style_table={'minWidth':'100%'}, style_cell=STYLE_CELL)
     ]))
     children.append(html.Div(style=STYLE_NO_BORDER, children=[
-        html.Div(id='label_submit', children='')
+        html.Div(id='label_submit', children=''),
+        html.Div(id='label_submission_status', children=''),
+        dcc.Store(id='store_submission', data=None),
+        dcc.Interval(id='interval_submission', interval=INTERVAL_SUBMISSION, disabled=True)
     ]))
     return html.Div(children=children)
 
 
-def add_html_form(form, dict_answers, dict_hide, bool_numbering=BOOL_NUMBERING):
+def add_html_form(study, form, dict_hide, bool_numbering=BOOL_NUMBERING, dict_answers=None):
     """
     Inputs:
+        - study: Study whose data dictionary is rendered
         - form: value of selected form (Form Name)
         - bool_numbering: show/hide question number, e.g. "1.1."
+        - dict_answers: answers restored from a draft (None: form is empty)
     """
+    dict_answers = dict_answers or {}
 
     ###################################################
     # Filter dataframes based on form
-    df = df_fields[df_fields['Form Name']==form]
-    dff = df_forms[df_forms['Form Name']==form]
+    dff = study.df_forms[study.df_forms['Form Name']==form]
     
     ###################################################
     # Add title
@@ -302,7 +322,7 @@ def add_html_form(form, dict_answers, dict_hide, bool_numbering=BOOL_NUMBERING):
     ###################################################
     # Form is HOME
     if form in ['home']:
-        contents.append(add_html_form_home(dict_answers, dict_hide))
+        contents.append(add_html_form_home(study))
         
     ###################################################
     # Form is REVIEW
@@ -312,125 +332,112 @@ def add_html_form(form, dict_answers, dict_hide, bool_numbering=BOOL_NUMBERING):
     ###################################################
     # Form is an actual questionnaire
     else:
-        # Loop through rows
-        for i in df.index:
+        # Loop through fields of the form
+        for field in study.dict_form_fields.get(form, ()):
             
             # Create question number (if numbering is desired)
-            idx_question = f"{dff['Form Index'].iloc[0]}.{list(df.index).index(i)+1}. " if bool_numbering else ''
-            
-            # Find type of component (be careful: text has subtypes)
-            type_component = get_type_component(df['Variable / Field Name'][i])
+            idx_question = f"{dff['Form Index'].iloc[0]}.{field.position}. " if bool_numbering else ''
             
             # Add section header (if corresponding column is not empty)
-            if not pd.isna(df['Section Header'][i]):
-                contents.append(html.H6(df['Section Header'][i]))
+            if field.section_header is not None:
+                contents.append(html.H6(field.section_header))
                 
-            # Add component
-            contents.append(add_html_component(type_component=type_component,
-                                               id_component=df['Variable / Field Name'][i],
-                                               label_children=idx_question+df['Field Label'][i],
-                                               label_help=df['Field Note'][i],
-                                               dict_options=get_dict_options(df['Choices, Calculations, OR Slider Labels'][i]),
-                                               style_visibility=get_field_style(df['Variable / Field Name'][i], dict_hide),
-                                               dict_answers=dict_answers,
-                                               dict_hide=dict_hide))
+            # Add component (type of component and choices are precompiled, be careful: text has subtypes)
+            dict_slider = {'value_min':0, 'value_max':100, 'dict_marks':field.dict_marks} if field.field_type == 'slider' else {}
+            contents.append(add_html_component(study, type_component=field.type_component,
+                                               id_component=field.name,
+                                               label_children=idx_question+field.label,
+                                               label_help=field.note,
+                                               value_component=dict_answers.get(field.name),
+                                               dict_options=field.dict_options,
+                                               style_border=STYLE_BORDER_BLUE if dict_answers.get(field.name) is None else STYLE_BORDER_GREEN,
+                                               style_visibility=get_field_style(field.name, dict_hide),
+                                               **dict_slider))
             
     ###################################################
     return contents
 
 
+def get_form_template(study, form):
+    """
+    Return template of a form (see templates.py), which is rendered once with the initial branching logic and no answers
+    Forms do not depend on the visit day, so that one template is shared by all days and sessions
+    """
+    template = study.dict_form_cache.get(form)
+    if template is None:
+        template = FormTemplate(add_html_form(study, form, study.dict_hide), study.dict_hide,
+                                style_visible=STYLE_VISIBLE, style_hidden=STYLE_HIDDEN,
+                                style_empty=STYLE_BORDER_BLUE, style_answered=STYLE_BORDER_GREEN)
+        study.dict_form_cache[form] = template
+    return template
+
+
 ###################################################
 # Functions to manage global variables
 ###################################################
 
 
-def convert_dict_to_list(dict_answers):
-    list_answers = []
-    for key in dict_answers:
-        list_answers.append([key,dict_answers[key]])
-    return list_answers
-
-
-def convert_list_to_dict(list_answers):
-    dict_answers = {}
-    for i in range(len(list_answers)):
-        key = list_answers[i][0]
-        answer = list_answers[i][1]
-        dict_answers[key] = answer
-    return dict_answers
-
-
-def get_dict_answers(df_fields):
+def get_answers_from_record(study, state_record, pending=None):
     """
-    This function is called once when app is started
-    Return one output:
-        - dict: a dictionary that summarizes the state of answers for all questions
-    """
-    dict_answers = {}
-    for i in df_fields['Variable / Field Name'].values:
-        dict_answers[i] = None
+    Rebuild the full record from the answer stores of all fields, or from the session store (calc fields are computed)
+    This is only done when rendering a form, reviewing or submitting, answering a question only sends deltas
+    Inputs:
+        - state_record: State STATE_RECORD, i.e. either
+          {'type':'store_answer', 'name':ALL} (list of id/property/value, answers kept in browser)
+          or 'store_session' (id/property/value, answers kept in server-side session store)
+        - pending: data of "store_pending" (answers not sent yet to the session store, see LIST_STATES_PENDING)
+    """
+    dict_answers = get_dict_answers(study.dict_fields)
+    if session_store is None:
+        for state in state_record:
+            dict_answers[state['id']['name']] = state.get('value')
+    else:
+        dict_session = session_store.get(state_record.get('value') or '')
+        if pending:
+            dict_session = {**dict_session, **pending['answers']}
+        for field_name, value in dict_session.items():
+            if field_name in dict_answers:
+                dict_answers[field_name] = value
+    dict_answers.update(study.calculations.get_values(dict_answers))
     return dict_answers
 
 
-def get_variables_branching_logic(df_fields):
+def get_dictionaries_from_stores(study, state_record, pending=None):
     """
-    This function is called once when app is started
     Return two outputs:
-        - list: all variables (field names) that have branching logic
-        - dict: dictionary that summarizes the state of show/hide styles for all questions
-    """
-    list_check_branching_logic = []
-    dict_hide_branching_logic = {}
-    for i in range(df_fields.shape[0]):
-        field_name = df_fields['Variable / Field Name'].iloc[i]
-        branching_logic = df_fields['Branching Logic (Show field only if...)'].iloc[i]
-        dict_hide_branching_logic[field_name] = type(branching_logic) == str # Hide field if string
-        if type(branching_logic) == str:
-            field_check = branching_logic.replace("[","]").split("]")[1] # get value between square brackets
-            if field_check not in list_check_branching_logic:
-                list_check_branching_logic.append(field_check)
-    return list_check_branching_logic, dict_hide_branching_logic
-
-
-def reset_dictionaries(dict_answers, dict_hide):
-    """
-    Reset all answers to None
-    """
-    for i in range(df_fields.shape[0]):
-        field_name = df_fields['Variable / Field Name'].iloc[i]
-        branching_logic = df_fields['Branching Logic (Show field only if...)'].iloc[i]
-        dict_answers[field_name] = None
-        dict_hide[field_name] = type(branching_logic) == str
+        - dict: answers for all questions
+        - dict: show/hide state for all questions
+    """
+    dict_answers = get_answers_from_record(study, state_record, pending)
+    dict_hide = study.branching_logic.get_dict_hide(dict_answers, study.dict_fields)
     return dict_answers, dict_hide
 
 
-def update_branching_logic(field_name_ref, value_ref,
-                           dict_hide_branching_logic,
-                           list_check_branching_logic):
+def get_client_config(study):
     """
-    This function is called once when app is started (to initialize callbacks for branching logic)
-    Then, it is called every time that the user enters an answer (value_ref) to any question (field_name_ref)
-    Inputs:
-        - field_name_ref: field where value has been changed
-        - value_ref: new value entered in field_name
-    Output:
-        - list_fields_updated: list of fields associated to branching logic (useful to initialize callbacks)
-    """
-    list_fields_updated = []
-    if field_name_ref in list_check_branching_logic:
-        for i in range(df_fields.shape[0]):
-            field_name = df_fields['Variable / Field Name'].iloc[i]
-            branching_logic = df_fields['Branching Logic (Show field only if...)'].iloc[i]
-            if type(branching_logic) == str:
-                field_name_check = branching_logic.replace("[","]").split("]")[1] # get value between square brackets
-                value_check = branching_logic.replace(" ","").split("=")[1] # get value after the equal sign
-                value_check = int(value_check.split("'")[1]) if "'" in value_check else int(value_check) # transform integer
-                if field_name_ref == field_name_check:
-                    dict_hide_branching_logic[field_name] = False if value_ref == value_check else True
-                    list_fields_updated.append(field_name)
-    return list_fields_updated, dict_hide_branching_logic
+    Return data of the store "store_client", sent once with the layout and read by clientside callbacks (assets/delectable.js):
+    styles of rows, compiled branching logic, equations of calc fields and validation rules of the study
+    """
+    return {
+        'style_border_empty': get_style_border_from_value(None),
+        'style_border_answered': get_style_border_from_value(''),
+        'style_border_invalid': STYLE_BORDER_RED,
+        'style_visible': STYLE_VISIBLE,
+        'style_hidden': STYLE_HIDDEN,
+        'rules': study.branching_logic.get_rules(),
+        'validation': study.validator.get_rules(),
+        'calculations': study.calculations.get_rules(),
+        'commit_interval': config_input['commit_interval'],
+        'autosave': is_autosave(study),
+    }
 
 
+def is_autosave(study):
+    """
+    Return True if answers are sent to the server while they are entered (drafts or server-side sessions)
+    """
+    return study.draft_store is not None or session_store is not None
+
 
 def get_field_style(field_name, dict_hide_branching_logic):
     """
@@ -444,323 +451,473 @@ def get_field_style(field_name, dict_hide_branching_logic):
 
 ########################################################
 # Initialize variables to be used throughout whole user session
-# These variables act as global variables
-df_forms = pd.read_excel('https://raw.githubusercontent.com/kevinsmeng/delectable-demo/main/resources/list_forms_v3.xlsx')
-df_fields = pd.read_excel('https://raw.githubusercontent.com/kevinsmeng/delectable-demo/main/resources/list_fields_v3.xlsx')
-dict_answers = get_dict_answers(df_fields)
-list_check, dict_hide = get_variables_branching_logic(df_fields)
+# These variables act as global variables (shared by all studies, data dictionaries are in Study objects)
+logger = get_logger('app')
+config_input = get_config_input_from_env()
+config_session = get_config_session_from_env()
+config_compression = get_config_compression_from_env()
+config_metadata = get_config_metadata_from_env()
+session_store = create_session_store(**config_session)
+
+# Callbacks that need the full record read it from the browser (answer stores) or from the session store
+# With a session store, answers that are still pending in the browser (not sent yet) are also read
+if session_store is None:
+    STATE_RECORD = State({'type':'store_answer', 'name':ALL}, 'data')
+    LIST_STATES_SESSION = []
+    LIST_STATES_PENDING = []
+else:
+    STATE_RECORD = State('store_session', 'data')
+    LIST_STATES_SESSION = [State('store_session', 'data')]
+    LIST_STATES_PENDING = [State('store_pending', 'data')]
+
+
 
 
 ########################################################
 # Layout before defining callbacks
 external_stylesheets = ['https://raw.githubusercontent.com/kevinsmeng/delectable-demo/main/assets/mycss.css']
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-server = app.server
-app.layout = html.Div(style=STYLE_LAYOUT, children=[
-    # Main dropdown to select form
-    html.Div(style={'width':'100%', 'display':'inline-block', 'verticalAlign':'top'},children=[
-        add_html_component(type_component='dropdown', id_component='main_dropdown', label_children='**Select form...**',
-                           value_component=VALUE_COMPONENT_MAIN, dict_options=DICT_OPTIONS_MAIN,
-                           style_left=STYLE_ROW_LEFT_MAIN, style_center=STYLE_ROW_CENTER_MAIN,
-                           style_right=STYLE_ROW_RIGHT_MAIN, style_border=STYLE_NO_BORDER)
-    ]),
-    # Contents of selected form
-    html.Div(style={'width':'100%', 'display':'inline-block', 'verticalAlign':'top'},children=[
-        html.Div(id='form_'+form, children=add_html_form(form, dict_answers, dict_hide)) for form in df_forms['Form Name'].values
-    ]),
-    # Previous and next buttons
-    html.Div(style={'width':'100%', 'display':'inline-block', 'verticalAlign':'top', 'marginBottom':'50px'},children=[
-        html.Button(id='button_previous', children='Previous', style=STYLE_BUTTON),
-        html.Button(id='button_next', children='Next', style=STYLE_BUTTON),
-        dcc.Store(id='back_to_top', data=[]),
-        dcc.Store(id='store_answer', data=convert_dict_to_list(dict_answers)),
-        dcc.Store(id='store_hide', data=convert_dict_to_list(dict_hide)),
-        dcc.Store(id='store_check', data=list_check)
-    ]),
-])
 
 
-########################################################
-# The loop creates multiple callbacks that are responsible for interactive processes:
-# - update_answer(input_id): user answers a question -> answer is shown in the corresponding HTML component
-# - update_style(input_id): user answers a question with branching logic -> additional questions are shown/hidden
-
-def update_answer(input_id):
-    """
-    This function creates callback functions for answering questions
-    """
-    attribute = 'date' if get_type_component(input_id) == 'date_dmy' else 'value'
-    @app.callback([Output(input_id, 'id'),
-                   Output('row_inner_'+input_id, 'style'),
-                   Output('store_answer_'+input_id, 'data'),
-                   Output('store_hide_'+input_id, 'data')],
-                  [Input(input_id, attribute)],
-                  [State(input_id, 'id'),
-                   State('store_answer', 'data'),
-                   State('store_hide', 'data'),
-                   State('store_check', 'data')], prevent_initial_call=True)
-    def update_answer_repeated(value, field_name, list_answers, list_hide, list_check):
-        
-        # Get dictionary of answers
-        dict_answers = convert_list_to_dict(list_answers)
-        dict_hide = convert_list_to_dict(list_hide)
-        
-        # Update dictionary of answers in global variables
-        if get_date_from_value(value): # returns a string (True)
-            dict_answers[field_name] = get_date_from_value(value)
-        else: # returns False
-            dict_answers[field_name] = value
-        print(f'Dictionary updated: {field_name}')
-        print(f'Answer entered: {dict_answers[field_name]}')
-        
-        # Update dictionary in global variables
-        _, dict_hide = update_branching_logic(field_name, value, dict_hide, list_check)
-        
-        # First output triggers branching logic callback
-        # Second output is an HTML style to change border color
-        list_answers_return = convert_dict_to_list(dict_answers)
-        list_hide_return = convert_dict_to_list(dict_hide)
-        return field_name, get_style_border_from_value(value), list_answers_return, list_hide_return
+def get_layout(study):
+    """
+    Return layout of the app of a study (forms "home" and "review" are rendered, other forms are rendered when selected)
+    """
+    return html.Div(style=STYLE_LAYOUT, children=[
+        # Main dropdown to select form
+        html.Div(style={'width':'100%', 'display':'inline-block', 'verticalAlign':'top'},children=[
+            add_html_component(study, type_component='dropdown', id_component='main_dropdown', label_children='**Select form...**',
+                               value_component=VALUE_COMPONENT_MAIN, dict_options=DICT_OPTIONS_MAIN,
+                               style_left=STYLE_ROW_LEFT_MAIN, style_center=STYLE_ROW_CENTER_MAIN,
+                               style_right=STYLE_ROW_RIGHT_MAIN, style_border=STYLE_NO_BORDER)
+        ]),
+        # Contents of selected form
+        html.Div(style={'width':'100%', 'display':'inline-block', 'verticalAlign':'top'},children=[
+            html.Div(id='form_'+form, children=add_html_form(study, form, study.dict_hide) if form in LIST_FORMS_EAGER else [])
+            for form in study.list_forms
+        ]),
+        # Previous and next buttons
+        html.Div(style={'width':'100%', 'display':'inline-block', 'verticalAlign':'top', 'marginBottom':'50px'},children=[
+            html.Button(id='button_previous', children='Previous', style=STYLE_BUTTON),
+            html.Button(id='button_next', children='Next', style=STYLE_BUTTON),
+            dcc.Store(id='back_to_top', data=[]),
+            dcc.Store(id='store_rendered', data=[]),
+            dcc.Store(id='store_client', data=get_client_config(study)),
+            dcc.Store(id='store_version', data=study.version), # version of the data dictionary of the page (see study.py)
+            dcc.Store(id='store_pending', data=None),
+            dcc.Store(id='store_commit', data=None),
+            dcc.Store(id='store_saved', data=None),
+            dcc.Interval(id='interval_commit', interval=max(config_input['commit_interval'], 100),
+                         disabled=config_input['commit_interval'] <= 0 or not is_autosave(study))
+        ]),
+    ])
 
 
-def update_style(input_id, dict_hide, list_check):
+def create_app(study, server):
     """
-    This function creates callback functions for branching logic
+    Create the Dash app of a study, mounted at the prefix of the study on a shared Flask server
+    All apps share the Flask server (workers), the assets folder and the session store
     """
-    list_outputs, dict_hide = update_branching_logic(input_id, None, dict_hide, list_check)
-    
-    # Single output cannot be in a list when defining callback
-    if len(list_outputs) == 1:
-        @app.callback(Output('row_outer_'+list_outputs[0], 'style'),
-                      [Input(input_id, 'id')],
-                      [State('store_hide_'+input_id, 'data')], prevent_initial_call=True)
-        def update_style_repeated(field_name, list_hide):
-            dict_hide = convert_list_to_dict(list_hide)
-            for i in df_fields['Variable / Field Name'].values:
-                if i in list_outputs:
-                    return get_field_style(i, dict_hide)
-                
-    # Multiple outputs in a list
-    elif len(list_outputs) > 1:
-        @app.callback([Output('row_outer_'+i, 'style') for i in list_outputs],
-                      [Input(input_id, 'id')],
-                      [State('store_hide_'+input_id, 'data')], prevent_initial_call=True)
-        def update_style_repeated(field_name, list_hide):
-            dict_hide = convert_list_to_dict(list_hide)
-            list_styles = []
-            for i in df_fields['Variable / Field Name'].values:
-                if i in list_outputs:
-                    list_styles.append(get_field_style(i, dict_hide))
-            return list_styles
-        
-for i in df_fields['Variable / Field Name'].values:
-    update_answer(i)
-    update_style(i, dict_hide, list_check)
+    app = dash.Dash(__name__, server=server, url_base_pathname=study.prefix,
+                    external_stylesheets=external_stylesheets)
+    init_metrics(app, study=study.name) # callback durations and payload sizes, /metrics
+    dict_layout = {'layout': get_layout(study)} # layout of the current version of the data dictionary
 
+    def get_layout_session(session_id):
+        """
+        Layout of a new page, with a new session id (only used with a server-side session store)
+        """
+        return html.Div(children=[dcc.Store(id='store_session', data=session_id), dict_layout['layout']])
 
-########################################################
-# These callbacks are standard callbacks:
-# - render_content(form, options): show selected form, show previous/next buttons
-# - update_patient_code(code):
-# - update_visit_day(day):
-# - update_review(style): update data table contents when review form is shown
-# - on_click_button_previous_next(): both Dash + JavaScript!
-    
-@app.callback([Output('form_'+tab, 'style') for tab in df_forms['Form Name'].values] + [Output('button_previous','style')] + [Output('button_next','style')] + [Output('button_next','children')],
-              [Input('main_dropdown', 'value'),
-               Input('main_dropdown', 'options')])
-def render_content(form, options):
-    """
-    This callback is called when user clicks on any tab
-    Shows questions associated with the clicked tab and hides the other questions
-    """
-        
-    # Styles for different forms (only one form to show)
-    list_styles = []
-    for i in df_forms['Form Name'].values:
-        list_styles.append(STYLE_VISIBLE if form==i else STYLE_HIDDEN)
-    
-    # Styles for previous/next buttons
-    style_previous = STYLE_BUTTON
-    style_next = STYLE_BUTTON
-    if form is None or form == options[0]['value']:
-        style_previous = STYLE_HIDDEN
-    if form is None or len(options) == 1:
-        style_next = STYLE_HIDDEN
-    list_styles.append(style_previous)
-    list_styles.append(style_next)
-    
-    # Children (text/label) for next button
-    button_children = 'Submit' if form == options[-1]['value'] else 'Next'
-    list_styles.append(button_children)
-    
-    return list_styles
-
-
-@app.callback(Output('store_answer','data'),
-              [Input('store_answer_'+i, 'data') for i in list(df_fields['Variable / Field Name'].values)],
-              prevent_initial_call=True)
-def update_store_answer(*args):
-    ctx = dash.callback_context
-    trigger = ctx.triggered[0]['prop_id'].split('.')[0].split('store_answer_')[-1]
-    print(trigger)
-    idx_trigger = list(df_fields['Variable / Field Name'].values).index(trigger)
-    print(args[idx_trigger])
-    return args[idx_trigger]
-
-
-@app.callback(Output('store_hide','data'),
-              [Input('store_hide_'+i, 'data') for i in list(df_fields['Variable / Field Name'].values)],
-              prevent_initial_call=True)
-def update_store_hide(*args):
-    ctx = dash.callback_context
-    trigger = ctx.triggered[0]['prop_id'].split('.')[0].split('store_hide_')[-1]
-    idx_trigger = list(df_fields['Variable / Field Name'].values).index(trigger)
-    print(args[idx_trigger])
-    return args[idx_trigger]
-
-
-@app.callback(Output('row_inner_home_patient_code','style'),
-              [Input('home_patient_code', 'value')], prevent_initial_call=True)
-def update_patient_code(code):
-    if code is None:
-        return STYLE_BORDER_RED
-    else:
-        return STYLE_BORDER_GREEN
-    
-    
-@app.callback([Output('form_'+tab, 'children') for tab in list(df_forms['Form Name'].values)[1:]] + [Output('main_dropdown', 'options')] + [Output('row_inner_home_visit_day','style')] + [Output('store_answer_home_visit_day','data')] + [Output('store_hide_home_visit_day','data')],
-              [Input('home_visit_day', 'value')],
-              [State('store_answer', 'data'),
-               State('store_hide', 'data')], prevent_initial_call=True)
-def update_visit_day(day, list_answers, list_hide):
-    """
-    This callback is called when user changes the value of "Day of visit (1-7)"
-    CDAI questionnaire has to be different between days 1-6 and day 7
-    Other questionnaires are only answered on day 7
-    Outputs:
-        - options in main dropdown
-        - border color of row of "visit day"
-    """
-    
-    # Reset global variables and form contents
-    dict_answers = convert_list_to_dict(list_answers)
-    dict_hide = convert_list_to_dict(list_hide)
-    dict_answers, dict_hide = reset_dictionaries(dict_answers, dict_hide)
-    
-    # First list of outputs
-    list_return = [add_html_form(form, dict_answers, dict_hide) for form in list(df_forms['Form Name'].values)[1:]]
-    
-    # Given selected day, get the following info:
-    # - list of forms to display (as options in dropdown)
-    # - border color to tell if selected day is within limits (1-7)
-    dict_dropdown = {}
-    if day is None: # No value or value outside limits (day 1-7)
-        for form in df_forms['Form Name'].values:
-            if form in ['home']:
-                dict_dropdown[form] = form.upper()
-        row_style = STYLE_BORDER_RED
+    def serve_layout():
+        return get_layout_session(get_session_id())
+
+    app.layout = dict_layout['layout'] if session_store is None else serve_layout
+    register_callbacks(app, study)
+    # Layout and dependencies are serialized and compressed once (a new session id is inserted for each page)
+    if session_store is None:
+        routes = init_compression(app, dict_layout['layout'], **config_compression)
     else:
-        for form in df_forms['Form Name'].values:
-            if day == 7: # Day 7: show all forms except "daily" forms
-                if '_d' not in form:
-                    dict_dropdown[form] = form.upper()
-            else: # Days 1-6: show only "daily" forms + home + review
-                if f'_d{day}' in form or form in ['home','review']:
-                    dict_dropdown[form] = form.upper()
-        row_style = STYLE_BORDER_GREEN
-    list_options = [{'label':dict_dropdown[i], 'value':i} for i in dict_dropdown]
-    
-    # Append additional outputs
-    list_return.append(list_options)
-    list_return.append(row_style)
-    list_return.append(convert_dict_to_list(dict_answers))
-    list_return.append(convert_dict_to_list(dict_hide))
-    return list_return
-
-
-@app.callback([Output('review_table', 'data'),
-               Output('review_table', 'columns')],
-              [Input('form_review', 'style')],
-              [State('store_answer', 'data'),
-               State('store_hide', 'data')], prevent_initial_call=True)
-def update_review(style, list_answers, list_hide):
-    """
-    This callback is called when user clicks on the "review" tab
-    Updates the DataTable object to display
-    """
-    # Convert list to dict
-    dict_answers = convert_list_to_dict(list_answers)
-    dict_hide = convert_list_to_dict(list_hide)
-    
-    # Generate datatable
-    df = pd.DataFrame(columns=['Question','Answer','Field Name','Value'])
-    dict_answers_final = get_dict_answers_final(dict_answers, dict_hide)
-    for i in range(len(dict_answers_final)):
-        key = list(dict_answers_final.keys())[i]
-        df.loc[i] = [get_question_from_key(key),
-                     get_choice_label_from_value(key,dict_answers_final[key]),
-                     key,
-                     dict_answers_final[key]]
-    data = df.to_dict('records')
-    columns=[{"name": str(i), "id": str(i)} for i in df.columns]
-    return data, columns
-
-
-@app.callback([Output('main_dropdown', 'value'),
-               Output('label_submit', 'children')],
-              [Input('button_previous','n_clicks'),
-               Input('button_next','n_clicks')],
-              [State('button_next','children'),
-               State('main_dropdown', 'value'),
-               State('main_dropdown', 'options'),
-               State('home_patient_code', 'value'),
-               State('store_answer', 'data'),
-               State('store_hide', 'data')], prevent_initial_call=True)
-def on_click_button_previous_next(n_clicks_previous, n_clicks_next, id_next,
-                                  value, options, patient_code, list_answers, list_hide):
-    """
-    Modify value of main dropdown, which in turn shows the corresponding form
-    """
-    # Convert list to dict
-    dict_answers = convert_list_to_dict(list_answers)
-    dict_hide = convert_list_to_dict(list_hide)
-    
-    # Determine current index of form (among available options)
-    list_values = [options[i]['value'] for i in range(len(options))]
-    idx_current = list_values.index(value)
-    
-    # Determine which Input has fired the callback
-    ctx = dash.callback_context
-    trigger = ctx.triggered[0]['prop_id'].split('.')[0]
-    if trigger == 'button_previous':
-        dropdown_value = list_values[idx_current-1]
-        output_label = ''
-    elif trigger == 'button_next':
-        if id_next == 'Submit':
-            output_label = send_record_to_redcap(patient_code, dict_answers, dict_hide)
-            dropdown_value = value
+        routes = init_compression(app, get_layout_session(SESSION_PLACEHOLDER), placeholder=SESSION_PLACEHOLDER,
+                                  get_value=get_session_id, **config_compression)
+
+    def update_layout():
+        """
+        Layout of new pages, when a new version of the data dictionary is loaded (see metadata.py)
+        Callbacks do not change: they read the version of the page of each session
+        """
+        dict_layout['layout'] = get_layout(study.get_version())
+        if session_store is None:
+            app.layout = dict_layout['layout']
+        if routes is not None:
+            routes.update(dict_layout['layout'] if session_store is None else get_layout_session(SESSION_PLACEHOLDER))
+
+    study.list_reload_hooks.append(update_layout)
+    server.before_request(MetadataSync(study, **config_metadata).start) # hot reload (thread started in each worker)
+    return app
+
+
+def register_callbacks(app, study):
+    """
+    Register callbacks of the app of a study (callbacks read the data dictionary of the study)
+    """
+
+    ########################################################
+    # Pattern-matching callbacks serve all fields of the data dictionary (number of callbacks does not depend on fields)
+    # Visual feedback is computed in the browser (assets/delectable.js), only answers to save are sent to the server:
+    # - copy date of date pickers to the hidden value of the same row (client side, MATCH)
+    # - update_answer(value): user answers a question -> border color (validation) and answer store of the same row (client side, MATCH)
+    # - copy answer of fields used in branching logic or equations to their source store (client side, MATCH)
+    # - update_calc(answers): user answers a question used in equations -> values of affected calc fields (client side, ALL)
+    # - update_style(answers): user answers a question with branching logic -> additional questions are shown/hidden (client side, ALL)
+    # - batch_answers(answers, interval): answers that have changed -> pending answers, sent in one batch after an idle time
+    #   (client side, ALL), if answers are autosaved
+    # - save_answers(commit): batch of answers -> draft of the patient and session store (server side)
+    # Callbacks do not depend on the data dictionary, so that a new version can be loaded without registering callbacks
+    # (update_calc has no outputs if there is no calc field, batch_answers does nothing if answers are not autosaved)
+
+    app.clientside_callback(
+        """
+        function(date) {
+        return date;
+        }
+        """,
+        Output({'type':'field', 'name':MATCH}, 'value'),
+        Input({'type':'field_date', 'name':MATCH}, 'date'),
+        prevent_initial_call=True
+    )
+
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='delectable', function_name='update_answer'),
+        [Output({'type':'row_inner', 'name':MATCH}, 'style'),
+         Output({'type':'row_inner', 'name':MATCH}, 'title'),
+         Output({'type':'store_answer', 'name':MATCH}, 'data')],
+        [Input({'type':'field', 'name':MATCH}, 'value')],
+        [State('store_client', 'data')],
+        prevent_initial_call=True
+    )
+
+
+    app.clientside_callback(
+        """
+        function(answer) {
+        return answer;
+        }
+        """,
+        Output({'type':'store_source', 'name':MATCH}, 'data'),
+        Input({'type':'store_answer', 'name':MATCH}, 'data'),
+        prevent_initial_call=True
+    )
+
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='delectable', function_name='update_calc'),
+        Output({'type':'calc', 'name':ALL}, 'value'),
+        [Input({'type':'store_source', 'name':ALL}, 'data')],
+        [State({'type':'calc', 'name':ALL}, 'value'),
+         State('store_client', 'data')],
+        prevent_initial_call=True
+    )
+
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='delectable', function_name='update_style'),
+        Output({'type':'row_logic', 'name':ALL}, 'style'),
+        [Input({'type':'store_source', 'name':ALL}, 'data'),
+         Input({'type':'calc', 'name':ALL}, 'value')],
+        [State({'type':'row_logic', 'name':ALL}, 'id'),
+         State('store_client', 'data')],
+        prevent_initial_call=True
+    )
+
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='delectable', function_name='batch_answers'),
+        [Output('store_pending', 'data'),
+         Output('store_commit', 'data')],
+        [Input({'type':'store_answer', 'name':ALL}, 'data'),
+         Input('interval_commit', 'n_intervals'),
+         Input('home_patient_code', 'value'),
+         Input('home_visit_day', 'value'),
+         Input('store_submission', 'data')],
+        [State('store_pending', 'data'),
+         State('store_client', 'data')],
+        prevent_initial_call=True
+    )
+
+
+    @app.callback(Output('store_saved', 'data'),
+                  [Input('store_commit', 'data')],
+                  [State('home_visit_day', 'value'),
+                   State('store_version', 'data')] + LIST_STATES_SESSION, prevent_initial_call=True)
+    def save_answers(commit, day_current, version, session_id=None):
+        """
+        Batch of answers entered in the browser is appended to the draft of the patient (autosave), and saved in the session store (if any)
+        A batch has the patient code and visit day of its answers, answers of a previous day are not saved in the session
+        Output is the number of answers saved
+        """
+        if not commit or not commit['answers']:
+            raise dash.exceptions.PreventUpdate
+        study_version = study.get_version(version)
+        dict_batch = {k: v for k, v in commit['answers'].items() if k in study_version.dict_fields}
+        patient_code, day = commit['patient_code'], commit['day']
+        if logger.isEnabledFor(logging.DEBUG): # hot path: nothing is formatted if debug messages are disabled
+            logger.debug('Answers entered: %s', dict_batch)
+        if study.draft_store is not None and patient_code is not None and day is not None:
+            study.draft_store.append(patient_code, day, dict_batch)
+        if session_store is not None and session_id is not None and day == day_current:
+            session_store.update(session_id, dict_batch)
+        return len(dict_batch)
+
+
+    ########################################################
+    # These callbacks are standard callbacks:
+    # - render_content(form, options): show selected form, show previous/next buttons
+    # - render_form(form, day): add components of selected form the first time it is selected
+    # - update_patient_code(code): border color (client side)
+    # - update_visit_day(day):
+    # - update_review(style): update data table contents when review form is shown
+    # - on_click_button_previous_next(): both Dash + JavaScript!
+    # - update_submission_status(submission_id): show result of submission sent in background
+
+    @app.callback([Output('form_'+tab, 'style') for tab in study.list_forms] + [Output('button_previous','style')] + [Output('button_next','style')] + [Output('button_next','children')],
+                  [Input('main_dropdown', 'value'),
+                   Input('main_dropdown', 'options')])
+    def render_content(form, options):
+        """
+        This callback is called when user clicks on any tab
+        Shows questions associated with the clicked tab and hides the other questions
+        """
+
+        # Styles for different forms (only one form to show)
+        list_styles = []
+        for i in study.list_forms:
+            list_styles.append(STYLE_VISIBLE if form==i else STYLE_HIDDEN)
+
+        # Styles for previous/next buttons
+        style_previous = STYLE_BUTTON
+        style_next = STYLE_BUTTON
+        if form is None or form == options[0]['value']:
+            style_previous = STYLE_HIDDEN
+        if form is None or len(options) == 1:
+            style_next = STYLE_HIDDEN
+        list_styles.append(style_previous)
+        list_styles.append(style_next)
+
+        # Children (text/label) for next button
+        button_children = 'Submit' if form == options[-1]['value'] else 'Next'
+        list_styles.append(button_children)
+
+        return list_styles
+
+
+    @app.callback([Output('form_'+form, 'children') for form in study.list_forms_lazy] + [Output('store_rendered', 'data')],
+                  [Input('main_dropdown', 'value'),
+                   Input('home_visit_day', 'value')],
+                  [State('store_rendered', 'data'),
+                   STATE_RECORD,
+                   State('home_patient_code', 'value'),
+                   State('store_version', 'data')] + LIST_STATES_PENDING, prevent_initial_call=True)
+    def render_form(form, day, list_rendered, record, patient_code, version, pending=None):
+        """
+        This callback is called when user selects a form or changes the visit day
+        Components of a form are only sent to the browser the first time the form is selected
+        (a template of the form rendered once, patched with the branching logic and draft of the session)
+        Changing the visit day removes the forms already rendered (answers are reset)
+        Answers saved in the draft of the patient and day are restored (e.g. after the page has been refreshed),
+        calc fields of the form show the values computed from the record
+        Forms are rendered with the version of the data dictionary of the page
+        """
+        study_version = study.get_version(version)
+        dict_children = {}
+        dict_answers = get_dict_answers(study_version.dict_fields)
+
+        # Visit day has changed: remove forms already rendered (and answers saved in session)
+        ctx = dash.callback_context
+        if ctx.triggered[0]['prop_id'] == 'home_visit_day.value':
+            for i in list_rendered:
+                dict_children[i] = []
+            list_rendered = []
+            if session_store is not None and record is not None:
+                session_store.reset(record)
         else:
-            dropdown_value = list_values[idx_current+1]
+            dict_answers = get_answers_from_record(study_version, ctx.states_list[1], pending)
+
+        # Render selected form (only if it is available for selected day)
+        if form in study_version.list_forms_lazy and form not in list_rendered and study_version.schedule.is_available(form, day):
+            dict_draft = {}
+            if study.draft_store is not None and patient_code is not None:
+                dict_draft = {k: v for k, v in study.draft_store.load(patient_code, day).items()
+                              if k in dict_answers and dict_answers[k] is None}
+                dict_answers.update(dict_draft)
+                dict_answers.update(study_version.calculations.get_values(dict_answers))
+            dict_hide_current = study_version.branching_logic.get_dict_hide(dict_answers, study_version.dict_fields)
+            dict_draft_form = {field.name: dict_draft[field.name] for field in study_version.dict_form_fields.get(form, ()) if field.name in dict_draft}
+            dict_calc_form = {field.name: dict_answers[field.name] for field in study_version.dict_form_fields.get(form, ()) if field.name in study_version.calculations.dict_rank}
+            dict_children[form] = get_form_template(study_version, form).render(dict_hide_current, {**dict_draft_form, **dict_calc_form})
+            if dict_draft_form and session_store is not None and record is not None:
+                session_store.update(record, dict_draft_form)
+            list_rendered = list_rendered + [form]
+
+        if not dict_children:
+            raise dash.exceptions.PreventUpdate
+        return [dict_children.get(i, dash.no_update) for i in study.list_forms_lazy] + [list_rendered]
+
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='delectable', function_name='update_border'),
+        Output('row_inner_home_patient_code','style'),
+        [Input('home_patient_code', 'value')],
+        [State('store_client', 'data')],
+        prevent_initial_call=True
+    )
+
+
+    @app.callback([Output('main_dropdown', 'options')] + [Output('row_inner_home_visit_day','style')],
+                  [Input('home_visit_day', 'value')], prevent_initial_call=True)
+    def update_visit_day(day):
+        """
+        This callback is called when user changes the value of "Day of visit"
+        Forms available on each day are given by the schedule (e.g. CDAI questionnaire is different between days 1-6 and day 7)
+        Outputs:
+            - options in main dropdown
+            - border color of row of "visit day"
+        """
+
+        # Given selected day, get the following info:
+        # - list of forms to display (as options in dropdown), precompiled in the schedule
+        # - border color to tell if selected day is within limits (1-n_days)
+        # Form contents are reset by render_form()
+        list_options = study.schedule.get_options(day)
+        row_style = STYLE_BORDER_RED if day is None else STYLE_BORDER_GREEN
+        return list_options, row_style
+
+
+    @app.callback([Output('review_table', 'data'),
+                   Output('review_table', 'columns')],
+                  [Input('form_review', 'style')],
+                  [STATE_RECORD,
+                   State('store_version', 'data')] + LIST_STATES_PENDING, prevent_initial_call=True)
+    def update_review(style, record, version, pending=None):
+        """
+        This callback is called when user clicks on the "review" tab
+        Updates the DataTable object to display
+        """
+        # Rebuild full record from answer stores (or session store)
+        study_version = study.get_version(version)
+        dict_answers, dict_hide = get_dictionaries_from_stores(study_version, dash.callback_context.states_list[0], pending)
+
+        # Generate datatable (one pass over answers, labels are precomputed)
+        data = study_version.review_table.get_records(get_dict_answers_final(dict_answers, dict_hide))
+        columns = study_version.review_table.columns
+        return data, columns
+
+
+    @app.callback([Output('main_dropdown', 'value'),
+                   Output('label_submit', 'children'),
+                   Output('store_submission', 'data')],
+                  [Input('button_previous','n_clicks'),
+                   Input('button_next','n_clicks')],
+                  [State('button_next','children'),
+                   State('main_dropdown', 'value'),
+                   State('home_patient_code', 'value'),
+                   State('home_visit_day', 'value'),
+                   STATE_RECORD,
+                   State('store_version', 'data')] + LIST_STATES_PENDING, prevent_initial_call=True)
+    def on_click_button_previous_next(n_clicks_previous, n_clicks_next, id_next,
+                                      value, patient_code, day, record, version, pending=None):
+        """
+        Modify value of main dropdown, which in turn shows the corresponding form
+        Previous/next forms are taken from the schedule of the selected day
+        """
+        # Determine which Input has fired the callback
+        ctx = dash.callback_context
+        trigger = ctx.triggered[0]['prop_id'].split('.')[0]
+        submission_id = None
+        if trigger == 'button_previous':
+            dropdown_value = study.schedule.get_next_form(value, day, -1)
             output_label = ''
-    return dropdown_value, output_label
+        elif trigger == 'button_next':
+            if id_next == 'Submit': # record is checked with the version of the data dictionary of the page
+                study_version = study.get_version(version)
+                dict_answers, dict_hide = get_dictionaries_from_stores(study_version, ctx.states_list[4], pending)
+                dict_errors = study_version.validator.get_errors(dict_answers, dict_hide, study_version.get_fields(day))
+                if dict_errors and patient_code is not None: # record is not sent (Redcap would reject it)
+                    output_label = get_html_errors(study_version, dict_errors)
+                else:
+                    output_label, submission_id = send_record_to_redcap(study, patient_code, dict_answers, dict_hide)
+                if submission_id is not None and study.draft_store is not None: # record is saved in outbox
+                    study.draft_store.delete(patient_code, day)
+                dropdown_value = value
+            else:
+                dropdown_value = study.schedule.get_next_form(value, day, 1)
+                output_label = ''
+        return dropdown_value, output_label, submission_id
+
+
+    @app.callback([Output('label_submission_status', 'children'),
+                   Output('interval_submission', 'disabled')],
+                  [Input('store_submission', 'data'),
+                   Input('interval_submission', 'n_intervals')], prevent_initial_call=True)
+    def update_submission_status(submission_id, n_intervals):
+        """
+        This callback is called when a record has been saved in the outbox, then at regular intervals until Redcap has answered
+        The outbox is shared by all workers, so any worker can answer
+        """
+        if submission_id is None:
+            return '', True
+        status = study.outbox.get_status(submission_id)
+        if status is None: # outbox has been deleted, or records delivered to Redcap have been purged
+            return 'Status of submission is not available', True
+        return status['message'], status['status'] != 'pending'
+
+
+    # This clientside callback is called when clicking on Previous or Next
+    # Scroll back to top (can be done only with JavaScript)
+    app.clientside_callback(
+        """
+        function(n_clicks_previous, n_clicks_next) {
+        document.body.scrollTop = 0; // For Safari
+        document.documentElement.scrollTop = 0; // For Chrome, Firefox, IE and Opera
+        return "";
+        }
+        """,
+        Output('back_to_top', 'data'), # Callback needs an output, so this is dummy
+        Input('button_previous', 'n_clicks'), # This triggers the Javascript callback
+        Input('button_next', 'n_clicks'), # This also triggers the Javascript callback
+        prevent_initial_call=True
+    )
 
 
-# This clientside callback is called when clicking on Previous or Next
-# Scroll back to top (can be done only with JavaScript)
-app.clientside_callback(
-    """
-    function(n_clicks_previous, n_clicks_next) {
-    document.body.scrollTop = 0; // For Safari
-    document.documentElement.scrollTop = 0; // For Chrome, Firefox, IE and Opera
-    return "";
-    }
-    """,
-    Output('back_to_top', 'data'), # Callback needs an output, so this is dummy
-    Input('button_previous', 'n_clicks'), # This triggers the Javascript callback
-    Input('button_next', 'n_clicks'), # This also triggers the Javascript callback
-    prevent_initial_call=True
-)
+########################################################
+# One Dash app per study, all mounted on the same Flask server (gunicorn app:server)
+server = flask.Flask(__name__)
+list_studies = [Study(**config) for config in get_studies_from_env()]
+list_apps = [create_app(study, server) for study in list_studies]
+study = list_studies[0] # first study (e.g. for scripts and benchmarks that serve one study)
+app = list_apps[0]
+
+
+def prepare_workers():
+    """
+    Build in the gunicorn master what each worker would build after it is forked (see gunicorn.conf.py):
+    templates of all forms and setup of the Dash apps (first request), so that workers share them.
+    Connections that cannot be shared by processes are closed (workers open their own)
+    """
+    for study_i in list_studies:
+        for form in study_i.list_forms_lazy:
+            get_form_template(study_i, form)
+        study_i.outbox.disconnect()
+    server.try_trigger_before_first_request_functions()
+
+if all(study_i.prefix != '/' for study_i in list_studies):
+    @server.route('/')
+    def serve_index():
+        """
+        List of studies, when no study is mounted at "/"
+        """
+        items = ''.join(f'<li><a href="{flask.escape(s.prefix)}">{flask.escape(s.name)}</a></li>' for s in list_studies)
+        return f'<html><body><h3>Studies</h3><ul>{items}</ul></body></html>'
 
 
 ########################################################
@@ -0,0 +1,378 @@
+/*
+Clientside callbacks of the app (visual feedback without request to the server)
+
+- update_answer: border color of a row (red if answer is empty or invalid, with
+  the error message as title) and answer store, when a field changes
+- update_border: border color of a row (e.g. patient code)
+- batch_answers: answers that have changed, sent to the server (autosave) in
+  one batch when the respondent has not answered anything for commit_interval ms
+- update_calc: values of calc fields, when a field used in their equations changes
+- update_style: show/hide rows with branching logic, when source fields change
+
+Branching logic is compiled by branching.py and sent once in the layout
+(store "store_client"). Evaluation follows branching.py: answers are compared
+as strings, or as numbers if both sides are numbers, and answers of hidden
+fields count as empty. Equations of calc fields (calculations.py) use the same
+ASTs, with arithmetic and functions as in branching.py. Validation rules are
+compiled by validation.py and sent in the same store, checks follow validation.py.
+*/
+
+window.dash_clientside = window.dash_clientside || {};
+
+(function() {
+
+    var REGEX_DATE = /^(\d{4})-(\d{1,2})-(\d{1,2})$/;
+    var REGEX_NUMBER = /^[-+]?(\d+(\.\d*)?|\.\d+)$/;
+    var dictRegex = {}; // regex of validation rules, compiled once
+
+    function isEmpty(value) {
+        return value === null || value === undefined;
+    }
+
+    function getAnswer(value) {
+        // Dates are normalized to YYYY-MM-DD, other answers are kept as entered
+        var match = typeof value === 'string' ? REGEX_DATE.exec(value) : null;
+        if (match) {
+            return match[1] + '-' + ('0' + match[2]).slice(-2) + '-' + ('0' + match[3]).slice(-2);
+        }
+        return value;
+    }
+
+    function getBorderStyle(value, config) {
+        return isEmpty(value) ? config.style_border_empty : config.style_border_answered;
+    }
+
+    function getName(propId) {
+        // Name of a pattern-matching id, e.g. '{"name":"cho_1","type":"store_answer"}.data' (null for other ids)
+        if (!propId || propId.charAt(0) !== '{') {
+            return null;
+        }
+        return JSON.parse(propId.slice(0, propId.lastIndexOf('.'))).name;
+    }
+
+    /* Branching logic (same rules as branching.py) */
+
+    function getStringFromAnswer(value, code) {
+        if (!isEmpty(code)) {
+            return !isEmpty(value) && [].concat(value).map(String).indexOf(code) >= 0 ? '1' : '0';
+        }
+        if (isEmpty(value)) {
+            return '';
+        }
+        return String(value);
+    }
+
+    function getNumberFromString(string) {
+        var trimmed = String(string).trim();
+        if (trimmed === '') {
+            return null;
+        }
+        var number = Number(trimmed);
+        return isNaN(number) ? null : number;
+    }
+
+    function compare(operator, left, right) {
+        var numberLeft = getNumberFromString(left);
+        var numberRight = getNumberFromString(right);
+        if (numberLeft !== null && numberRight !== null) {
+            left = numberLeft;
+            right = numberRight;
+        } else if (['>', '<', '>=', '<='].indexOf(operator) >= 0 && (left === '' || right === '')) {
+            return false;
+        }
+        switch (operator) {
+            case '=': return left === right;
+            case '<>': return left !== right;
+            case '>': return left > right;
+            case '<': return left < right;
+            case '>=': return left >= right;
+            default: return left <= right;
+        }
+    }
+
+    function getNumber(value) {
+        var number = typeof value === 'boolean' ? Number(value) : getNumberFromString(value);
+        return number !== null && isFinite(number) ? number : null;
+    }
+
+    function getStringFromNumber(number) {
+        return number === null || !isFinite(number) ? '' : String(number);
+    }
+
+    function calculate(operator, left, right) {
+        var numberLeft = getNumber(left);
+        var numberRight = getNumber(right);
+        if (numberLeft === null || numberRight === null) {
+            return '';
+        }
+        switch (operator) {
+            case '+': return getStringFromNumber(numberLeft + numberRight);
+            case '-': return getStringFromNumber(numberLeft - numberRight);
+            case '*': return getStringFromNumber(numberLeft * numberRight);
+            case '/': return getStringFromNumber(numberLeft / numberRight);
+            default: return getStringFromNumber(Math.pow(numberLeft, numberRight));
+        }
+    }
+
+    function roundNumber(name, number, digits) {
+        var factor = Math.pow(10, digits);
+        var sign = number < 0 ? -1 : 1;
+        if (name === 'round') {
+            return sign * Math.floor(Math.abs(number) * factor + 0.5) / factor;
+        }
+        if (name === 'roundup') {
+            return sign * Math.ceil(Math.abs(number) * factor) / factor;
+        }
+        return sign * Math.floor(Math.abs(number) * factor) / factor;
+    }
+
+    function callFunction(name, listValues) {
+        if (name === 'if') {
+            return listValues[0] ? listValues[1] : listValues[2];
+        }
+        var listNumbers = listValues.map(getNumber).filter(function(number) { return number !== null; });
+        if (['sum', 'mean', 'min', 'max'].indexOf(name) >= 0) {
+            if (!listNumbers.length) {
+                return '';
+            }
+            var total = listNumbers.reduce(function(a, b) { return a + b; }, 0);
+            switch (name) {
+                case 'sum': return getStringFromNumber(total);
+                case 'mean': return getStringFromNumber(total / listNumbers.length);
+                case 'min': return getStringFromNumber(Math.min.apply(null, listNumbers));
+                default: return getStringFromNumber(Math.max.apply(null, listNumbers));
+            }
+        }
+        var number = getNumber(listValues[0]);
+        if (number === null) {
+            return '';
+        }
+        if (name === 'abs') {
+            return getStringFromNumber(Math.abs(number));
+        }
+        if (name === 'sqrt') {
+            return number >= 0 ? getStringFromNumber(Math.sqrt(number)) : '';
+        }
+        var digits = listValues.length > 1 ? getNumber(listValues[1]) : 0;
+        return digits === null ? '' : getStringFromNumber(roundNumber(name, number, Math.trunc(digits)));
+    }
+
+    function evaluate(node, getValue) {
+        switch (node[0]) {
+            case 'literal': return node[1];
+            case 'field': return getStringFromAnswer(getValue(node[1]), node[2]);
+            case 'not': return !evaluate(node[1], getValue);
+            case 'and': return Boolean(evaluate(node[1], getValue)) && Boolean(evaluate(node[2], getValue));
+            case 'or': return Boolean(evaluate(node[1], getValue)) || Boolean(evaluate(node[2], getValue));
+            case 'cmp': return compare(node[1], evaluate(node[2], getValue), evaluate(node[3], getValue));
+            case 'arith': return calculate(node[1], evaluate(node[2], getValue), evaluate(node[3], getValue));
+            case 'neg': return calculate('-', '0', evaluate(node[1], getValue));
+            case 'call': return callFunction(node[1], node[2].map(function(child) { return evaluate(child, getValue); }));
+        }
+        throw new Error('Unknown node ' + node[0]);
+    }
+
+    function getHideDelta(rules, listTriggers, answers) {
+        // Fields to evaluate for a trigger include the fields they depend on: each trigger is evaluated on its own
+        var delta = {};
+        listTriggers.forEach(function(trigger) {
+            var hide = {};
+            var getValue = function(name) {
+                return hide[name] ? null : answers[name];
+            };
+            (rules.evaluation[trigger] || []).forEach(function(name) {
+                var condition = rules.conditions[name];
+                hide[name] = condition ? !evaluate(condition, getValue) : false;
+            });
+            (rules.affected[trigger] || []).forEach(function(name) {
+                delta[name] = hide[name];
+            });
+        });
+        return delta;
+    }
+
+    /* Calc fields (same rules as calculations.py) */
+
+    function getCalcDelta(calculations, listTriggers, answers) {
+        // Calc fields of forms that are not rendered are computed when an equation needs them
+        var getValue = function(name) {
+            if (!(name in answers) && name in calculations.equations) {
+                answers[name] = null;
+                answers[name] = getNumber(evaluate(calculations.equations[name], getValue));
+            }
+            return answers[name];
+        };
+        var delta = {};
+        listTriggers.forEach(function(trigger) {
+            (calculations.affected[trigger] || []).forEach(function(name) {
+                answers[name] = delta[name] = getNumber(evaluate(calculations.equations[name], getValue));
+            });
+        });
+        return delta;
+    }
+
+    /* Validation (same rules as validation.py) */
+
+    function isBlank(value) {
+        return isEmpty(value) || value === '' || (Array.isArray(value) && value.length === 0);
+    }
+
+    function pad(number) {
+        return ('0' + number).slice(-2);
+    }
+
+    function getBoundValue(bound, compare) {
+        var now = new Date();
+        var date = now.getFullYear() + '-' + pad(now.getMonth() + 1) + '-' + pad(now.getDate());
+        var time = pad(now.getHours()) + ':' + pad(now.getMinutes());
+        if (bound === 'today') {
+            return date;
+        }
+        if (bound === 'now') {
+            return compare === 'string' ? time : date + ' ' + time;
+        }
+        return bound;
+    }
+
+    function isBelow(compare, value, bound) {
+        return compare === 'number' ? Number(value) < Number(bound) : value < bound;
+    }
+
+    function checkRule(rule, value, messages) {
+        if (isBlank(value)) {
+            return rule.required ? messages.required : null;
+        }
+        if (rule.choices) {
+            var listValues = rule.multiple && Array.isArray(value) ? value : [value];
+            var isValid = listValues.every(function(item) {
+                return rule.choices.indexOf(String(item)) >= 0;
+            });
+            return isValid ? null : messages.choice;
+        }
+        var string = getStringFromAnswer(value);
+        if (rule.regex) {
+            dictRegex[rule.regex] = dictRegex[rule.regex] || new RegExp(rule.regex);
+            if (!dictRegex[rule.regex].test(string)) {
+                return rule.message;
+            }
+        }
+        if (!rule.compare) {
+            return null;
+        }
+        if (rule.compare === 'number' && !REGEX_NUMBER.test(string)) {
+            return messages.number;
+        }
+        if ('min' in rule && isBelow(rule.compare, string, getBoundValue(rule.min, rule.compare))) {
+            return messages.min.replace('{}', rule.min);
+        }
+        if ('max' in rule && isBelow(rule.compare, getBoundValue(rule.max, rule.compare), string)) {
+            return messages.max.replace('{}', rule.max);
+        }
+        return null;
+    }
+
+    function checkAnswer(validation, name, value) {
+        var rule = validation.fields[name];
+        return rule ? checkRule(rule, value, validation.messages) : null;
+    }
+
+    /* Callbacks */
+
+    window.dash_clientside.delectable = {
+
+        update_answer: function(value, config) {
+            var ctx = window.dash_clientside.callback_context;
+            var answer = getAnswer(value);
+            var message = checkAnswer(config.validation, ctx.inputs_list[0].id.name, answer);
+            var style = message === null ? getBorderStyle(value, config) : config.style_border_invalid;
+            return [style, message === null ? '' : message, answer];
+        },
+
+        update_border: function(value, config) {
+            return getBorderStyle(value, config);
+        },
+
+        batch_answers: function(listAnswers, nIntervals, patientCode, day, submissionId, pending, config) {
+            // Outputs: pending answers (kept in browser), batch of answers sent to the server (store "store_commit")
+            var ctx = window.dash_clientside.callback_context;
+            var noUpdate = window.dash_clientside.no_update;
+            if (!config.autosave) {
+                // No draft store and no session store: answers are only sent when the record is submitted
+                return [noUpdate, noUpdate];
+            }
+            var now = Date.now();
+            var listNames = ctx.triggered.map(function(item) { return getName(item.prop_id); })
+                                          .filter(function(name) { return name !== null; });
+            var listPropIds = ctx.triggered.map(function(item) { return item.prop_id; });
+            var commit = null;
+            var isChanged = false;
+            if (listPropIds.indexOf('store_submission.data') >= 0 && !isEmpty(submissionId)) {
+                // Record has been submitted (and draft deleted): pending answers are not saved
+                return [null, noUpdate];
+            }
+            if (pending && (pending.patient_code !== patientCode || pending.day !== day)) {
+                // Answers of another patient or day are sent at once
+                commit = pending;
+                pending = null;
+                isChanged = true;
+            }
+            if (listNames.length) {
+                var answers = Object.assign({}, pending ? pending.answers : {});
+                ctx.inputs_list[0].forEach(function(item) {
+                    if (listNames.indexOf(item.id.name) >= 0) {
+                        answers[item.id.name] = isEmpty(item.value) ? null : item.value;
+                    }
+                });
+                pending = {answers: answers, patient_code: patientCode, day: day, time: now};
+                isChanged = true;
+            }
+            if (commit === null && pending && now - pending.time >= config.commit_interval) {
+                commit = pending;
+                pending = null;
+                isChanged = true;
+            }
+            return [isChanged ? pending : noUpdate, commit === null ? noUpdate : commit];
+        },
+
+        update_calc: function(listSources, listValues, config) {
+            // Outputs are given by the state of calc values (same pattern, same order as outputs)
+            var ctx = window.dash_clientside.callback_context;
+            var noUpdate = window.dash_clientside.no_update;
+            var answers = {};
+            ctx.inputs_list[0].concat(ctx.states_list[0]).forEach(function(item) {
+                answers[item.id.name] = isEmpty(item.value) ? null : item.value;
+            });
+            var listTriggers = ctx.triggered.map(function(item) { return getName(item.prop_id); });
+            var delta = getCalcDelta(config.calculations, listTriggers, answers);
+            return ctx.states_list[0].map(function(item) {
+                return item.id.name in delta ? delta[item.id.name] : noUpdate;
+            });
+        },
+
+        update_style: function(listSources, listCalcs, listRows, config) {
+            // Rows (outputs) are given by a state with the same pattern, in the same order as outputs
+            var ctx = window.dash_clientside.callback_context;
+            var noUpdate = window.dash_clientside.no_update;
+            var answers = {};
+            ctx.inputs_list[0].concat(ctx.inputs_list[1] || []).forEach(function(item) {
+                answers[item.id.name] = isEmpty(item.value) ? null : item.value;
+            });
+            var listTriggers = ctx.triggered.map(function(item) { return getName(item.prop_id); })
+                                            .filter(function(name) { return name !== null; });
+            var delta = getHideDelta(config.rules, listTriggers, answers);
+            return listRows.map(function(id) {
+                var name = id.name;
+                if (!(name in delta)) {
+                    return noUpdate;
+                }
+                return delta[name] ? config.style_hidden : config.style_visible;
+            });
+        }
+    };
+
+    // Evaluation of compiled rules, for tests of parity with the Python implementation (tests/run_delectable.js)
+    if (typeof module !== 'undefined' && module.exports) {
+        module.exports = {evaluate: evaluate, getHideDelta: getHideDelta, getCalcDelta: getCalcDelta, checkRule: checkRule};
+    }
+
+})();
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of app startup and callback payloads for data dictionaries of different sizes
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_callbacks [n_fields ...]
+
+For each size, the app is imported in a new process with a synthetic data
+dictionary, and the following are reported:
+    - startup: time to import app.py (read dictionary, build layout, register callbacks)
+    - callbacks: number of callbacks registered
+    - dependencies: size of the /_dash-dependencies response
+    - layout: size of the /_dash-layout response
+    - compressed: size of the /_dash-layout response sent to browsers (Accept-Encoding: gzip, deflate, br)
+    - layout time: duration of a /_dash-layout request (compressed, no ETag: page loaded for the first time)
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import write_data_dictionary
+
+
+LIST_SIZES = [100, 1000, 5000]
+
+SCRIPT_CHILD = """
+import json, time
+t = time.perf_counter()
+import app
+startup = time.perf_counter() - t
+client = app.server.test_client()
+headers = {'Accept-Encoding': 'gzip, deflate, br'}
+client.get('/_dash-layout', headers=headers) # first request of the worker
+t = time.perf_counter()
+for i in range(20):
+    compressed = len(client.get('/_dash-layout', headers=headers).data)
+layout_seconds = (time.perf_counter() - t) / 20
+print(json.dumps({
+    'startup': startup,
+    'callbacks': len(app.app.callback_map),
+    'dependencies': len(client.get('/_dash-dependencies').data),
+    'layout': len(client.get('/_dash-layout').data),
+    'compressed': compressed,
+    'layout_seconds': layout_seconds,
+}))
+"""
+
+
+def run_benchmark(n_fields, path_dir):
+    """
+    Import the app in a new process with a synthetic dictionary of n_fields fields
+    """
+    path_forms, path_fields = write_data_dictionary(path_dir, n_fields)
+    env = {**os.environ, 'DELECTABLE_FORMS': path_forms, 'DELECTABLE_FIELDS': path_fields,
+           'DELECTABLE_OUTBOX': os.path.join(path_dir, f'outbox_{n_fields}.sqlite3'),
+           'DELECTABLE_CACHE': os.path.join(path_dir, f'cache_{n_fields}')}
+    path_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', SCRIPT_CHILD], cwd=path_root, env=env,
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(list_sizes):
+    print(f"{'fields':>8} {'startup (s)':>12} {'callbacks':>10} {'dependencies (kB)':>18} {'layout (kB)':>12} {'compressed (kB)':>16} {'layout time (ms)':>17}")
+    with tempfile.TemporaryDirectory() as path_dir:
+        for n_fields in list_sizes:
+            result = run_benchmark(n_fields, path_dir)
+            print(f"{n_fields:>8} {result['startup']:>12.2f} {result['callbacks']:>10} "
+                  f"{result['dependencies']/1000:>18.1f} {result['layout']/1000:>12.1f} "
+                  f"{result['compressed']/1000:>16.1f} {result['layout_seconds']*1000:>17.2f}")
+
+
+if __name__ == '__main__':
+    main([int(i) for i in sys.argv[1:]] or LIST_SIZES)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of bulk ingestion (ingest.py) of records collected offline
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_ingest [--fields 200] [--records 20000] [--workers 1 4] [--invalid 0.05]
+
+A synthetic data dictionary and a CSV file of random records are written (all
+fields of all forms answered, dates in the display format of the field, a
+fraction of records with an invalid number), then ingest.py is run in a new
+process for each number of workers. Reported: wall time (including startup and
+compilation of the study in each process), records per second, valid and
+rejected records.
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.bench_sessions import get_random_answer
+from benchmarks.synthetic import write_data_dictionary
+from fields import build_field_index
+
+
+def write_records(path, df_fields, n_records, ratio_invalid, seed=0):
+    """
+    Write a CSV file of random records (one column per field, record_id and visit_day)
+    """
+    rng = random.Random(seed)
+    field_index = build_field_index(df_fields)
+    list_records = []
+    for i in range(n_records):
+        record = {'record_id': f'P{i+1:06d}', 'visit_day': 7}
+        for field in field_index.values():
+            answer = get_random_answer(field, rng)
+            if field.type_component == 'date_dmy' and answer is not None: # as keyed from paper forms
+                year, month, day = answer.split('-')
+                answer = f'{day}/{month}/{year}'
+            record[field.name] = answer
+        if rng.random() < ratio_invalid:
+            list_numbers = [field.name for field in field_index.values() if field.type_component == 'number']
+            record[rng.choice(list_numbers)] = 'n/a'
+        list_records.append(record)
+    pd.DataFrame(list_records).to_csv(path, index=False)
+
+
+def main(list_args=None):
+    parser = argparse.ArgumentParser(description='Benchmark of bulk ingestion')
+    parser.add_argument('--fields', type=int, default=200)
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count()])
+    parser.add_argument('--invalid', type=float, default=0.05, help='fraction of records with an invalid answer')
+    args = parser.parse_args(list_args)
+
+    with tempfile.TemporaryDirectory() as path_dir:
+        path_forms, path_fields = write_data_dictionary(path_dir, args.fields)
+        path_records = os.path.join(path_dir, 'records.csv')
+        write_records(path_records, pd.read_csv(path_fields), args.records, args.invalid)
+        env = {**os.environ, 'DELECTABLE_FORMS': path_forms, 'DELECTABLE_FIELDS': path_fields,
+               'DELECTABLE_OUTBOX': os.path.join(path_dir, 'outbox.sqlite3'),
+               'DELECTABLE_DRAFTS': os.path.join(path_dir, 'drafts')}
+        print(f'{args.records} records, {args.fields} fields')
+        for n_workers in args.workers:
+            t = time.perf_counter()
+            output = subprocess.run([sys.executable, 'ingest.py', path_records, '--workers', str(n_workers),
+                                     '--out', os.path.join(path_dir, f'out_{n_workers}')],
+                                    env=env, check=True, capture_output=True, text=True).stdout
+            duration = time.perf_counter() - t
+            list_lines = [line for line in output.splitlines() if line.startswith(('Valid', 'Rejected'))]
+            print(f'{n_workers:>3} worker(s): {duration:6.1f} s, {args.records / duration:7.0f} records/s | ' + ' | '.join(list_lines))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the review table for data dictionaries of different sizes
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_review [n_fields ...]
+
+Every field of a synthetic data dictionary is answered, then the review table
+is built:
+    - loop: previous implementation (dataframe grown with df.loc, keys listed at each row)
+    - one pass: review.ReviewTable (precomputed labels, records returned directly)
+"""
+
+import random
+import sys
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import make_data_dictionary
+from fields import build_field_index
+from review import ReviewTable
+
+
+LIST_SIZES = [200, 2000]
+N_REPEATS = 5
+
+
+def get_answers(field_index, seed=0):
+    """
+    Return an answer for every field (a code for fields with choices)
+    """
+    rng = random.Random(seed)
+    dict_answers = {}
+    for field in field_index.values():
+        if field.dict_options:
+            dict_answers[field.name] = rng.choice(list(field.dict_options))
+        elif field.type_component == 'number':
+            dict_answers[field.name] = rng.randint(0, 100)
+        else:
+            dict_answers[field.name] = f'Answer {field.name}'
+    return dict_answers
+
+
+def get_records_loop(field_index, dict_answers_final):
+    """
+    Previous implementation of update_review (kept as reference)
+    """
+    df = pd.DataFrame(columns=['Question','Answer','Field Name','Value'])
+    for i in range(len(dict_answers_final)):
+        key = list(dict_answers_final.keys())[i]
+        field = field_index[key]
+        value = dict_answers_final[key]
+        label = field.dict_options.get(value, '') if field.dict_options else value
+        df.loc[i] = [field.label, label, key, value]
+    return df.to_dict('records')
+
+
+def get_time(function, *args):
+    """
+    Return best time of N_REPEATS calls (seconds)
+    """
+    list_times = []
+    for _ in range(N_REPEATS):
+        t = time.perf_counter()
+        function(*args)
+        list_times.append(time.perf_counter() - t)
+    return min(list_times)
+
+
+def main(list_sizes):
+    print(f"{'fields':>8} {'loop (ms)':>10} {'one pass (ms)':>14} {'speedup':>8}")
+    for n_fields in list_sizes:
+        _, df_fields = make_data_dictionary(n_fields)
+        field_index = build_field_index(df_fields)
+        dict_answers = get_answers(field_index)
+        review_table = ReviewTable(field_index)
+        assert review_table.get_records(dict_answers) == get_records_loop(field_index, dict_answers)
+        time_loop = get_time(get_records_loop, field_index, dict_answers)
+        time_pass = get_time(review_table.get_records, dict_answers)
+        print(f"{n_fields:>8} {time_loop*1000:>10.1f} {time_pass*1000:>14.2f} {time_loop/time_pass:>8.0f}")
+
+
+if __name__ == '__main__':
+    main([int(i) for i in sys.argv[1:]] or LIST_SIZES)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Load test: respondent sessions replayed against /_dash-update-component
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_sessions [--fields 200 1000] [--sessions 20] [--depth 2] [--choices 4]
+
+For each size, a synthetic data dictionary is written, and a new process
+starts a stub Redcap server, imports the app and replays sessions in the same
+process (one worker). A session is what a respondent does in the browser:
+    - load the page (layout and dependencies)
+    - enter patient code, select visit day
+    - select each form, answer each visible field (branching logic shows/hides fields)
+    - open review, submit record (to the stub Redcap)
+Clientside callbacks (borders, calc fields, branching logic) are done by the benchmark, as
+the browser would, so only requests that reach the server are measured: calc fields and
+branching logic with Calculations.get_delta and BranchingLogic.get_hide_delta, the Python
+copies of assets/delectable.js (same results, see tests/test_parity.py).
+Answers are autosaved in one batch per form (respondent idle after each form).
+Reported: startup time, memory (RSS), throughput of one worker (sessions and
+callback requests per second of server time), p50/p99 latency and average
+payload (request + response) of each callback.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import write_data_dictionary
+
+
+SCRIPT_CHILD = """
+import json, os, random, resource, sys, time
+from redcap_stub import RedcapStub
+stub = RedcapStub()
+server_stub = stub.serve()
+os.environ['REDCAP_API_URL'] = f'http://127.0.0.1:{server_stub.server_port}/api/'
+os.environ['REDCAP_API_TOKEN'] = 'stub'
+
+def get_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+rss_before = get_rss()
+t = time.perf_counter()
+import app
+startup = time.perf_counter() - t
+rss_startup = get_rss()
+
+from benchmarks.bench_sessions import run_session
+from benchmarks.dash_client import DashClient
+config = json.loads(sys.argv[1])
+rng = random.Random(config['seed'])
+dict_times = {}
+dict_bytes = {}
+n_requests = 0
+for i in range(config['sessions']):
+    client = DashClient(app.app)
+    run_session(app.study, client, f'patient_{i}', rng)
+    n_requests += client.n_requests
+    for name, list_times in client.dict_times.items():
+        dict_times.setdefault(name, []).extend(list_times)
+        dict_bytes.setdefault(name, []).extend(client.dict_bytes[name])
+duration = sum(sum(v) for v in dict_times.values()) # time spent by the server (not by the client)
+app.study.outbox_worker.stop() # records being sent by the background thread are counted
+app.study.outbox.flush(app.study.redcap_client)
+assert len(stub.dict_records) == config['sessions'], (len(stub.dict_records), app.study.outbox.count())
+
+def get_quantile(list_values, q):
+    list_values = sorted(list_values)
+    return list_values[min(len(list_values) - 1, int(q * len(list_values)))]
+
+print(json.dumps({
+    'startup': startup,
+    'rss_startup': rss_startup - rss_before,
+    'rss': get_rss(),
+    'sessions_per_second': config['sessions'] / duration,
+    'requests_per_second': n_requests / duration,
+    'records': len(stub.dict_records),
+    'callbacks': {name: {'n': len(v), 'p50': get_quantile(v, 0.5), 'p99': get_quantile(v, 0.99),
+                         'bytes': sum(dict_bytes[name]) / len(v)}
+                  for name, v in sorted(dict_times.items())},
+}))
+"""
+
+
+###################################################
+# Respondent session
+###################################################
+
+def get_random_answer(field, rng):
+    """
+    Return an answer as sent by the browser (codes of choices, numbers, dates, text)
+    """
+    if field.dict_options:
+        return rng.choice(list(field.dict_options))
+    if field.type_component == 'number':
+        return rng.randint(0, 100)
+    if field.type_component == 'date_dmy':
+        return f'2021-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+    if field.type_component == 'slider':
+        return rng.randint(0, 100)
+    if field.type_component in ['descriptive', 'calc']:
+        return None
+    return f'text {rng.randint(0, 1000)}'
+
+
+def answer_field(study, client, field, rng, dict_pending):
+    """
+    Answer one field (what clientside callbacks do in the browser, answers to autosave are added to dict_pending)
+    """
+    answer = get_random_answer(field, rng)
+    client.set({'type':'field', 'name':field.name}, 'value', answer)
+    client.set({'type':'store_answer', 'name':field.name}, 'data', answer)
+    dict_pending[field.name] = answer
+    if field.name in study.set_sources: # copy to source store, then calc fields and branching logic (assets/delectable.js)
+        client.set({'type':'store_source', 'name':field.name}, 'data', answer)
+        dict_sources = {id_source['name']: client.get(id_source, 'data') for id_source in client.get_ids('store_source')}
+        dict_sources.update({id_calc['name']: client.get(id_calc, 'value') for id_calc in client.get_ids('calc')})
+        dict_calc = study.calculations.get_delta(field.name, dict_sources)
+        dict_sources.update(dict_calc)
+        for field_name in [field.name] + list(dict_calc):
+            if field_name in dict_calc:
+                client.set({'type':'calc', 'name':field_name}, 'value', dict_calc[field_name])
+            for field_name_logic, hidden in study.branching_logic.get_hide_delta(field_name, dict_sources).items():
+                client.set({'type':'row_logic', 'name':field_name_logic}, 'style', {'display':'none'} if hidden else {'display':True})
+
+
+def commit_answers(client, patient_code, day, dict_pending):
+    """
+    Send pending answers in one batch (autosave), as the browser does when the respondent is idle
+    """
+    if 'save_answers' in client.dict_callbacks and dict_pending:
+        client.set('store_commit', 'data', {'answers': dict_pending, 'patient_code': patient_code, 'day': day})
+        client.call('save_answers', [('store_commit', 'data')])
+    dict_pending.clear()
+
+
+def is_visible(client, field_name):
+    style = client.get({'type':'row_logic', 'name':field_name}, 'style')
+    return style is None or style.get('display') != 'none'
+
+
+def run_session(study, client, patient_code, rng, day=7):
+    """
+    Replay the session of one respondent
+    """
+    client.set('home_patient_code', 'value', patient_code)
+    client.set('home_visit_day', 'value', day)
+    client.call('update_visit_day', [('home_visit_day', 'value')])
+    client.call('render_form', [('home_visit_day', 'value')])
+    list_forms = [option['value'] for option in client.get('main_dropdown', 'options')]
+    for form in list_forms:
+        client.set('main_dropdown', 'value', form)
+        client.call('render_content', [('main_dropdown', 'value')])
+        client.call('render_form', [('main_dropdown', 'value')])
+        dict_pending = {}
+        for field in study.dict_form_fields.get(form, ()):
+            if is_visible(client, field.name) and field.type_component not in ['descriptive', 'calc']:
+                answer_field(study, client, field, rng, dict_pending)
+        commit_answers(client, patient_code, day, dict_pending) # one batch per form
+    client.call('update_review', [('form_review', 'style')])
+    client.set('button_next', 'children', 'Submit')
+    client.set('button_next', 'n_clicks', 1)
+    client.call('on_click_button_previous_next', [('button_next', 'n_clicks')])
+    client.call('update_submission_status', [('store_submission', 'data')])
+
+
+###################################################
+# Benchmark
+###################################################
+
+def run_benchmark(n_fields, path_dir, n_sessions, seed=0, **kwargs):
+    """
+    Replay sessions in a new process with a synthetic dictionary of n_fields fields
+    """
+    path_forms, path_fields = write_data_dictionary(path_dir, n_fields, seed=seed, **kwargs)
+    env = {**os.environ, 'DELECTABLE_FORMS': path_forms, 'DELECTABLE_FIELDS': path_fields,
+           'DELECTABLE_OUTBOX': os.path.join(path_dir, f'outbox_{n_fields}.sqlite3'),
+           'DELECTABLE_DRAFTS': os.path.join(path_dir, f'drafts_{n_fields}'),
+           'OUTBOX_BATCH_DELAY': '0.1', 'REDCAP_RETRIES': '0'}
+    path_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = json.dumps({'sessions': n_sessions, 'seed': seed})
+    output = subprocess.run([sys.executable, '-c', SCRIPT_CHILD, config], cwd=path_root, env=env,
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(list_args=None):
+    parser = argparse.ArgumentParser(description='Replay respondent sessions against the Dash callbacks')
+    parser.add_argument('--fields', type=int, nargs='+', default=[200, 1000], help='numbers of fields')
+    parser.add_argument('--forms', type=int, default=None, help='number of forms (default: one per 50 fields)')
+    parser.add_argument('--sessions', type=int, default=10, help='number of sessions per size')
+    parser.add_argument('--depth', type=int, default=2, help='maximum depth of branching logic')
+    parser.add_argument('--choices', type=int, default=4, help='number of choices of dropdown and radio fields')
+    parser.add_argument('--ratio-logic', type=float, default=0.3, help='fraction of fields with branching logic')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(list_args)
+
+    with tempfile.TemporaryDirectory() as path_dir:
+        for n_fields in args.fields:
+            result = run_benchmark(n_fields, path_dir, args.sessions, seed=args.seed, n_forms=args.forms,
+                                   n_choices=args.choices, ratio_logic=args.ratio_logic, depth_logic=args.depth)
+            print(f"\n{n_fields} fields: startup {result['startup']:.2f} s, "
+                  f"memory {result['rss']/1e6:.0f} MB (dictionary and layout: {result['rss_startup']/1e6:.0f} MB), "
+                  f"{result['sessions_per_second']:.2f} sessions/s, {result['requests_per_second']:.0f} requests/s "
+                  f"per worker, {result['records']} records received by Redcap")
+            print(f"{'callback':>32} {'requests':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'payload (kB)':>13}")
+            for name, item in result['callbacks'].items():
+                print(f"{name:>32} {item['n']:>9} {item['p50']*1000:>9.2f} {item['p99']*1000:>9.2f} "
+                      f"{item['bytes']/1000:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
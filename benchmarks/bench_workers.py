@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the memory of gunicorn workers, with and without preload (see gunicorn.conf.py)
+
+Usage (from the root of the repository, Linux):
+    python -m benchmarks.bench_workers [--fields 1000] [--workers 4] [--sessions 3]
+
+For each mode, a new process emulates the gunicorn master: with preload, it
+imports the app (garbage collector disabled), builds what workers share
+(app.prepare_workers) and freezes its objects before forking the workers;
+without preload, each worker imports the app after it is forked. Each worker
+replays sessions (see bench_sessions.py), then reports its memory while all
+workers are still running, so that shared pages are counted once by PSS.
+Reported: time until all workers are ready, memory of the master, memory of
+each worker (RSS, PSS, USS) and total PSS (master + workers, what the dyno uses).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import write_data_dictionary
+
+
+SCRIPT_CHILD = """
+import gc, json, os, random, sys, time
+from redcap_stub import RedcapStub
+from metrics import get_memory
+config = json.loads(sys.argv[1])
+stub = RedcapStub()
+server_stub = stub.serve()
+os.environ['REDCAP_API_URL'] = f'http://127.0.0.1:{server_stub.server_port}/api/'
+os.environ['REDCAP_API_TOKEN'] = 'stub'
+
+t = time.perf_counter()
+if config['preload']:
+    gc.disable()
+    import app
+    app.prepare_workers()
+    gc.freeze()
+    gc.enable()
+
+list_workers = []
+for i_worker in range(config['workers']):
+    read_report, write_report = os.pipe()
+    read_exit, write_exit = os.pipe()
+    pid = os.fork()
+    if pid == 0: # worker
+        gc.enable()
+        import app
+        os.write(write_report, b'ready\\n')
+        from benchmarks.bench_sessions import run_session
+        from benchmarks.dash_client import DashClient
+        rng = random.Random(i_worker)
+        for i in range(config['sessions']):
+            run_session(app.study, DashClient(app.app), f'patient_{i_worker}_{i}', rng)
+        os.write(write_report, (json.dumps(get_memory()) + '\\n').encode())
+        os.read(read_exit, 1) # memory of all workers is read while they are all running
+        os._exit(0)
+    list_workers.append((pid, os.fdopen(read_report), write_exit))
+
+for pid, f, write_exit in list_workers:
+    f.readline()
+ready = time.perf_counter() - t
+list_memory = [json.loads(f.readline()) for pid, f, write_exit in list_workers]
+memory_master = get_memory()
+for pid, f, write_exit in list_workers:
+    os.write(write_exit, b'x')
+    os.waitpid(pid, 0)
+print(json.dumps({'ready': ready, 'master': memory_master, 'workers': list_memory}))
+"""
+
+
+def run_benchmark(path_forms, path_fields, path_dir, n_workers, n_sessions, bool_preload):
+    """
+    Emulate gunicorn (master and n_workers workers) in a new process
+    """
+    name = 'preload' if bool_preload else 'no_preload'
+    env = {**os.environ, 'DELECTABLE_FORMS': path_forms, 'DELECTABLE_FIELDS': path_fields,
+           'DELECTABLE_OUTBOX': os.path.join(path_dir, f'outbox_{name}.sqlite3'),
+           'DELECTABLE_DRAFTS': os.path.join(path_dir, f'drafts_{name}'),
+           'OUTBOX_BATCH_DELAY': '0.1', 'REDCAP_RETRIES': '0'}
+    path_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = json.dumps({'workers': n_workers, 'sessions': n_sessions, 'preload': bool_preload})
+    output = subprocess.run([sys.executable, '-c', SCRIPT_CHILD, config], cwd=path_root, env=env,
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(list_args=None):
+    parser = argparse.ArgumentParser(description='Memory of gunicorn workers, with and without preload')
+    parser.add_argument('--fields', type=int, default=1000, help='number of fields')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=3, help='number of sessions replayed by each worker')
+    args = parser.parse_args(list_args)
+
+    with tempfile.TemporaryDirectory() as path_dir:
+        path_forms, path_fields = write_data_dictionary(path_dir, args.fields)
+        print(f'{args.fields} fields, {args.workers} workers, {args.sessions} sessions per worker')
+        for bool_preload in [False, True]:
+            result = run_benchmark(path_forms, path_fields, path_dir, args.workers, args.sessions, bool_preload)
+            master = result['master']
+            total = master.get('pss', 0) + sum(memory.get('pss', 0) for memory in result['workers'])
+            print(f"\n{'preload' if bool_preload else 'no preload'}: workers ready in {result['ready']:.2f} s, "
+                  f"master rss {master.get('rss', 0)/2**20:.0f} MB, total pss {total/2**20:.0f} MB")
+            print(f"{'worker':>8} {'rss (MB)':>9} {'pss (MB)':>9} {'uss (MB)':>9}")
+            for i, memory in enumerate(result['workers']):
+                print(f"{i:>8} {memory.get('rss', 0)/2**20:>9.0f} {memory.get('pss', 0)/2**20:>9.0f} "
+                      f"{memory.get('uss', 0)/2**20:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal Dash client for benchmarks
+
+Plays the role of the browser (dash-renderer): keeps the properties of the
+components of the layout, builds the requests of /_dash-update-component
+(including pattern-matching ids) and applies the responses.
+Clientside callbacks are not run: the caller copies the properties itself.
+"""
+
+import json
+import time
+
+
+def get_key(id_component):
+    """
+    Return key of a component id (pattern-matching ids are dictionaries)
+    """
+    return json.dumps(id_component, sort_keys=True) if isinstance(id_component, dict) else id_component
+
+
+def get_prop_id(id_component, prop):
+    """
+    Return prop id as sent by dash-renderer (keys of pattern-matching ids are sorted, no spaces)
+    """
+    if isinstance(id_component, dict):
+        return json.dumps(id_component, sort_keys=True, separators=(',', ':')) + '.' + prop
+    return id_component + '.' + prop
+
+
+def split_output(output):
+    """
+    Return list of (id, property) of the output string of a callback
+    """
+    if output.startswith('..'):
+        list_outputs = output[2:-2].split('...')
+    else:
+        list_outputs = [output]
+    return [tuple(i.rsplit('.', 1)) for i in list_outputs]
+
+
+class DashClient:
+    """
+    Inputs:
+        - dash_app: dash.Dash instance (requests are sent to its Flask server in the same process)
+        - prefix: URL prefix of the app (default: prefix of dash_app)
+    """
+
+    def __init__(self, dash_app, prefix=None):
+        self.client = dash_app.server.test_client()
+        self.prefix = dash_app.config.requests_pathname_prefix if prefix is None else prefix
+        self.dict_props = {} # key of component id -> {property: value}
+        self.dict_patterns = {} # type of pattern-matching id -> {key of component id: id}
+        self.dict_times = {} # callback name -> list of durations (seconds)
+        self.dict_bytes = {} # callback name -> list of request + response sizes
+        self.n_requests = 0
+        self.dict_callbacks = {} # callback name -> dependency
+        list_dependencies = self.get_json('_dash-dependencies')
+        for dependency in list_dependencies:
+            callback = dash_app.callback_map.get(dependency['output'], {}).get('callback')
+            if callback is not None:
+                self.dict_callbacks[callback.__name__] = dependency
+        self.add_components(self.get_json('_dash-layout'))
+
+    def get_json(self, path):
+        response = self.client.get(self.prefix + path)
+        assert response.status_code == 200, (path, response.status_code)
+        return json.loads(response.data)
+
+    def add_components(self, node):
+        """
+        Save properties of components of a layout (or of children returned by a callback)
+        """
+        if isinstance(node, list):
+            for i in node:
+                self.add_components(i)
+        elif isinstance(node, dict) and 'props' in node:
+            props = node['props']
+            if 'id' in props:
+                self.dict_props[get_key(props['id'])] = props
+                self.add_pattern(props['id'])
+            self.add_components(props.get('children'))
+
+    def add_pattern(self, id_component):
+        if isinstance(id_component, dict):
+            self.dict_patterns.setdefault(id_component.get('type'), {})[get_key(id_component)] = id_component
+
+    def get(self, id_component, prop):
+        return self.dict_props.get(get_key(id_component), {}).get(prop)
+
+    def set(self, id_component, prop, value):
+        self.dict_props.setdefault(get_key(id_component), {})[prop] = value
+        self.add_pattern(id_component)
+
+    def get_ids(self, type_id):
+        """
+        Return pattern-matching ids of a type that are in the layout (e.g. all 'store_answer')
+        """
+        return list(self.dict_patterns.get(type_id, {}).values())
+
+    def resolve(self, id_string, prop, name=None, bool_value=True):
+        """
+        Return item(s) of a request for an id of the dependencies (wildcards are replaced by ids of the layout)
+        """
+        if not id_string.startswith('{'):
+            item = {'id': id_string, 'property': prop}
+            if bool_value:
+                item['value'] = self.get(id_string, prop)
+            return item
+        pattern = json.loads(id_string)
+        if pattern['name'] == ['MATCH']:
+            list_ids = [id_component for id_component in [{**pattern, 'name': name}]
+                        if get_key(id_component) in self.dict_patterns.get(pattern['type'], {})]
+        else:
+            list_ids = self.get_ids(pattern['type'])
+        list_items = []
+        for id_component in list_ids:
+            if set(id_component) != set(pattern):
+                continue
+            if pattern['name'] == ['MATCH'] and id_component['name'] != name:
+                continue
+            item = {'id': id_component, 'property': prop}
+            if bool_value:
+                item['value'] = self.get(id_component, prop)
+            list_items.append(item)
+        if pattern['name'] == ['MATCH']:
+            return list_items[0] if list_items else None
+        return list_items
+
+    def call(self, callback_name, list_changed, name=None):
+        """
+        Send request of a callback, apply response, return response (None if callback did not update anything)
+        Inputs:
+            - list_changed: list of (id, property) that have changed
+            - name: value of MATCH wildcard
+        """
+        dependency = self.dict_callbacks[callback_name]
+        list_outputs = [self.resolve(id_string, prop, name, bool_value=False)
+                        for id_string, prop in split_output(dependency['output'])]
+        if any(output is None for output in list_outputs):
+            return None # MATCH callback without output (e.g. field without store)
+        body = {
+            'output': dependency['output'],
+            'outputs': list_outputs if dependency['output'].startswith('..') else list_outputs[0],
+            'inputs': [self.resolve(i['id'], i['property'], name) for i in dependency['inputs']],
+            'state': [self.resolve(i['id'], i['property'], name) for i in dependency['state']],
+            'changedPropIds': [get_prop_id(id_component, prop) for id_component, prop in list_changed],
+        }
+        data = json.dumps(body)
+        start = time.perf_counter()
+        response = self.client.post(self.prefix + '_dash-update-component', data=data,
+                                    content_type='application/json')
+        self.dict_times.setdefault(callback_name, []).append(time.perf_counter() - start)
+        self.dict_bytes.setdefault(callback_name, []).append(len(data) + len(response.data))
+        self.n_requests += 1
+        if response.status_code == 204:
+            return None
+        assert response.status_code == 200, (callback_name, response.status_code, response.data[:1000])
+        dict_response = json.loads(response.data)['response']
+        for key, props in dict_response.items():
+            id_component = json.loads(key) if key.startswith('{') else key
+            for prop, value in props.items():
+                self.set(id_component, prop, value)
+                if prop == 'children':
+                    self.add_components(value)
+        return dict_response
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic Redcap data dictionaries for benchmarks
+
+The dictionaries have the same columns as resources/list_forms_v3.xlsx and
+resources/list_fields_v3.xlsx, and can be written as CSV files that the app
+reads through the DELECTABLE_FORMS and DELECTABLE_FIELDS environment variables.
+"""
+
+import os
+import random
+
+import pandas as pd
+
+
+LIST_COLUMNS_FORMS = ['Form Name', 'Form Index', 'Title']
+LIST_COLUMNS_FIELDS = ['Variable / Field Name', 'Form Name', 'Section Header', 'Field Type', 'Field Label',
+                       'Choices, Calculations, OR Slider Labels', 'Field Note',
+                       'Text Validation Type OR Show Slider Number', 'Text Validation Min', 'Text Validation Max',
+                       'Identifier?', 'Branching Logic (Show field only if...)', 'Required Field?',
+                       'Custom Alignment', 'Question Number (surveys only)', 'Matrix Group Name',
+                       'Matrix Ranking?', 'Field Annotation']
+
+# Field types and their relative frequency (similar to list_fields_v3.xlsx)
+LIST_TYPES = [('dropdown', None, 0.55), ('radio', None, 0.15), ('yesno', None, 0.05),
+              ('text', None, 0.05), ('text', 'number', 0.15), ('text', 'date_dmy', 0.05)]
+
+
+def get_choices(n_choices):
+    return ' | '.join(f'{i}, Choice {i}' for i in range(1, n_choices+1))
+
+
+def make_data_dictionary(n_fields, n_forms=None, n_choices=4, ratio_logic=0.3, depth_logic=2, bool_totals=True, seed=0):
+    """
+    Return two dataframes (forms, fields) of a synthetic data dictionary
+    Inputs:
+        - n_fields: number of fields
+        - n_forms: number of questionnaires (default: one per 50 fields), "home" and "review" are added
+        - n_choices: number of choices of dropdown and radio fields
+        - ratio_logic: fraction of fields that have branching logic
+        - depth_logic: maximum length of chains of branching logic (field -> parent -> grand-parent...)
+        - bool_totals: add a calc field at the end of each questionnaire (sum of its number fields, like a score)
+    """
+    rng = random.Random(seed)
+    n_forms = n_forms or max(1, n_fields // 50)
+    list_forms = [f'form_{i+1}' for i in range(n_forms)]
+    df_forms = pd.DataFrame([['home', 0, None]] +
+                            [[form, i+1, f'Synthetic form {i+1}'] for i, form in enumerate(list_forms)] +
+                            [['review', n_forms+1, 'Review']], columns=LIST_COLUMNS_FORMS)
+
+    list_rows = []
+    dict_depth = {} # field name -> length of its chain of branching logic
+    dict_candidates = {form: [] for form in list_forms} # fields that can be used in branching logic
+    dict_numbers = {form: [] for form in list_forms} # fields added to the total of the form
+    for i in range(n_fields):
+        form = list_forms[i * n_forms // n_fields]
+        name = f'field_{i+1}'
+        field_type, validation, _ = rng.choices(LIST_TYPES, weights=[t[2] for t in LIST_TYPES])[0]
+        choices = get_choices(n_choices) if field_type in ['dropdown', 'radio'] else None
+        logic = None
+        list_candidates = [j for j in dict_candidates[form] if dict_depth[j] < depth_logic]
+        if list_candidates and rng.random() < ratio_logic:
+            source = rng.choice(list_candidates[-20:])
+            logic = f"[{source}] = '1'"
+            dict_depth[name] = dict_depth[source] + 1
+        else:
+            dict_depth[name] = 0
+        if field_type in ['dropdown', 'radio', 'yesno']:
+            dict_candidates[form].append(name)
+        if validation == 'number':
+            dict_numbers[form].append(name)
+        row = dict.fromkeys(LIST_COLUMNS_FIELDS)
+        row.update({'Variable / Field Name': name, 'Form Name': form, 'Field Type': field_type,
+                    'Field Label': f'Question {i+1}', 'Choices, Calculations, OR Slider Labels': choices,
+                    'Text Validation Type OR Show Slider Number': validation,
+                    'Branching Logic (Show field only if...)': logic})
+        list_rows.append(row)
+    if bool_totals:
+        for i, form in enumerate(list_forms):
+            if not dict_numbers[form]:
+                continue
+            row = dict.fromkeys(LIST_COLUMNS_FIELDS)
+            row.update({'Variable / Field Name': f'{form}_total', 'Form Name': form, 'Field Type': 'calc',
+                        'Field Label': f'Total of form {i+1}',
+                        'Choices, Calculations, OR Slider Labels': 'sum(' + ', '.join(f'[{j}]' for j in dict_numbers[form]) + ')'})
+            list_rows.append(row)
+    df_fields = pd.DataFrame(list_rows, columns=LIST_COLUMNS_FIELDS)
+    df_fields = df_fields.sort_values('Form Name', key=lambda column: column.map(list_forms.index), kind='stable')
+    return df_forms, df_fields
+
+
+def write_data_dictionary(path_dir, n_fields, **kwargs):
+    """
+    Write synthetic data dictionary as two CSV files
+    Return paths of forms and fields files
+    """
+    df_forms, df_fields = make_data_dictionary(n_fields, **kwargs)
+    path_forms = os.path.join(path_dir, f'forms_{n_fields}.csv')
+    path_fields = os.path.join(path_dir, f'fields_{n_fields}.csv')
+    df_forms.to_csv(path_forms, index=False)
+    df_fields.to_csv(path_fields, index=False)
+    return path_forms, path_fields
@@ -0,0 +1,543 @@
+# -*- coding: utf-8 -*-
+"""
+Compiler for Redcap branching logic
+
+Each "Branching Logic (Show field only if...)" expression is parsed once when
+the app is started. The result is a function of the answers, plus a reverse
+dependency index (source field -> dependent fields) so that only the fields
+affected by an answer are evaluated again. The same ASTs and indexes are sent
+to the browser (get_rules), where assets/delectable.js evaluates them without
+a request to the server.
+
+Supported syntax:
+    - comparisons: =, <>, !=, >, <, >=, <=
+    - operands: [field], [field(code)] (checkbox), 'string', "string", numbers
+    - boolean operators: and, or, not (&&, || are also accepted)
+    - arithmetic: +, -, *, /, ^ and functions (see DICT_FUNCTIONS), e.g. sum([a], [b]) / 2
+    - nested parentheses
+The same parser compiles the equations of calc fields (see calculations.py).
+"""
+
+import math
+import re
+
+
+###################################################
+# Errors
+###################################################
+
+class BranchingLogicError(ValueError):
+    """
+    Raised when a branching logic expression cannot be compiled
+    """
+
+
+###################################################
+# Tokenizer
+###################################################
+
+REGEX_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<field>\[[^\[\]()]+(?:\([^\[\]()]*\))?\])
+      | (?P<string>'[^']*'|"[^"]*")
+      | (?P<number>\d+(?:\.\d*)?|\.\d+)
+      | (?P<op><>|!=|>=|<=|&&|\|\||[=<>()+\-*/^,])
+      | (?P<word>[A-Za-z_]+)
+    )""", re.VERBOSE)
+
+DICT_KEYWORDS = {'and': 'and', 'or': 'or', 'not': 'not', '&&': 'and', '||': 'or'}
+LIST_COMPARISONS = ['=', '<>', '!=', '>', '<', '>=', '<=']
+LIST_FUNCTIONS = ['if', 'sum', 'mean', 'min', 'max', 'abs', 'sqrt', 'round', 'roundup', 'rounddown']
+
+
+def tokenize(expression):
+    """
+    Split expression into a list of (kind, text) tuples
+    """
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = REGEX_TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise BranchingLogicError(f'Unexpected character at position {position}: {expression!r}')
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'word':
+            if text.lower() in LIST_FUNCTIONS:
+                kind, text = 'function', text.lower()
+            elif text.lower() in DICT_KEYWORDS:
+                kind, text = 'op', DICT_KEYWORDS[text.lower()]
+            else:
+                raise BranchingLogicError(f'Unknown keyword {text!r}: {expression!r}')
+        elif kind == 'op' and text in DICT_KEYWORDS:
+            text = DICT_KEYWORDS[text]
+        tokens.append((kind, text))
+        position = match.end()
+    return tokens
+
+
+###################################################
+# Parser (expression -> AST)
+###################################################
+# AST nodes are tuples:
+#     ('or', left, right), ('and', left, right), ('not', operand)
+#     ('cmp', operator, left, right)
+#     ('arith', operator, left, right), ('neg', operand)
+#     ('call', function, [arguments])
+#     ('field', field_name, checkbox_code or None)
+#     ('literal', value)
+
+class Parser:
+    """
+    Recursive-descent parser, one instance per expression
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        if token[0] is None:
+            raise BranchingLogicError(f'Unexpected end of expression: {self.expression!r}')
+        self.position += 1
+        return token
+
+    def expect(self, text):
+        kind, value = self.take()
+        if kind != 'op' or value != text:
+            raise BranchingLogicError(f'Expected {text!r} but found {value!r}: {self.expression!r}')
+
+    def parse(self):
+        if not self.tokens:
+            raise BranchingLogicError('Empty expression')
+        node = self.parse_or()
+        if self.position != len(self.tokens):
+            raise BranchingLogicError(f'Unexpected token {self.peek()[1]!r}: {self.expression!r}')
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.peek() == ('op', 'or'):
+            self.take()
+            node = ('or', node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.peek() == ('op', 'and'):
+            self.take()
+            node = ('and', node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        if self.peek() == ('op', 'not'):
+            self.take()
+            return ('not', self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        node = self.parse_sum()
+        kind, value = self.peek()
+        if kind == 'op' and value in LIST_COMPARISONS:
+            self.take()
+            node = ('cmp', '<>' if value == '!=' else value, node, self.parse_sum())
+        return node
+
+    def parse_sum(self):
+        node = self.parse_product()
+        while self.peek() in [('op', '+'), ('op', '-')]:
+            node = ('arith', self.take()[1], node, self.parse_product())
+        return node
+
+    def parse_product(self):
+        node = self.parse_unary()
+        while self.peek() in [('op', '*'), ('op', '/')]:
+            node = ('arith', self.take()[1], node, self.parse_unary())
+        return node
+
+    def parse_unary(self):
+        if self.peek() == ('op', '-'): # binds less tightly than ^, e.g. -2^2 = -4 (as in Redcap)
+            self.take()
+            return ('neg', self.parse_unary())
+        return self.parse_power()
+
+    def parse_power(self):
+        node = self.parse_operand()
+        if self.peek() == ('op', '^'):
+            self.take()
+            node = ('arith', '^', node, self.parse_unary()) # right-associative
+        return node
+
+    def parse_operand(self):
+        kind, value = self.take()
+        if kind == 'op' and value == '(':
+            node = self.parse_or()
+            self.expect(')')
+            return node
+        if kind == 'function':
+            self.expect('(')
+            list_arguments = [self.parse_or()]
+            while self.peek() == ('op', ','):
+                self.take()
+                list_arguments.append(self.parse_or())
+            self.expect(')')
+            if value == 'if' and len(list_arguments) != 3:
+                raise BranchingLogicError(f'Function if expects 3 arguments: {self.expression!r}')
+            return ('call', value, list_arguments)
+        if kind == 'field':
+            name = value[1:-1].strip()
+            if '(' in name:
+                name, code = name[:-1].split('(')
+                return ('field', name.strip(), code.strip())
+            return ('field', name, None)
+        if kind == 'string':
+            return ('literal', value[1:-1])
+        if kind == 'number':
+            return ('literal', value)
+        raise BranchingLogicError(f'Unexpected token {value!r}: {self.expression!r}')
+
+
+def parse_expression(expression):
+    """
+    Return AST of a branching logic expression
+    """
+    return Parser(expression).parse()
+
+
+def get_fields_from_ast(node, set_fields=None):
+    """
+    Return set of field names referenced by an AST
+    """
+    set_fields = set() if set_fields is None else set_fields
+    if node[0] == 'field':
+        set_fields.add(node[1])
+    elif node[0] in ['or', 'and', 'cmp', 'arith', 'not', 'neg']:
+        for child in node[1:]:
+            if isinstance(child, tuple):
+                get_fields_from_ast(child, set_fields)
+    elif node[0] == 'call':
+        for child in node[2]:
+            get_fields_from_ast(child, set_fields)
+    return set_fields
+
+
+###################################################
+# Compiler (AST -> Python function)
+###################################################
+
+def get_string_from_answer(value, code=None):
+    """
+    Convert an answer to the string that Redcap uses in comparisons
+    (None -> '', checkbox -> '1'/'0', 1.0 -> '1')
+    """
+    if code is not None:
+        return '1' if value is not None and code in [str(i) for i in value] else '0'
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def get_number_from_string(string):
+    try:
+        return float(string)
+    except ValueError:
+        return None
+
+
+def compare(operator, left, right):
+    """
+    Compare two strings the way Redcap does (numerically if both are numbers)
+    """
+    number_left = get_number_from_string(left)
+    number_right = get_number_from_string(right)
+    if number_left is not None and number_right is not None:
+        left, right = number_left, number_right
+    elif operator in ['>', '<', '>=', '<='] and (left == '' or right == ''):
+        return False
+    if operator == '=':
+        return left == right
+    if operator == '<>':
+        return left != right
+    if operator == '>':
+        return left > right
+    if operator == '<':
+        return left < right
+    if operator == '>=':
+        return left >= right
+    return left <= right
+
+
+def get_number(value):
+    """
+    Return number of an operand of arithmetic (None if empty or not a number), true/false count as 1/0
+    """
+    number = float(value) if isinstance(value, bool) else get_number_from_string(value)
+    return number if number is not None and math.isfinite(number) else None
+
+
+def get_string_from_number(number):
+    """
+    Return result of arithmetic as a string ('' if undefined, e.g. empty operand or division by zero)
+    """
+    if number is None or not math.isfinite(number):
+        return ''
+    return get_string_from_answer(float(number))
+
+
+def calculate(operator, left, right):
+    """
+    Apply an arithmetic operator to two operands (empty if an operand is empty or not a number)
+    """
+    number_left = get_number(left)
+    number_right = get_number(right)
+    if number_left is None or number_right is None:
+        return ''
+    try:
+        if operator == '+':
+            return get_string_from_number(number_left + number_right)
+        if operator == '-':
+            return get_string_from_number(number_left - number_right)
+        if operator == '*':
+            return get_string_from_number(number_left * number_right)
+        if operator == '/':
+            return get_string_from_number(number_left / number_right)
+        return get_string_from_number(math.pow(number_left, number_right))
+    except (ZeroDivisionError, ValueError, OverflowError):
+        return ''
+
+
+def round_number(function, number, digits):
+    """
+    Round half away from zero (round), away from zero (roundup) or toward zero (rounddown)
+    """
+    factor = math.pow(10, digits)
+    sign = -1 if number < 0 else 1
+    if function == 'round':
+        return sign * math.floor(abs(number) * factor + 0.5) / factor
+    if function == 'roundup':
+        return sign * math.ceil(abs(number) * factor) / factor
+    return sign * math.floor(abs(number) * factor) / factor
+
+
+def call_function(function, list_values):
+    """
+    Apply a function of Redcap equations to the values of its arguments
+    Functions of several numbers ignore empty values (sum, mean, min, max)
+    """
+    if function == 'if':
+        return list_values[1] if list_values[0] else list_values[2]
+    list_numbers = [number for number in map(get_number, list_values) if number is not None]
+    if function in ['sum', 'mean', 'min', 'max']:
+        if not list_numbers:
+            return ''
+        total = 0.0
+        for number in list_numbers: # added from left to right, as in the browser
+            total += number
+        if function == 'sum':
+            return get_string_from_number(total)
+        if function == 'mean':
+            return get_string_from_number(total / len(list_numbers))
+        return get_string_from_number(min(list_numbers) if function == 'min' else max(list_numbers))
+    number = get_number(list_values[0])
+    if number is None:
+        return ''
+    if function == 'abs':
+        return get_string_from_number(abs(number))
+    if function == 'sqrt':
+        return get_string_from_number(math.sqrt(number)) if number >= 0 else ''
+    digits = get_number(list_values[1]) if len(list_values) > 1 else 0
+    if digits is None:
+        return ''
+    try:
+        return get_string_from_number(round_number(function, number, int(digits)))
+    except (ZeroDivisionError, OverflowError):
+        return ''
+
+
+def compile_ast(node):
+    """
+    Return a function get_value -> value, where get_value(field_name) returns the current answer
+    """
+    kind = node[0]
+    if kind == 'literal':
+        value = node[1]
+        return lambda get_value: value
+    if kind == 'field':
+        name, code = node[1], node[2]
+        return lambda get_value: get_string_from_answer(get_value(name), code)
+    if kind == 'not':
+        operand = compile_ast(node[1])
+        return lambda get_value: not operand(get_value)
+    if kind == 'and':
+        left, right = compile_ast(node[1]), compile_ast(node[2])
+        return lambda get_value: bool(left(get_value)) and bool(right(get_value))
+    if kind == 'or':
+        left, right = compile_ast(node[1]), compile_ast(node[2])
+        return lambda get_value: bool(left(get_value)) or bool(right(get_value))
+    if kind == 'cmp':
+        operator, left, right = node[1], compile_ast(node[2]), compile_ast(node[3])
+        return lambda get_value: compare(operator, left(get_value), right(get_value))
+    if kind == 'arith':
+        operator, left, right = node[1], compile_ast(node[2]), compile_ast(node[3])
+        return lambda get_value: calculate(operator, left(get_value), right(get_value))
+    if kind == 'neg':
+        operand = compile_ast(node[1])
+        return lambda get_value: calculate('-', '0', operand(get_value))
+    if kind == 'call':
+        function, list_arguments = node[1], [compile_ast(i) for i in node[2]]
+        return lambda get_value: call_function(function, [argument(get_value) for argument in list_arguments])
+    raise BranchingLogicError(f'Unknown node {kind!r}')
+
+
+###################################################
+# Branching logic of the whole data dictionary
+###################################################
+
+class BranchingLogic:
+    """
+    Compiled branching logic of all fields, with reverse dependency index
+    Inputs:
+        - dict_logic: field name -> branching logic expression (fields without logic are omitted)
+    """
+
+    def __init__(self, dict_logic):
+        self.dict_conditions = {}
+        self.dict_ast = {}
+        self.dict_sources = dict_sources = {}
+        for field_name, expression in dict_logic.items():
+            try:
+                ast = parse_expression(expression)
+            except BranchingLogicError as e:
+                raise BranchingLogicError(f'Field {field_name}: {e}') from None
+            self.dict_ast[field_name] = ast
+            self.dict_conditions[field_name] = compile_ast(ast)
+            dict_sources[field_name] = get_fields_from_ast(ast)
+
+        # Order fields so that a field is always evaluated after the fields it depends on
+        self.dict_rank = {}
+        for field_name in self.get_topological_order(dict_sources):
+            self.dict_rank[field_name] = len(self.dict_rank)
+
+        # Reverse index: source field -> direct dependent fields
+        self.dict_dependents = {}
+        for field_name in self.dict_rank:
+            for source in dict_sources[field_name]:
+                self.dict_dependents.setdefault(source, []).append(field_name)
+
+        # Transitive closure: source field -> all fields to evaluate again (evaluation order)
+        self.dict_affected = {}
+        for source in self.dict_dependents:
+            set_affected = set()
+            list_todo = [source]
+            while list_todo:
+                for field_name in self.dict_dependents.get(list_todo.pop(), []):
+                    if field_name not in set_affected:
+                        set_affected.add(field_name)
+                        list_todo.append(field_name)
+            self.dict_affected[source] = tuple(sorted(set_affected, key=self.dict_rank.get))
+
+        # Fields to evaluate so that the affected fields can be evaluated without the rest of the record:
+        # affected fields, and the fields they depend on (a hidden parent hides its children)
+        self.dict_evaluation = {}
+        for source in self.dict_dependents:
+            set_visited = {source, *self.dict_affected[source]}
+            list_todo = list(set_visited)
+            while list_todo:
+                for field_name in dict_sources.get(list_todo.pop(), ()):
+                    if field_name not in set_visited:
+                        set_visited.add(field_name)
+                        list_todo.append(field_name)
+            self.dict_evaluation[source] = tuple(sorted((i for i in set_visited if i in self.dict_rank),
+                                                        key=self.dict_rank.get))
+
+    @staticmethod
+    def get_topological_order(dict_sources):
+        list_order = []
+        dict_state = {}
+        for field_name in dict_sources:
+            if field_name in dict_state:
+                continue
+            dict_state[field_name] = 'visiting'
+            list_stack = [(field_name, iter(sorted(dict_sources[field_name])))]
+            while list_stack:
+                current, iterator = list_stack[-1]
+                for source in iterator:
+                    if source not in dict_sources or dict_state.get(source) == 'done':
+                        continue
+                    if dict_state.get(source) == 'visiting':
+                        raise BranchingLogicError(f'Circular branching logic between {current} and {source}')
+                    dict_state[source] = 'visiting'
+                    list_stack.append((source, iter(sorted(dict_sources[source]))))
+                    break
+                else:
+                    dict_state[current] = 'done'
+                    list_order.append(current)
+                    list_stack.pop()
+        return list_order
+
+    def get_rules(self):
+        """
+        Return compiled branching logic as JSON (evaluated in the browser by assets/delectable.js):
+            - conditions: field name -> AST (tuples become lists)
+            - evaluation: source field -> fields to evaluate when source changes (evaluation order)
+            - affected: source field -> fields whose visibility may change when source changes
+        """
+        return {
+            'conditions': self.dict_ast,
+            'evaluation': {source: list(fields) for source, fields in self.dict_evaluation.items()},
+            'affected': {source: list(fields) for source, fields in self.dict_affected.items()},
+        }
+
+    def get_sources(self):
+        """
+        Return list of fields that other fields depend on
+        """
+        return list(self.dict_dependents)
+
+    def get_affected_fields(self, field_name):
+        """
+        Return fields whose visibility may change when field_name changes (evaluation order)
+        """
+        return self.dict_affected.get(field_name, ())
+
+    def is_hidden(self, field_name, dict_answers, dict_hide):
+        """
+        Evaluate branching logic of one field (answers of hidden fields count as empty)
+        """
+        condition = self.dict_conditions.get(field_name)
+        if condition is None:
+            return False
+        get_value = lambda name: None if dict_hide.get(name) else dict_answers.get(name)
+        return not condition(get_value)
+
+    def get_hide_delta(self, field_name_ref, dict_answers):
+        """
+        Same as getHideDelta of assets/delectable.js, where branching logic is evaluated when an answer changes
+        (used by benchmarks to do what the browser does, and tested against the browser in tests/test_parity.py)
+        Inputs:
+            - field_name_ref: field whose answer has changed
+            - dict_answers: answers of field_name_ref and of the fields used in branching logic
+        Output:
+            - dict: field name -> hidden, only for fields affected by field_name_ref
+        """
+        dict_hide = {}
+        for field_name in self.dict_evaluation.get(field_name_ref, ()):
+            dict_hide[field_name] = self.is_hidden(field_name, dict_answers, dict_hide)
+        return {field_name: dict_hide[field_name] for field_name in self.get_affected_fields(field_name_ref)}
+
+    def get_dict_hide(self, dict_answers, list_fields):
+        """
+        Evaluate branching logic of all fields (e.g. when app is started)
+        """
+        dict_hide = {field_name: False for field_name in list_fields}
+        for field_name in self.dict_rank:
+            dict_hide[field_name] = self.is_hidden(field_name, dict_answers, dict_hide)
+        return dict_hide
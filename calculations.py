@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Engine of calculated fields (Redcap "calc" fields)
+
+The equation of each calc field (column "Choices, Calculations, OR Slider
+Labels") is compiled once when the app is started, with the parser of
+branching logic (see branching.py), e.g.:
+    sum([cdai_stools_d1], [cdai_stools_d2]) * 2 + round([cdai_weight] / 10, 1)
+A reverse dependency index (field -> calc fields to compute again, in
+evaluation order) is built from the fields of each equation, so that an answer
+only recomputes the calc fields that depend on it (directly or through other
+calc fields), whatever the size of the data dictionary.
+
+Calc fields are computed in the browser when an answer changes (same ASTs and
+indexes, see get_rules and assets/delectable.js), and on the server from the
+whole record (values restored from drafts, review and submission). The value of
+a calc field is a number, or None if the equation is undefined (e.g. an answer
+is empty, or division by zero).
+"""
+
+from branching import BranchingLogic, BranchingLogicError, compile_ast, get_fields_from_ast, get_number, parse_expression
+
+
+def get_value_from_string(string):
+    """
+    Return value of a calc field from the result of its equation (int if integer, None if not a number)
+    """
+    number = get_number(string)
+    if number is None:
+        return None
+    return int(number) if number.is_integer() else number
+
+
+class Calculations:
+    """
+    Compiled equations of all calc fields, with reverse dependency index
+    Inputs:
+        - dict_equations: field name -> equation (fields that are not calc fields are omitted)
+    """
+
+    def __init__(self, dict_equations):
+        self.dict_ast = {}
+        self.dict_functions = {}
+        dict_sources = {}
+        for field_name, equation in dict_equations.items():
+            try:
+                ast = parse_expression(str(equation))
+            except BranchingLogicError as e:
+                raise BranchingLogicError(f'Calc field {field_name}: {e}') from None
+            self.dict_ast[field_name] = ast
+            self.dict_functions[field_name] = compile_ast(ast)
+            dict_sources[field_name] = get_fields_from_ast(ast)
+
+        # Order calc fields so that a calc field is always computed after the calc fields it depends on
+        try:
+            list_order = BranchingLogic.get_topological_order(dict_sources)
+        except BranchingLogicError as e:
+            raise BranchingLogicError(f'Calc fields: {e}') from None
+        self.dict_rank = {field_name: i for i, field_name in enumerate(list_order)}
+
+        # Reverse index: field -> calc fields to compute again (transitive, evaluation order)
+        dict_dependents = {}
+        for field_name, set_sources in dict_sources.items():
+            for source in set_sources:
+                dict_dependents.setdefault(source, set()).add(field_name)
+        self.dict_affected = {}
+        for source in dict_dependents:
+            set_affected = set()
+            list_todo = [source]
+            while list_todo:
+                for field_name in dict_dependents.get(list_todo.pop(), ()):
+                    if field_name not in set_affected:
+                        set_affected.add(field_name)
+                        list_todo.append(field_name)
+            self.dict_affected[source] = tuple(sorted(set_affected, key=self.dict_rank.get))
+
+    def get_rules(self):
+        """
+        Return compiled equations as JSON (computed in the browser by assets/delectable.js):
+            - equations: calc field -> AST (tuples become lists)
+            - affected: field -> calc fields to compute again when field changes (evaluation order)
+        """
+        return {
+            'equations': self.dict_ast,
+            'affected': {source: list(fields) for source, fields in self.dict_affected.items()},
+        }
+
+    def get_sources(self):
+        """
+        Return list of fields that calc fields depend on
+        """
+        return list(self.dict_affected)
+
+    def compute(self, field_name, dict_answers):
+        """
+        Return value of one calc field (answers of calc fields it depends on must be up to date)
+        """
+        return get_value_from_string(self.dict_functions[field_name](dict_answers.get))
+
+    def get_delta(self, field_name_ref, dict_answers):
+        """
+        Same as getCalcDelta of assets/delectable.js, where calc fields are computed when an answer changes
+        (used by benchmarks to do what the browser does, and tested against the browser in tests/test_parity.py)
+        Inputs:
+            - field_name_ref: field whose answer has changed
+            - dict_answers: answers of the fields used in equations, and values of the calc fields that are rendered
+              (calc fields of forms that are not rendered are computed when an equation needs them)
+        Output:
+            - dict: calc field -> value, only for calc fields affected by field_name_ref
+        """
+        dict_answers = dict(dict_answers)
+
+        def get_value(name):
+            if name not in dict_answers and name in self.dict_functions:
+                dict_answers[name] = None
+                dict_answers[name] = get_value_from_string(self.dict_functions[name](get_value))
+            return dict_answers.get(name)
+
+        dict_delta = {}
+        for field_name in self.dict_affected.get(field_name_ref, ()):
+            dict_answers[field_name] = dict_delta[field_name] = get_value_from_string(self.dict_functions[field_name](get_value))
+        return dict_delta
+
+    def get_values(self, dict_answers):
+        """
+        Compute all calc fields from the whole record (e.g. when a record is reviewed or submitted)
+        """
+        dict_answers = dict(dict_answers)
+        dict_values = {}
+        for field_name in self.dict_rank:
+            dict_answers[field_name] = dict_values[field_name] = self.compute(field_name, dict_answers)
+        return dict_values
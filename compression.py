@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Precompressed responses of the layout and dependencies of Dash apps
+
+Dash serializes the layout (/_dash-layout) and the callbacks (/_dash-dependencies)
+again for every page that is loaded, and compresses them again (Flask-Compress, if
+the compress option of Dash is on).
+Both only change when the data dictionary changes, so they are serialized once
+per version of the data dictionary, compressed once (Brotli at maximum quality,
+gzip), and served with a strong ETag: browsers that load the page again send
+If-None-Match and get a 304 without a body.
+
+With a server-side session store, the layout has a new session id for each
+page: the layout is serialized once around a placeholder, the session id is
+inserted for each request and the response is compressed at a faster level
+(no ETag). Dependencies are the same for all pages.
+
+Environment variables:
+    - DELECTABLE_COMPRESS: encodings of precompressed responses, in order of preference
+      (default: br,gzip; empty: responses of Dash are kept, compressed or not depending on
+      the compress option of Dash)
+"""
+
+import gzip
+import hashlib
+import json
+import os
+
+import flask
+import plotly
+
+try:
+    import brotli
+except ImportError: # gzip only
+    brotli = None
+
+from metrics import get_logger
+
+
+LIST_ENCODINGS = ['br', 'gzip']
+# Compression of responses that are compressed once, and of responses compressed for each request
+BROTLI_QUALITY = 11
+GZIP_LEVEL = 9
+BROTLI_QUALITY_DYNAMIC = 5
+GZIP_LEVEL_DYNAMIC = 6
+
+logger = get_logger('compression')
+
+
+def get_config_compression_from_env():
+    """
+    Return configuration of precompressed responses from environment variables
+    """
+    encodings = os.environ.get('DELECTABLE_COMPRESS', ','.join(LIST_ENCODINGS))
+    return dict(
+        encodings = [i.strip() for i in encodings.split(',') if i.strip()],
+    )
+
+
+def compress(body, encoding, bool_dynamic=False):
+    """
+    Return body (bytes) compressed with an encoding (br or gzip)
+    """
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY_DYNAMIC if bool_dynamic else BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL_DYNAMIC if bool_dynamic else GZIP_LEVEL, mtime=0)
+    raise ValueError(f'Unknown encoding: {encoding!r}')
+
+
+def get_encoding(list_encodings):
+    """
+    Return first encoding (order of preference of the server) accepted by the browser of the request, or None
+    """
+    for encoding in list_encodings:
+        if flask.request.accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def get_response(body, encoding, etag=None):
+    response = flask.Response(body, mimetype='application/json')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    if etag is not None:
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache' # browser checks ETag, data dictionary may change
+    return response
+
+
+###################################################
+# Responses
+###################################################
+
+class StaticResponse:
+    """
+    JSON response compressed once, with a strong ETag for each encoding (e.g. "<hash>-br")
+    Inputs:
+        - body: JSON (bytes)
+        - list_encodings: encodings to precompute, in order of preference
+    """
+
+    def __init__(self, body, list_encodings):
+        self.list_encodings = list_encodings
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.dict_variants = {None: (body, f'"{digest}"')} # encoding -> (body, ETag)
+        for encoding in list_encodings:
+            self.dict_variants[encoding] = (compress(body, encoding), f'"{digest}-{encoding}"')
+
+    def serve(self):
+        encoding = get_encoding(self.list_encodings)
+        body, etag = self.dict_variants[encoding]
+        if flask.request.if_none_match.contains_weak(etag.strip('"')):
+            response = flask.Response(status=304)
+            response.headers['ETag'] = etag
+            response.headers['Vary'] = 'Accept-Encoding'
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return get_response(body, encoding, etag)
+
+
+class DynamicResponse:
+    """
+    JSON response where a placeholder (JSON string) is replaced for each request, compressed for each request
+    Inputs:
+        - body: JSON (bytes) that contains the placeholder once
+        - placeholder: string replaced, e.g. session id
+        - get_value: function that returns the value (JSON) of the placeholder for a request
+    """
+
+    def __init__(self, body, placeholder, get_value, list_encodings):
+        self.list_encodings = list_encodings
+        self.prefix, self.suffix = body.split(json.dumps(placeholder).encode(), 1)
+        self.get_value = get_value
+
+    def serve(self):
+        encoding = get_encoding(self.list_encodings)
+        body = self.prefix + json.dumps(self.get_value()).encode() + self.suffix
+        if encoding is not None:
+            body = compress(body, encoding, bool_dynamic=True)
+        return get_response(body, encoding)
+
+
+###################################################
+# Routes of a Dash app
+###################################################
+
+class CompressedRoutes:
+    """
+    Precompressed layout and dependencies of a Dash app (views replace the views of Dash)
+    """
+
+    def __init__(self, app, list_encodings, placeholder=None, get_value=None):
+        self.app = app
+        self.list_encodings = list_encodings
+        self.placeholder = placeholder
+        self.get_value = get_value
+        self.layout = None
+        self.dependencies = None
+        prefix = app.config.routes_pathname_prefix
+        app.server.view_functions[prefix + '_dash-layout'] = self.serve_layout
+        app.server.view_functions[prefix + '_dash-dependencies'] = self.serve_dependencies
+
+    def update(self, layout):
+        """
+        Serialize and compress layout and dependencies (once for each version of the data dictionary)
+        Inputs:
+            - layout: layout of the app (components), with the placeholder if the layout changes for each page
+        """
+        body_layout = json.dumps(layout, cls=plotly.utils.PlotlyJSONEncoder, separators=(',', ':')).encode()
+        if self.placeholder is None:
+            self.layout = StaticResponse(body_layout, self.list_encodings)
+        else:
+            self.layout = DynamicResponse(body_layout, self.placeholder, self.get_value, self.list_encodings)
+        body_dependencies = flask.json.dumps(self.app._callback_list, separators=(',', ':')).encode()
+        self.dependencies = StaticResponse(body_dependencies, self.list_encodings)
+        logger.info('%s: layout %d bytes, dependencies %d bytes', self.app.config.routes_pathname_prefix,
+                    len(body_layout), len(body_dependencies))
+
+    def serve_layout(self):
+        return self.layout.serve()
+
+    def serve_dependencies(self):
+        return self.dependencies.serve()
+
+
+def init_app(app, layout, encodings=LIST_ENCODINGS, placeholder=None, get_value=None):
+    """
+    Serve layout and dependencies of a Dash app from precompressed responses (call after callbacks are registered)
+    Inputs:
+        - layout: layout of the app (components)
+        - encodings: encodings in order of preference (empty: responses of Dash are kept)
+        - placeholder, get_value: string of the layout replaced by get_value() for each page (e.g. session id)
+    Return CompressedRoutes (None if disabled), whose update method is called when the data dictionary changes
+    """
+    if not encodings:
+        return None
+    if 'br' in encodings and brotli is None:
+        logger.warning('Brotli is not installed, layout is compressed with gzip only')
+        encodings = [i for i in encodings if i != 'br']
+    routes = CompressedRoutes(app, encodings, placeholder, get_value)
+    routes.update(layout)
+    return routes
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Loader of the Redcap data dictionary
+
+By default, the dictionary bundled with the app (resources/*.xlsx) is read.
+Parsing Excel files is slow, so the parsed dataframes are saved as a snapshot
+(pickle) named after the content hash of the source files. Workers and
+restarts reuse the snapshot until a source file changes.
+
+The content hash is also the version of the data dictionary. The fields can be
+reloaded from the Redcap metadata API (see metadata.py): each version is saved
+as a snapshot, so that any worker can load the version of a page that was
+loaded by another worker.
+
+Environment variables:
+    - DELECTABLE_FORMS, DELECTABLE_FIELDS: path (or URL) of forms and fields (Excel or CSV)
+    - DELECTABLE_CACHE: folder of snapshots (empty string to disable snapshots)
+"""
+
+import hashlib
+import io
+import json
+import os
+import pickle
+import re
+import tempfile
+
+import pandas as pd
+import requests
+
+from metrics import get_logger
+
+
+PATH_ROOT = os.path.dirname(os.path.abspath(__file__))
+PATH_FORMS = os.path.join(PATH_ROOT, 'resources', 'list_forms_v3.xlsx')
+PATH_FIELDS = os.path.join(PATH_ROOT, 'resources', 'list_fields_v3.xlsx')
+PATH_CACHE = os.path.join(PATH_ROOT, '.cache')
+SNAPSHOT_VERSION = 1 # increase when the content of snapshots changes
+TIMEOUT_DOWNLOAD = 30
+
+# Keys of the Redcap metadata API -> columns of the data dictionary (as exported by Redcap)
+DICT_COLUMNS_METADATA = {
+    'field_name': 'Variable / Field Name',
+    'form_name': 'Form Name',
+    'section_header': 'Section Header',
+    'field_type': 'Field Type',
+    'field_label': 'Field Label',
+    'select_choices_or_calculations': 'Choices, Calculations, OR Slider Labels',
+    'field_note': 'Field Note',
+    'text_validation_type_or_show_slider_number': 'Text Validation Type OR Show Slider Number',
+    'text_validation_min': 'Text Validation Min',
+    'text_validation_max': 'Text Validation Max',
+    'identifier': 'Identifier?',
+    'branching_logic': 'Branching Logic (Show field only if...)',
+    'required_field': 'Required Field?',
+    'custom_alignment': 'Custom Alignment',
+    'question_number': 'Question Number (surveys only)',
+    'matrix_group_name': 'Matrix Group Name',
+    'matrix_ranking': 'Matrix Ranking?',
+    'field_annotation': 'Field Annotation',
+}
+FIELD_RECORD_ID = 'record_id' # record id of the Redcap project (patient code, not a question)
+
+logger = get_logger('dictionary')
+
+
+def read_source(path):
+    """
+    Return content (bytes) of a file of the data dictionary (local path or URL)
+    """
+    if path.startswith('http://') or path.startswith('https://'):
+        r = requests.get(path, timeout=TIMEOUT_DOWNLOAD)
+        r.raise_for_status()
+        return r.content
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_dictionary(path, content):
+    """
+    Parse one sheet of the Redcap data dictionary (Excel file, or CSV file)
+    """
+    if path.endswith('.csv'):
+        return pd.read_csv(io.BytesIO(content))
+    return pd.read_excel(io.BytesIO(content))
+
+
+def get_hash(list_contents):
+    """
+    Return content hash of the source files (used to name the snapshot)
+    """
+    h = hashlib.sha256(f'v{SNAPSHOT_VERSION}'.encode())
+    for content in list_contents:
+        h.update(hashlib.sha256(content).digest())
+    return h.hexdigest()[:32]
+
+
+def read_snapshot(path_snapshot):
+    """
+    Return (df_forms, df_fields) from snapshot, or None if snapshot is missing or unreadable
+    """
+    try:
+        with open(path_snapshot, 'rb') as f:
+            return pickle.load(f)
+    except Exception: # missing file, or snapshot written by another version of pandas
+        return None
+
+
+def write_snapshot(path_snapshot, snapshot):
+    """
+    Write snapshot atomically (several workers may write the same snapshot at the same time)
+    """
+    path_dir = os.path.dirname(path_snapshot)
+    try:
+        os.makedirs(path_dir, exist_ok=True)
+        fd, path_tmp = tempfile.mkstemp(dir=path_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path_tmp, path_snapshot)
+    except OSError as e: # read-only file system: app works without snapshot
+        logger.warning('Snapshot not written: %s', e)
+
+
+def get_path_snapshot(path_cache, version):
+    return os.path.join(path_cache, f'dictionary_{version}.pkl')
+
+
+def load_data_dictionary(path_forms=None, path_fields=None, path_cache=None):
+    """
+    This function is called once when app is started
+    Return three outputs:
+        - df_forms: list of forms
+        - df_fields: list of fields (Redcap data dictionary)
+        - version: content hash of the source files
+    """
+    path_forms = path_forms or os.environ.get('DELECTABLE_FORMS') or PATH_FORMS
+    path_fields = path_fields or os.environ.get('DELECTABLE_FIELDS') or PATH_FIELDS
+    path_cache = os.environ.get('DELECTABLE_CACHE', PATH_CACHE) if path_cache is None else path_cache
+
+    content_forms = read_source(path_forms)
+    content_fields = read_source(path_fields)
+
+    # Reuse snapshot if source files have not changed
+    version = get_hash([content_forms, content_fields])
+    path_snapshot = None
+    if path_cache:
+        path_snapshot = get_path_snapshot(path_cache, version)
+        snapshot = read_snapshot(path_snapshot)
+        if snapshot is not None:
+            return (*snapshot, version)
+
+    # Parse source files (slow) and save snapshot
+    snapshot = (read_dictionary(path_forms, content_forms), read_dictionary(path_fields, content_fields))
+    if path_snapshot is not None:
+        write_snapshot(path_snapshot, snapshot)
+    return (*snapshot, version)
+
+
+###################################################
+# Versions of the data dictionary (Redcap metadata API)
+###################################################
+
+def get_fields_from_metadata(list_metadata, list_forms):
+    """
+    Return list of fields (same columns as the data dictionary exported by Redcap) from the Redcap metadata API
+    Inputs:
+        - list_metadata: fields as exported by the API (content=metadata, format=json)
+        - list_forms: forms of the app (fields of other instruments and the record id are not questions of the app)
+    """
+    set_forms = set(list_forms)
+    list_rows = []
+    for item in list_metadata:
+        if item.get('form_name') not in set_forms or item.get('field_name') == FIELD_RECORD_ID:
+            continue
+        list_rows.append({column: item.get(key) if item.get(key) != '' else None
+                          for key, column in DICT_COLUMNS_METADATA.items()})
+    return pd.DataFrame(list_rows, columns=list(DICT_COLUMNS_METADATA.values()))
+
+
+def get_metadata_from_fields(df_fields):
+    """
+    Return fields as exported by the Redcap metadata API, from the data dictionary (e.g. for redcap_stub.py)
+    """
+    list_metadata = []
+    for row in df_fields.to_dict('records'):
+        item = {}
+        for key, column in DICT_COLUMNS_METADATA.items():
+            value = row.get(column)
+            if value is None or pd.isna(value):
+                value = ''
+            elif isinstance(value, float) and value.is_integer():
+                value = str(int(value))
+            item[key] = str(value)
+        list_metadata.append(item)
+    return list_metadata
+
+
+def get_version_from_metadata(df_forms, list_metadata):
+    """
+    Return version of a data dictionary whose fields are read from the Redcap metadata API
+    (same version in all workers and after a restart, for the same forms and metadata)
+    """
+    content_forms = df_forms.to_json(orient='split').encode()
+    content_metadata = json.dumps(list_metadata, sort_keys=True).encode()
+    return get_hash([content_forms, content_metadata])
+
+
+def save_version(df_forms, df_fields, version, path_cache=None):
+    """
+    Save a version of the data dictionary as a snapshot (read by load_version in other workers)
+    """
+    path_cache = os.environ.get('DELECTABLE_CACHE', PATH_CACHE) if path_cache is None else path_cache
+    if path_cache:
+        write_snapshot(get_path_snapshot(path_cache, version), (df_forms, df_fields))
+
+
+def load_version(version, path_cache=None):
+    """
+    Return (df_forms, df_fields) of a version of the data dictionary, or None if it has no snapshot
+    """
+    path_cache = os.environ.get('DELECTABLE_CACHE', PATH_CACHE) if path_cache is None else path_cache
+    if not path_cache or not re.fullmatch(r'[0-9a-f]{32}', str(version)): # version is sent by browsers
+        return None
+    return read_snapshot(get_path_snapshot(path_cache, version))
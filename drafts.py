@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Autosave of draft answers, per patient and visit day
+
+Every answer is appended to a write-ahead log (one JSON line per answer, one
+file per patient code and visit day), so that a draft survives a browser
+refresh or a restart of the app. Appends only write to the OS: files are
+synced to disk in batches by a background thread, which also compacts long
+logs (only the last answer of each field is kept).
+
+Environment variables:
+    - DELECTABLE_DRAFTS: folder of draft logs (default: empty, autosave is disabled). Answers are
+      saved as plain text: use a folder outside the repository, readable only by the app
+    - DRAFTS_FSYNC_INTERVAL: time between two syncs of draft logs to disk (seconds)
+    - DRAFTS_COMPACT_LINES: logs longer than this are compacted
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl # several gunicorn workers may write the same log
+except ImportError: # Windows: development server only (one process)
+    fcntl = None
+
+from metrics import get_logger
+
+
+MAX_FILES_OPEN = 64
+
+logger = get_logger('drafts')
+
+
+def get_config_drafts_from_env():
+    """
+    Return configuration of draft logs from environment variables
+    """
+    return dict(
+        path = os.environ.get('DELECTABLE_DRAFTS', ''),
+        fsync_interval = float(os.environ.get('DRAFTS_FSYNC_INTERVAL', 1)),
+        compact_lines = int(os.environ.get('DRAFTS_COMPACT_LINES', 200)),
+    )
+
+
+def lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def is_current(f, path):
+    """
+    Return True if open file f is still the file at path
+    """
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def read_log(path):
+    """
+    Return answers of a draft log (last answer of each field), and number of lines
+    A line that was only partly written (crash) is ignored
+    """
+    dict_answers = {}
+    n_lines = 0
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                n_lines += 1
+                try:
+                    dict_answers.update(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return dict_answers, n_lines
+
+
+class DraftStore:
+    """
+    Draft logs of a folder, with open files kept in cache (least recently used files are closed)
+    """
+
+    def __init__(self, path, fsync_interval=1, compact_lines=200, **kwargs):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_lines = compact_lines
+        self.dict_files = {} # path -> [file, number of lines, dirty]
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        os.makedirs(path, exist_ok=True)
+
+    def get_path(self, patient_code, day):
+        """
+        Return path of the draft log of a patient and day (patient code is sanitized, hash avoids collisions)
+        """
+        code = str(patient_code)
+        name = re.sub(r'[^A-Za-z0-9_-]', '_', code)[:40]
+        digest = hashlib.sha1(code.encode()).hexdigest()[:8]
+        return os.path.join(self.path, f'{name}_{digest}_d{day}.jsonl')
+
+    def get_file(self, path):
+        """
+        Return cached [file, number of lines, dirty]
+        """
+        item = self.dict_files.pop(path, None)
+        if item is None:
+            item = [open(path, 'a', encoding='utf-8'), 0, False]
+        self.dict_files[path] = item # most recently used is last
+        while len(self.dict_files) > MAX_FILES_OPEN:
+            self.close(next(iter(self.dict_files)))
+        return item
+
+    def close(self, path):
+        item = self.dict_files.pop(path, None)
+        if item is not None:
+            if item[2]:
+                item[0].flush()
+                os.fsync(item[0].fileno())
+            item[0].close()
+
+    def append(self, patient_code, day, dict_delta):
+        """
+        Append answers that have changed (field name -> value) to the draft log
+        """
+        self.start()
+        path = self.get_path(patient_code, day)
+        line = json.dumps(dict_delta) + '\n'
+        with self.lock:
+            while True:
+                item = self.get_file(path)
+                lock_file(item[0])
+                try:
+                    if is_current(item[0], path): # not compacted or deleted by another process
+                        item[0].write(line)
+                        item[0].flush() # one write system call, lines of processes are not mixed
+                        break
+                finally:
+                    unlock_file(item[0])
+                item[0].close()
+                del self.dict_files[path]
+            item[1] += 1
+            item[2] = True
+
+    def load(self, patient_code, day):
+        """
+        Return answers of the draft of a patient and day (field name -> value), empty if there is no draft
+        """
+        return read_log(self.get_path(patient_code, day))[0]
+
+    def delete(self, patient_code, day):
+        """
+        Delete draft (e.g. when record has been submitted)
+        """
+        path = self.get_path(patient_code, day)
+        with self.lock:
+            self.close(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def compact(self, path):
+        """
+        Replace draft log by one line per field (last answer), must be called with self.lock
+        """
+        item = self.dict_files[path]
+        lock_file(item[0])
+        try:
+            dict_answers, _ = read_log(path)
+            fd, path_tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for field_name, value in dict_answers.items():
+                    f.write(json.dumps({field_name: value}) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path_tmp, path)
+        finally:
+            unlock_file(item[0])
+        item[0].close()
+        del self.dict_files[path]
+
+    def flush(self):
+        """
+        Sync modified logs to disk, and compact long logs
+        """
+        with self.lock:
+            for path in list(self.dict_files):
+                item = self.dict_files[path]
+                if item[1] > self.compact_lines:
+                    self.compact(path)
+                elif item[2]:
+                    os.fsync(item[0].fileno())
+                    item[2] = False
+
+    def start(self):
+        """
+        Start thread that syncs logs (if needed), this is done after gunicorn has forked
+        """
+        if self.pid == os.getpid() and self.thread is not None:
+            return
+        with self.lock:
+            if self.pid != os.getpid() or self.thread is None:
+                self.dict_files = {} # files opened by parent process are not used
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name='drafts-fsync', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            try:
+                self.flush()
+            except OSError as e: # thread must keep running
+                logger.error('Drafts not synced: %s', e)
+
+
+def create_draft_store(path, **kwargs):
+    """
+    Return draft store, or None if autosave is disabled (empty path)
+    """
+    if not path:
+        return None
+    return DraftStore(path, **kwargs)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Field registry compiled once from the Redcap data dictionary
+
+Each row of the data dictionary becomes an immutable FieldSpec, so that the
+callbacks look up labels, choices and component types in a dictionary instead
+of filtering df_fields on every call.
+
+The column "Choices, Calculations, OR Slider Labels" is compiled once per field,
+depending on the field type:
+    - dropdown, radio, checkbox: code -> label (dict_options), codes are int or str
+    - yesno, truefalse: fixed choices of Redcap (dict_options)
+    - slider: position (0, 50, 100) -> label (dict_marks)
+    - calc: equation (calculation)
+"""
+
+import re
+import types
+
+import pandas as pd
+
+
+###################################################
+# Columns of the Redcap data dictionary
+###################################################
+
+COL_FIELD_NAME = 'Variable / Field Name'
+COL_FORM_NAME = 'Form Name'
+COL_SECTION_HEADER = 'Section Header'
+COL_FIELD_TYPE = 'Field Type'
+COL_FIELD_LABEL = 'Field Label'
+COL_CHOICES = 'Choices, Calculations, OR Slider Labels'
+COL_FIELD_NOTE = 'Field Note'
+COL_VALIDATION = 'Text Validation Type OR Show Slider Number'
+COL_VALIDATION_MIN = 'Text Validation Min'
+COL_VALIDATION_MAX = 'Text Validation Max'
+COL_BRANCHING_LOGIC = 'Branching Logic (Show field only if...)'
+COL_REQUIRED = 'Required Field?'
+
+
+###################################################
+# Choices of fields that are not listed in the data dictionary
+###################################################
+
+DICT_OPTIONS_YESNO = {1:'Yes', 0:'No'}
+DICT_OPTIONS_TRUEFALSE = {1:'True', 0:'False'}
+LIST_SLIDER_POSITIONS = [0, 50, 100] # slider labels are shown left, middle and right
+REGEX_INTEGER = re.compile(r'-?\d+$')
+
+
+###################################################
+# Field specification
+###################################################
+
+class FieldSpec:
+    """
+    Immutable description of one field (one row of the data dictionary)
+    """
+    __slots__ = ('name', 'form', 'position', 'field_type', 'type_component', 'label',
+                 'choices', 'dict_options', 'dict_marks', 'calculation', 'note', 'section_header',
+                 'validation', 'validation_min', 'validation_max', 'branching_logic', 'required')
+
+    def __init__(self, **kwargs):
+        for key in self.__slots__:
+            object.__setattr__(self, key, kwargs.get(key))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'FieldSpec is read-only: {key}')
+
+    def __delattr__(self, key):
+        raise AttributeError(f'FieldSpec is read-only: {key}')
+
+    def __repr__(self):
+        return f'FieldSpec({self.name!r}, form={self.form!r}, type={self.type_component!r})'
+
+
+def get_value_or_none(value):
+    """
+    Replace empty cells of the data dictionary (NaN) by None
+    """
+    return None if pd.isna(value) else value
+
+
+def get_code_from_string(code):
+    """
+    Return code of a choice: int for numeric codes (e.g. '1'), str otherwise (e.g. 'A', 'unk')
+    """
+    code = code.strip()
+    return int(code) if REGEX_INTEGER.match(code) else code
+
+
+def get_dict_options(choices):
+    """
+    Get dictionary of options from raw string in Redcap dictionary ("code, label | code, label")
+    Labels may contain commas, a choice without comma is used as both code and label
+    """
+    if choices is None or pd.isna(choices):
+        return {}
+    else:
+        dict_choices = {}
+        for choice in str(choices).split('|'):
+            if not choice.strip():
+                continue
+            code, _, label = choice.partition(',')
+            dict_choices[get_code_from_string(code)] = label.strip() if _ else code.strip()
+        return dict_choices
+
+
+def get_dict_marks(choices):
+    """
+    Get dictionary of slider marks from raw string in Redcap dictionary ("left | middle | right")
+    """
+    if choices is None or pd.isna(choices):
+        return {}
+    list_labels = [label.strip() for label in str(choices).split('|')]
+    if len(list_labels) == 2: # left and right labels only
+        list_labels = [list_labels[0], '', list_labels[1]]
+    return {position: label for position, label in zip(LIST_SLIDER_POSITIONS, list_labels) if label}
+
+
+def compile_choices(field_type, choices):
+    """
+    Compile column "Choices, Calculations, OR Slider Labels" of one field
+    Return three outputs:
+        - dict_options: code -> label (fields whose answer is a code)
+        - dict_marks: slider position -> label (slider fields)
+        - calculation: equation (calc fields)
+    """
+    if field_type == 'yesno':
+        return dict(DICT_OPTIONS_YESNO), {}, None
+    if field_type == 'truefalse':
+        return dict(DICT_OPTIONS_TRUEFALSE), {}, None
+    if field_type == 'slider':
+        return {}, get_dict_marks(choices), None
+    if field_type == 'calc':
+        return {}, {}, choices
+    return get_dict_options(choices), {}, None
+
+
+def get_type_component_from_row(field_type, field_type_alt):
+    """
+    Return type of component (be careful: text has subtypes)
+    """
+    if field_type == 'text':
+        return field_type if field_type_alt is None else field_type_alt
+    return field_type
+
+
+###################################################
+# Registry
+###################################################
+
+def build_field_index(df_fields):
+    """
+    This function is called once when app is started
+    Return one output:
+        - mapping: field name -> FieldSpec, in the order of the data dictionary (read-only)
+    """
+    dict_fields = {}
+    dict_position = {}
+    for row in df_fields.to_dict('records'):
+        row = {key: get_value_or_none(row.get(key)) for key in row}
+        form = row[COL_FORM_NAME]
+        dict_position[form] = dict_position.get(form, 0) + 1
+        field_type = row[COL_FIELD_TYPE]
+        validation = row.get(COL_VALIDATION)
+        dict_options, dict_marks, calculation = compile_choices(field_type, row.get(COL_CHOICES))
+        dict_fields[row[COL_FIELD_NAME]] = FieldSpec(
+            name=row[COL_FIELD_NAME],
+            form=form,
+            position=dict_position[form],
+            field_type=field_type,
+            type_component=get_type_component_from_row(field_type, validation),
+            label=row[COL_FIELD_LABEL],
+            choices=row.get(COL_CHOICES),
+            dict_options=types.MappingProxyType(dict_options),
+            dict_marks=types.MappingProxyType(dict_marks),
+            calculation=calculation,
+            note=row.get(COL_FIELD_NOTE),
+            section_header=row.get(COL_SECTION_HEADER),
+            validation=validation,
+            validation_min=row.get(COL_VALIDATION_MIN),
+            validation_max=row.get(COL_VALIDATION_MAX),
+            branching_logic=row.get(COL_BRANCHING_LOGIC),
+            required=row.get(COL_REQUIRED) == 'y',
+        )
+    return types.MappingProxyType(dict_fields)
+
+
+def build_form_index(field_index):
+    """
+    This function is called once when app is started
+    Return one output:
+        - mapping: form name -> tuple of FieldSpec (in the order of the data dictionary)
+    """
+    dict_forms = {}
+    for field in field_index.values():
+        dict_forms.setdefault(field.form, []).append(field)
+    return types.MappingProxyType({form: tuple(dict_forms[form]) for form in dict_forms})
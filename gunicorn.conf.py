@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration of gunicorn, read from the current directory (Procfile: gunicorn app:server)
+
+With preload (default), app.py is imported once by the master process: data
+dictionaries, field indexes, layouts, templates of all forms, compressed
+responses and callbacks are built before workers are forked, and workers share
+these pages (copy-on-write) instead of building them again.
+
+The garbage collector is disabled while the app is imported, and objects of the
+master are frozen (gc.freeze) just before workers are forked: collections in
+workers do not scan them, so they do not write to their pages. The garbage
+collector of the master is enabled again once its objects are frozen. Reading an object
+still updates its reference count, so some shared pages are copied by each
+worker over time.
+
+Each worker logs its memory when it has started and when it exits, and reports
+it on /metrics (delectable_process_memory_bytes, see metrics.py).
+
+Environment variables:
+    - DELECTABLE_PRELOAD: import app.py in the master before forking workers (default: 1, 0 to disable)
+    - WEB_CONCURRENCY: number of workers (read by gunicorn, default: 1)
+"""
+
+import gc
+import os
+
+from metrics import get_memory_text
+
+
+preload_app = os.environ.get('DELECTABLE_PRELOAD', '1') != '0'
+
+if preload_app:
+    gc.disable() # no collections (and no freed holes in pages) while the app is imported
+
+
+def when_ready(server):
+    """
+    Master: app has been imported (preload), workers are about to be forked
+    """
+    if preload_app:
+        import app
+        app.prepare_workers()
+        gc.freeze()
+        gc.enable() # frozen objects are not collected (master lives until workers are stopped, or reloads)
+    server.log.info('Master memory: %s', get_memory_text())
+
+
+def post_fork(server, worker):
+    gc.enable()
+
+
+def post_worker_init(worker):
+    worker.log.info('Worker %s started, memory: %s', worker.pid, get_memory_text())
+
+
+def worker_exit(server, worker):
+    server.log.info('Worker %s exits, memory: %s', worker.pid, get_memory_text())
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk ingestion of records collected offline (e.g. paper forms keyed into a spreadsheet)
+
+Records are read from a CSV file (one row per record, one column per field) or
+a JSONL file (one JSON object per line), and go through the same pipeline as a
+record submitted in the app:
+    - answers are normalized as the components of the app store them (codes of
+      choices, dates of date pickers as YYYY-MM-DD, numbers of number inputs)
+    - calc fields are computed, answers of fields hidden by branching logic are removed
+    - answers are checked with the validation rules of the study (forms of the visit day)
+Records are checked by a pool of processes (each process compiles the study once).
+Valid records are written as Redcap-ready batches (JSON files, as imported by the
+outbox), invalid records are reported per field (rejects.csv). Nothing is sent to
+Redcap, unless valid records are added to the outbox (--outbox).
+
+Columns (or keys) of a record:
+    - record_id: patient code (required)
+    - visit_day: day of the visit (optional, default: --day; no day: fields of all forms are checked)
+    - names of fields of the data dictionary (calc fields are computed again, other columns are ignored)
+
+Usage (from the root of the repository):
+    python ingest.py records.csv                      # batches and rejects in records_redcap/
+    python ingest.py records.jsonl --out out --workers 8
+    python ingest.py records.csv --day 7 --outbox     # also add valid records to the outbox,
+    python outbox.py flush                            # which are sent by the app or by this command
+
+The data dictionary, studies and outbox are those of the app (environment variables, see study.py).
+"""
+
+import argparse
+import collections
+import csv
+import datetime
+import glob
+import json
+import math
+import multiprocessing
+import os
+import re
+import time
+
+from branching import get_string_from_answer
+from metrics import get_logger
+from study import Study, get_dict_answers, get_dict_answers_final, get_studies_from_env
+
+
+COL_RECORD_ID = 'record_id'
+COL_VISIT_DAY = 'visit_day'
+LIST_COLUMNS_REJECTS = ['line', 'record_id', 'field', 'form', 'answer', 'message']
+LIST_TYPES_NUMBER = ['integer', 'number', 'slider'] # components whose answer is a number (see app.DICT_INPUT_TYPES)
+LIST_TYPES_IGNORED = ['calc', 'descriptive']
+DICT_DATE_ORDERS = {'date_dmy': 'dmy', 'date_mdy': 'mdy', 'date_ymd': 'ymd'} # order of display formats of date pickers
+REGEX_DATE_ISO = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$')
+REGEX_DATE = re.compile(r'^(\d{1,4})[/.-](\d{1,2})[/.-](\d{1,4})$')
+REGEX_SEPARATOR = re.compile(r'[,;|]') # codes of checkbox answers, e.g. "1,3"
+CHUNK_SIZE = 200 # records sent to a process at once
+
+logger = get_logger('ingest')
+
+
+###################################################
+# Normalization of answers (as stored by the components of the app)
+###################################################
+
+def is_blank(value):
+    return value is None or (isinstance(value, float) and math.isnan(value)) or (isinstance(value, str) and value.strip() == '')
+
+
+def get_code(field, value):
+    """
+    Return code of a choice from its code or its label (case-insensitive), or the value itself if it is not a choice
+    """
+    string = get_string_from_answer(value).strip()
+    for code in field.dict_options:
+        if str(code) == string:
+            return code
+    for code, label in field.dict_options.items():
+        if str(label).strip().lower() == string.lower():
+            return code
+    return string
+
+
+def get_date(field, value):
+    """
+    Return date as stored by date pickers (YYYY-MM-DD), from YYYY-MM-DD or the display format of the field,
+    or the value itself if it is not a date
+    """
+    string = str(value).strip()
+    match = REGEX_DATE_ISO.match(string)
+    if match is not None:
+        year, month, day = match.groups()
+    else:
+        match = REGEX_DATE.match(string)
+        if match is None:
+            return string
+        dict_parts = dict(zip(DICT_DATE_ORDERS[field.type_component], match.groups()))
+        year, month, day = dict_parts['y'], dict_parts['m'], dict_parts['d']
+    try:
+        return datetime.date(int(year), int(month), int(day)).isoformat()
+    except ValueError:
+        return string
+
+
+def get_number(value):
+    """
+    Return number as stored by number inputs (int if integer), or the value itself if it is not a number
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value) if float(value).is_integer() else value
+    string = str(value).strip()
+    try:
+        number = float(string)
+    except ValueError:
+        return string
+    if not math.isfinite(number):
+        return string
+    return int(number) if number.is_integer() else number
+
+
+def get_answer(field, value):
+    """
+    Return answer of a field as stored by the app (see app.add_html_component), None if empty
+    Values that cannot be normalized are kept, so that they are reported by validation
+    """
+    if field.field_type == 'checkbox':
+        list_values = value if isinstance(value, list) else [] if is_blank(value) else REGEX_SEPARATOR.split(str(value))
+        return [get_code(field, i) for i in list_values if not is_blank(i)] or None
+    if is_blank(value):
+        return None
+    if isinstance(value, list):
+        return value
+    if field.dict_options:
+        return get_code(field, value)
+    if field.type_component in DICT_DATE_ORDERS:
+        return get_date(field, value)
+    if field.type_component in LIST_TYPES_NUMBER:
+        return get_number(value)
+    return get_string_from_answer(value).strip()
+
+
+###################################################
+# Pipeline of one record (same as submission in the app)
+###################################################
+
+def get_day(study, value, day_default=None):
+    """
+    Return visit day of a record (day_default if empty), or -1 if it is not a day of the schedule
+    """
+    if is_blank(value):
+        return day_default
+    number = get_number(value)
+    return number if number in study.schedule.list_days else -1
+
+
+def check_record(study, record, day_default=None, dict_day_fields=None):
+    """
+    Return two outputs:
+        - dict: record ready for Redcap (None if record is not valid)
+        - list: errors (field name, answer, message)
+    Inputs:
+        - record: field name -> value, with patient code (record_id) and visit day (visit_day, optional)
+        - dict_day_fields: cache of fields of each day (day -> set of field names)
+    """
+    list_errors = []
+    patient_code = record.get(COL_RECORD_ID)
+    if is_blank(patient_code):
+        list_errors.append((COL_RECORD_ID, None, 'Patient code is required'))
+    day = get_day(study, record.get(COL_VISIT_DAY), day_default)
+    if day == -1:
+        list_errors.append((COL_VISIT_DAY, record.get(COL_VISIT_DAY), f'Expected a visit day (1-{study.schedule.n_days})'))
+        day = None
+
+    # Answers (fields of forms that are not available on the visit day cannot be answered in the app)
+    set_fields = None
+    if day is not None:
+        dict_day_fields = {} if dict_day_fields is None else dict_day_fields
+        if day not in dict_day_fields:
+            dict_day_fields[day] = set(study.get_fields(day))
+        set_fields = dict_day_fields[day]
+    dict_answers = get_dict_answers(study.dict_fields)
+    for field_name, value in record.items():
+        field = study.dict_fields.get(field_name)
+        if field is None or field.field_type in LIST_TYPES_IGNORED:
+            continue
+        answer = get_answer(field, value)
+        if answer is None:
+            continue
+        if set_fields is not None and field_name not in set_fields:
+            list_errors.append((field_name, value, f'Form {field.form} is not available on day {day}'))
+            continue
+        dict_answers[field_name] = answer
+
+    # Calc fields, branching logic and validation
+    dict_answers.update(study.calculations.get_values(dict_answers))
+    dict_hide = study.branching_logic.get_dict_hide(dict_answers, study.dict_fields)
+    dict_errors = study.validator.get_errors(dict_answers, dict_hide, None if day is None else study.get_fields(day))
+    for field_name, message in dict_errors.items():
+        list_errors.append((field_name, dict_answers[field_name], message))
+    if list_errors:
+        return None, list_errors
+    record_final = get_dict_answers_final(dict_answers, dict_hide)
+    record_final['record_id'] = get_string_from_answer(patient_code).strip()
+    return record_final, []
+
+
+###################################################
+# Pool of processes
+###################################################
+
+study_worker = None # study compiled by the process (inherited from the parent process if it was forked)
+dict_day_fields_worker = {}
+
+
+def init_worker(config_study):
+    global study_worker
+    if study_worker is None or study_worker.name != config_study['name']:
+        study_worker = Study(**config_study)
+
+
+def check_chunk(chunk):
+    """
+    Check records of a chunk in a process of the pool
+    Inputs:
+        - chunk: (day_default, list of (line, record))
+    Return list of (line, patient code, record ready for Redcap or None, errors)
+    """
+    day_default, list_lines = chunk
+    list_results = []
+    for line, record in list_lines:
+        record_final, list_errors = check_record(study_worker, record, day_default, dict_day_fields_worker)
+        list_results.append((line, record.get(COL_RECORD_ID), record_final, list_errors))
+    return list_results
+
+
+def get_results(list_chunks, config_study, n_workers):
+    """
+    Yield results of records (see check_chunk) in the order of chunks, checked by a pool of processes if n_workers > 1
+    """
+    if n_workers > 1 and len(list_chunks) > 1:
+        with multiprocessing.Pool(n_workers, initializer=init_worker, initargs=(config_study,)) as pool:
+            for list_results in pool.imap(check_chunk, list_chunks):
+                yield from list_results
+    else:
+        init_worker(config_study)
+        for chunk in list_chunks:
+            yield from check_chunk(chunk)
+
+
+###################################################
+# Files
+###################################################
+
+def read_records(path):
+    """
+    Return list of (line, record) of a CSV file (header and one record per row) or a JSONL file
+    """
+    if os.path.splitext(path)[1].lower() in ['.jsonl', '.ndjson', '.json']:
+        list_lines = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line, text in enumerate(f, 1):
+                if text.strip():
+                    list_lines.append((line, json.loads(text)))
+        return list_lines
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        return [(i+2, record) for i, record in enumerate(csv.DictReader(f))]
+
+
+def write_batches(path_dir, list_records, batch_size):
+    """
+    Write records ready for Redcap in batches (JSON files, previous batches of the folder are removed)
+    Return list of paths
+    """
+    for path in glob.glob(os.path.join(path_dir, 'records_*.json')):
+        os.remove(path)
+    list_paths = []
+    for i in range(0, len(list_records), batch_size):
+        path = os.path.join(path_dir, f'records_{i // batch_size + 1:05d}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(list_records[i:i+batch_size])) # faster than json.dump (one call to the C encoder)
+        list_paths.append(path)
+    return list_paths
+
+
+def write_rejects(path, study, list_rejects):
+    """
+    Write invalid answers, one row per field (line, record_id, field, form, answer, message)
+    """
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(LIST_COLUMNS_REJECTS)
+        for line, patient_code, list_errors in list_rejects:
+            for field_name, answer, message in list_errors:
+                field = study.dict_fields.get(field_name)
+                writer.writerow([line, patient_code, field_name, field.form if field else '',
+                                 json.dumps(answer) if isinstance(answer, list) else answer, message])
+
+
+###################################################
+# Command line
+###################################################
+
+def get_study_config(name=None):
+    """
+    Return configuration of a study (first study of DELECTABLE_STUDIES if name is None)
+    """
+    list_configs = get_studies_from_env()
+    for config in list_configs:
+        if name is None or config['name'] == name:
+            return config
+    raise ValueError(f'Unknown study {name!r}: {[config["name"] for config in list_configs]}')
+
+
+def main(list_args=None):
+    parser = argparse.ArgumentParser(description='Check records collected offline and write Redcap-ready batches')
+    parser.add_argument('path', help='CSV or JSONL file of records')
+    parser.add_argument('--out', help='folder of batches and rejects (default: next to the file, e.g. records_redcap)')
+    parser.add_argument('--study', help='name of the study (see DELECTABLE_STUDIES, default: first study)')
+    parser.add_argument('--day', type=int, help='visit day of records without visit_day (default: fields of all forms are checked)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes (1: no pool)')
+    parser.add_argument('--batch-size', type=int, help='records per batch (default: batch size of the outbox)')
+    parser.add_argument('--outbox', action='store_true', help='add valid records to the outbox of the study')
+    args = parser.parse_args(list_args)
+
+    global study_worker
+    time_start = time.time()
+    config_study = get_study_config(args.study)
+    study = study_worker = Study(**config_study) # compiled once, forked processes inherit it
+    if args.day is not None and args.day not in study.schedule.list_days:
+        parser.error(f'--day: expected a visit day (1-{study.schedule.n_days})')
+    list_lines = read_records(args.path)
+    list_chunks = [(args.day, list_lines[i:i+CHUNK_SIZE]) for i in range(0, len(list_lines), CHUNK_SIZE)]
+
+    # Check records (results are in the order of the file)
+    list_records = []
+    list_rejects = []
+    for line, patient_code, record_final, list_errors in get_results(list_chunks, config_study, args.workers):
+        if record_final is None:
+            list_rejects.append((line, patient_code, list_errors))
+        else:
+            list_records.append(record_final)
+
+    # Batches, rejects and report
+    path_dir = args.out or os.path.splitext(args.path)[0] + '_redcap'
+    os.makedirs(path_dir, exist_ok=True)
+    batch_size = args.batch_size or study.outbox.batch_size
+    list_paths = write_batches(path_dir, list_records, batch_size)
+    path_rejects = os.path.join(path_dir, 'rejects.csv')
+    write_rejects(path_rejects, study, list_rejects)
+    if args.outbox:
+        for i in range(0, len(list_records), batch_size):
+            study.outbox.add(list_records[i:i+batch_size])
+    duration = time.time() - time_start
+    logger.info('Ingested %s: %d valid, %d rejected (%.1f s)', args.path, len(list_records), len(list_rejects), duration)
+
+    set_columns = {key for _, record in list_lines for key in record}
+    list_unknown = sorted(set_columns - set(study.dict_fields) - {COL_RECORD_ID, COL_VISIT_DAY})
+    print(f'Records read: {len(list_lines)} in {duration:.1f} s ({len(list_lines) / max(duration, 1e-9):.0f} records/s)')
+    print(f'Valid records: {len(list_records)} in {len(list_paths)} batch(es) in {path_dir}'
+          + (' (added to the outbox)' if args.outbox else ''))
+    print(f'Rejected records: {len(list_rejects)} (see {path_rejects})')
+    if list_unknown:
+        print(f'Columns ignored (not fields of the data dictionary): {", ".join(list_unknown)}')
+    counter_errors = collections.Counter((field_name, message) for _, _, list_errors in list_rejects
+                                         for field_name, _, message in list_errors)
+    if counter_errors:
+        print('Rejects per field:')
+        for (field_name, message), count in counter_errors.most_common():
+            print(f'    {field_name}: {message} ({count})')
+
+
+if __name__ == '__main__':
+    main()
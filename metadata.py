@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Hot reload of the data dictionary from the Redcap metadata API
+
+Each worker exports the data dictionary of the Redcap project of each study
+(content=metadata) at regular intervals, from a background thread. Nothing is
+done if the data dictionary has not changed: the request is conditional
+(If-None-Match, for servers that send an ETag, e.g. redcap_stub.py), the
+content hash of the metadata is compared with the last export, and fields are
+compared with the current version (e.g. first export, whose hash differs from
+the hash of the data dictionary file of the app).
+
+A new data dictionary becomes a new version of the study (see study.py): only
+fields of forms that have changed are compiled again, templates of other forms
+are reused, then the layout of the app is rebuilt (new pages get the new
+version). Sessions in progress keep the version of their page, which is kept in
+memory, and saved as a snapshot so that other workers can load it.
+
+The list of forms and the schedule are read from the forms file (restart
+needed): fields of instruments that are not in the list of forms are ignored.
+
+Usage (from the root of the repository), to show the differences between the
+data dictionary of the app and the Redcap project:
+    python metadata.py [--study ibd]
+
+Environment variables:
+    - REDCAP_METADATA_INTERVAL: time between two exports of the data dictionary (seconds, 0: no hot reload)
+"""
+
+import argparse
+import os
+import threading
+import time
+
+from dictionary import get_fields_from_metadata, get_version_from_metadata, save_version
+from metrics import get_logger, metadata_reloads
+from study import DataDictionary, Study, get_changes, get_form_rows, get_studies_from_env
+
+
+logger = get_logger('metadata')
+
+
+def get_config_metadata_from_env():
+    """
+    Return configuration of hot reload from environment variables
+    """
+    return dict(
+        interval = float(os.environ.get('REDCAP_METADATA_INTERVAL', 0)),
+    )
+
+
+def get_changes_text(dict_changes):
+    """
+    Return changes of a data dictionary as text (one line per form)
+    """
+    list_lines = []
+    for form, dict_fields in dict_changes.items():
+        list_parts = [f'{key} {", ".join(names)}' for key, names in dict_fields.items() if names]
+        list_lines.append(f'{form}: {"; ".join(list_parts) or "order of fields"}')
+    return '\n'.join(list_lines)
+
+
+class MetadataSync:
+    """
+    Reload the data dictionary of a study from its Redcap project (at regular intervals from a background thread)
+    """
+
+    def __init__(self, study, interval=0, **kwargs):
+        self.study = study
+        self.interval = interval
+        self.etag = None
+        self.version = None # version of the last metadata exported
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def export(self):
+        """
+        Export the data dictionary of the Redcap project
+        Return three outputs:
+            - fields, version: None if the data dictionary has not changed since the last version loaded
+            - ETag of the response, kept once the version is loaded
+        """
+        list_metadata, etag = self.study.redcap_client.export_metadata(self.etag)
+        if list_metadata is None:
+            return None, None, etag
+        version = get_version_from_metadata(self.study.df_forms, list_metadata)
+        if version == self.version:
+            return None, None, etag
+        return get_fields_from_metadata(list_metadata, self.study.list_forms), version, etag
+
+    def sync(self):
+        """
+        Reload data dictionary if it has changed, return dict of changes (form -> added/removed/changed fields)
+        The version and ETag are kept only once the version is loaded: a data dictionary that cannot be compiled
+        (e.g. invalid branching logic) is exported and compiled again at the next interval
+        """
+        df_fields, version, etag = self.export()
+        if df_fields is None: # same version as the last version loaded
+            self.etag = etag
+            return {}
+        if get_form_rows(df_fields) == self.study.dictionary.dict_form_rows: # e.g. first export, app is up to date
+            self.version, self.etag = version, etag
+            return {}
+        save_version(self.study.df_forms, df_fields, version) # before pages are served with this version
+        t = time.perf_counter()
+        dict_changes = self.study.reload(df_fields, version)
+        self.version, self.etag = version, etag
+        metadata_reloads.inc(study=self.study.name, status='done')
+        logger.info('Study %s: data dictionary reloaded (version %s, %.2f s)\n%s', self.study.name, version,
+                    time.perf_counter() - t, get_changes_text(dict_changes) or 'No changes')
+        return dict_changes
+
+    def start(self):
+        """
+        Start thread (if needed), this is done when the first request is received (after gunicorn has forked)
+        """
+        if self.interval <= 0 or not self.study.redcap_client.is_configured():
+            return
+        if self.pid == os.getpid() and self.thread is not None:
+            return
+        with self.lock:
+            if self.pid != os.getpid() or self.thread is None:
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name='metadata-sync', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e: # thread must keep running (e.g. Redcap not reachable, invalid branching logic)
+                metadata_reloads.inc(study=self.study.name, status='error')
+                logger.error('Study %s: data dictionary not reloaded: %r', self.study.name, e)
+            time.sleep(self.interval)
+
+
+###################################################
+# Command line
+###################################################
+
+def main(list_args=None):
+    parser = argparse.ArgumentParser(description='Differences between the data dictionary of the app and the Redcap project')
+    parser.add_argument('--study', default=None, help='name of the study (default: first study)')
+    args = parser.parse_args(list_args)
+
+    list_configs = get_studies_from_env()
+    list_configs = [config for config in list_configs if args.study in [None, config.get('name')]][:1]
+    if not list_configs:
+        parser.error(f'Unknown study: {args.study}')
+    study = Study(**list_configs[0])
+    if not study.redcap_client.is_configured():
+        parser.error('Redcap project not configured: set REDCAP_API_URL and REDCAP_API_TOKEN')
+    df_fields, version, etag = MetadataSync(study).export()
+    dict_changes = get_changes(study.dictionary, DataDictionary(study.df_forms, df_fields, version, study.dictionary))
+    print(f'Study {study.name}: version {study.version} (app), {version} (Redcap)')
+    print(get_changes_text(dict_changes) if dict_changes else 'No differences')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics (Prometheus text format) and logging
+
+Metrics are kept in memory by each process and exposed on /metrics:
+    - delectable_callback_seconds: duration of server-side callbacks (histogram, per callback)
+    - delectable_callback_request_bytes, delectable_callback_response_bytes: payload sizes (per callback)
+    - delectable_callback_errors_total: callbacks that raised an exception
+    - delectable_redcap_request_seconds: duration of requests to the Redcap API
+    - delectable_redcap_errors_total: failed requests to the Redcap API (per retryable)
+    - delectable_process_memory_bytes: memory of the process (rss, pss, uss, shared), read when scraped
+    - delectable_metadata_reloads_total: reloads of the data dictionary (per study and status: done or error)
+With several gunicorn workers, each worker reports its own metrics (label pid).
+With several studies in one process, callback metrics have a label study.
+
+Logging goes through the "delectable" logger, whose level is set by the
+environment variable DELECTABLE_LOG_LEVEL (default: WARNING). Messages below
+that level are not formatted.
+"""
+
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+LIST_BUCKETS_SECONDS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+LIST_BUCKETS_BYTES = [100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000, 3000000]
+
+
+###################################################
+# Logging
+###################################################
+
+def get_logger(name):
+    """
+    Return logger of a module (child of the "delectable" logger)
+    """
+    logger = logging.getLogger('delectable')
+    if not logger.handlers: # configured once per process
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(os.environ.get('DELECTABLE_LOG_LEVEL', 'WARNING').upper())
+        logger.propagate = False
+    return logger.getChild(name)
+
+
+###################################################
+# Memory
+###################################################
+
+def get_memory():
+    """
+    Return memory of this process (bytes):
+        - rss: resident pages, including pages shared with the gunicorn master and other workers
+        - pss: resident pages, where shared pages are divided by the number of processes that share them
+        - uss: private pages (memory freed if the process exits)
+        - shared: resident pages shared with other processes
+    Read from /proc/self/smaps_rollup (Linux), otherwise only rss is returned (peak)
+    """
+    dict_kb = {}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    dict_kb[key] = int(value.split()[0])
+    except OSError:
+        if resource is None:
+            return {}
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'rss': rss if sys.platform == 'darwin' else rss * 1024} # bytes on macOS, kB on Linux
+    return {
+        'rss': dict_kb.get('Rss', 0) * 1024,
+        'pss': dict_kb.get('Pss', 0) * 1024,
+        'uss': (dict_kb.get('Private_Clean', 0) + dict_kb.get('Private_Dirty', 0)) * 1024,
+        'shared': (dict_kb.get('Shared_Clean', 0) + dict_kb.get('Shared_Dirty', 0)) * 1024,
+    }
+
+
+def get_memory_text():
+    """
+    Return memory of this process as text, e.g. "rss 150.2 MB, pss 61.0 MB, uss 40.1 MB, shared 110.1 MB"
+    """
+    return ', '.join(f'{key} {value / 2**20:.1f} MB' for key, value in get_memory().items())
+
+
+###################################################
+# Metrics
+###################################################
+
+def get_labels_text(dict_labels):
+    if not dict_labels:
+        return ''
+    labels = ','.join(f'{key}="{str(value)}"' for key, value in sorted(dict_labels.items()))
+    return '{' + labels + '}'
+
+
+class Counter:
+    """
+    Counter with labels
+    """
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.dict_values = {} # labels (tuple of items) -> value
+        self.lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.dict_values[key] = self.dict_values.get(key, 0) + value
+
+    def get_lines(self, dict_labels_common):
+        list_lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in self.dict_values.items():
+                list_lines.append(f'{self.name}{get_labels_text({**dict_labels_common, **dict(key)})} {value}')
+        return list_lines
+
+
+class Histogram:
+    """
+    Histogram with labels (cumulative buckets, sum and count)
+    """
+
+    def __init__(self, name, description, list_buckets=LIST_BUCKETS_SECONDS):
+        self.name = name
+        self.description = description
+        self.list_buckets = list(list_buckets)
+        self.dict_values = {} # labels (tuple of items) -> [counts per bucket (+inf last), sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.list_buckets, value)
+        with self.lock:
+            item = self.dict_values.get(key)
+            if item is None:
+                item = self.dict_values[key] = [[0] * (len(self.list_buckets) + 1), 0]
+            item[0][index] += 1
+            item[1] += value
+
+    def get_lines(self, dict_labels_common):
+        list_lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (list_counts, total) in self.dict_values.items():
+                dict_labels = {**dict_labels_common, **dict(key)}
+                n = 0
+                for bucket, count in zip(self.list_buckets + ['+Inf'], list_counts):
+                    n += count
+                    list_lines.append(f'{self.name}_bucket{get_labels_text({**dict_labels, "le": bucket})} {n}')
+                list_lines.append(f'{self.name}_sum{get_labels_text(dict_labels)} {total}')
+                list_lines.append(f'{self.name}_count{get_labels_text(dict_labels)} {n}')
+        return list_lines
+
+
+class Gauge:
+    """
+    Gauge whose values are read when metrics are scraped
+    Inputs:
+        - get_values: function that returns a list of (dict of labels, value)
+    """
+
+    def __init__(self, name, description, get_values):
+        self.name = name
+        self.description = description
+        self.get_values = get_values
+
+    def get_lines(self, dict_labels_common):
+        list_lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} gauge']
+        for dict_labels, value in self.get_values():
+            list_lines.append(f'{self.name}{get_labels_text({**dict_labels_common, **dict_labels})} {value}')
+        return list_lines
+
+
+class Registry:
+    """
+    Metrics of this process
+    """
+
+    def __init__(self):
+        self.list_metrics = []
+
+    def counter(self, name, description):
+        metric = Counter(name, description)
+        self.list_metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, list_buckets=LIST_BUCKETS_SECONDS):
+        metric = Histogram(name, description, list_buckets)
+        self.list_metrics.append(metric)
+        return metric
+
+    def gauge(self, name, description, get_values):
+        metric = Gauge(name, description, get_values)
+        self.list_metrics.append(metric)
+        return metric
+
+    def get_text(self):
+        """
+        Return metrics in Prometheus text format
+        """
+        list_lines = []
+        for metric in self.list_metrics:
+            list_lines.extend(metric.get_lines({'pid': os.getpid()}))
+        return '\n'.join(list_lines) + '\n'
+
+
+registry = Registry()
+callback_seconds = registry.histogram('delectable_callback_seconds', 'Duration of server-side callbacks')
+callback_request_bytes = registry.histogram('delectable_callback_request_bytes', 'Size of callback requests',
+                                            LIST_BUCKETS_BYTES)
+callback_response_bytes = registry.histogram('delectable_callback_response_bytes', 'Size of callback responses',
+                                             LIST_BUCKETS_BYTES)
+callback_errors = registry.counter('delectable_callback_errors_total', 'Callbacks that raised an exception')
+redcap_seconds = registry.histogram('delectable_redcap_request_seconds', 'Duration of requests to the Redcap API')
+redcap_errors = registry.counter('delectable_redcap_errors_total', 'Failed requests to the Redcap API')
+metadata_reloads = registry.counter('delectable_metadata_reloads_total',
+                                   'Reloads of the data dictionary from the Redcap metadata API')
+process_memory = registry.gauge('delectable_process_memory_bytes', 'Memory of the process',
+                                lambda: [({'kind': key}, value) for key, value in get_memory().items()])
+
+
+###################################################
+# Flask integration
+###################################################
+
+def init_app(app, **labels):
+    """
+    Measure Dash callbacks (duration and payload size) and add /metrics route to the Flask server of app
+    Several Dash apps can share one Flask server (different prefixes), labels tell them apart (e.g. study="ibd")
+    """
+    import flask
+    server = app.server
+    path_update = app.config.requests_pathname_prefix + '_dash-update-component'
+    dict_names = {} # callback output -> function name
+
+    def get_callback_name(output):
+        name = dict_names.get(output)
+        if name is None:
+            callback = app.callback_map.get(output, {}).get('callback')
+            name = dict_names[output] = getattr(callback, '__name__', 'unknown')
+        return name
+
+    @server.before_request
+    def start_timer():
+        if flask.request.path == path_update:
+            flask.g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def record_callback(response):
+        if flask.request.path != path_update: # request of another app of the same server
+            return response
+        start = flask.g.pop('metrics_start', None)
+        if start is not None:
+            body = flask.request.get_json(silent=True) or {}
+            name = get_callback_name(body.get('output', ''))
+            callback_seconds.observe(time.perf_counter() - start, callback=name, **labels)
+            callback_request_bytes.observe(flask.request.content_length or 0, callback=name, **labels)
+            if not response.direct_passthrough:
+                callback_response_bytes.observe(response.calculate_content_length() or 0, callback=name, **labels)
+            if response.status_code >= 500:
+                callback_errors.inc(callback=name, **labels)
+        return response
+
+    path_metrics = app.config.routes_pathname_prefix + 'metrics' # metrics of all apps of the process
+    server.add_url_rule(path_metrics, endpoint=path_metrics, view_func=serve_metrics)
+
+
+def serve_metrics():
+    import flask
+    return flask.Response(registry.get_text(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+Durable outbox of records submitted to Redcap
+
+Submitted records are saved in a SQLite database before anything is sent to
+Redcap, then delivered in batches (Redcap imports a list of records in one
+request). Records stay in the outbox while Redcap is slow or down, and
+several gunicorn workers can share the same outbox (rows are claimed before
+being sent, so that a record is only sent by one worker). Records delivered to
+Redcap are deleted after a retention period (the status of a submission is
+shown to the respondent until then).
+
+Usage (from the root of the repository):
+    python outbox.py status            # number of records per status
+    python outbox.py flush             # send pending records to Redcap
+    python outbox.py replay            # send records that Redcap rejected again
+    python outbox.py replay --flush
+    python outbox.py purge             # delete records delivered before the retention period
+
+Environment variables:
+    - DELECTABLE_OUTBOX: path of the SQLite database
+    - OUTBOX_BATCH_SIZE: maximum number of records per Redcap request
+    - OUTBOX_BATCH_DELAY: time to wait for other submissions before sending a batch (seconds)
+    - OUTBOX_RETRY_INTERVAL: time between attempts while Redcap is not reachable (seconds)
+    - OUTBOX_RETENTION: time records delivered to Redcap are kept (seconds, 0: deleted at once)
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from metrics import get_logger
+from redcap import RedcapClient, RedcapError, get_config_from_env
+
+
+PATH_ROOT = os.path.dirname(os.path.abspath(__file__))
+PATH_OUTBOX = os.path.join(PATH_ROOT, 'outbox.sqlite3')
+CLAIM_TIMEOUT = 300 # records claimed by a worker that died are sent again after this delay (seconds)
+MESSAGE_PENDING = 'Redcap not available, record will be sent later'
+
+logger = get_logger('outbox')
+
+SQL_CREATE = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    submission_id TEXT NOT NULL,
+    record TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_status ON records (status, id);
+CREATE INDEX IF NOT EXISTS records_submission ON records (submission_id);
+"""
+
+
+def get_config_outbox_from_env():
+    """
+    Return configuration of outbox from environment variables
+    """
+    return dict(
+        path = os.environ.get('DELECTABLE_OUTBOX', PATH_OUTBOX),
+        batch_size = int(os.environ.get('OUTBOX_BATCH_SIZE', 100)),
+        batch_delay = float(os.environ.get('OUTBOX_BATCH_DELAY', 1)),
+        retry_interval = float(os.environ.get('OUTBOX_RETRY_INTERVAL', 30)),
+        retention = float(os.environ.get('OUTBOX_RETENTION', 86400)),
+    )
+
+
+###################################################
+# Outbox
+###################################################
+
+class Outbox:
+    """
+    Records waiting to be sent to Redcap (status: pending -> sending -> done | error)
+    Records that are done are deleted by purge, records with errors are kept until they are replayed
+    """
+
+    def __init__(self, path, batch_size=100, retention=86400, **kwargs):
+        self.path = path
+        self.batch_size = batch_size
+        self.retention = retention
+        self.local = threading.local()
+        with self.connect() as connection:
+            connection.executescript(SQL_CREATE)
+
+    def connect(self):
+        """
+        Return connection of current thread (connections cannot be shared by threads or forked processes)
+        """
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def disconnect(self):
+        """
+        Close connection of current thread, e.g. in the gunicorn master before workers are forked
+        (a worker that closes a connection inherited from its parent releases the SQLite locks of its own connection)
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+            self.local.pid = None
+
+    def add(self, list_records):
+        """
+        Save records (list of flat dictionaries) and return submission id
+        """
+        submission_id = uuid.uuid4().hex
+        now = time.time()
+        connection = self.connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('INSERT INTO records (submission_id, record, created, updated) VALUES (?, ?, ?, ?)',
+                                   [(submission_id, json.dumps(record), now, now) for record in list_records])
+        return submission_id
+
+    def get_status(self, submission_id):
+        """
+        Return status of a submission: {'status': 'pending' | 'done' | 'error', 'message': str}
+        or None if submission id is unknown
+        """
+        rows = self.connect().execute('SELECT status, message FROM records WHERE submission_id = ?',
+                                      (submission_id,)).fetchall()
+        if not rows:
+            return None
+        list_errors = [message for status, message in rows if status == 'error']
+        if list_errors:
+            return {'status': 'error', 'message': f'Error: record not saved in Redcap ({list_errors[0]})'}
+        if all(status == 'done' for status, _ in rows):
+            return {'status': 'done', 'message': f'Redcap confirmed {len(rows)} record(s)'}
+        message = rows[0][1] or 'Sending record to Redcap...'
+        return {'status': 'pending', 'message': message}
+
+    def count(self):
+        """
+        Return number of records per status
+        """
+        return dict(self.connect().execute('SELECT status, COUNT(*) FROM records GROUP BY status').fetchall())
+
+    def claim(self, batch_size, submission_id=None):
+        """
+        Mark a batch of pending records as being sent (by this process), return list of (id, record)
+        Inputs:
+            - submission_id: only records of this submission (default: oldest records)
+        """
+        now = time.time()
+        sql = "SELECT id, record FROM records WHERE (status = 'pending' OR (status = 'sending' AND updated < ?))"
+        parameters = [now - CLAIM_TIMEOUT]
+        if submission_id is not None:
+            sql += ' AND submission_id = ?'
+            parameters.append(submission_id)
+        connection = self.connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(sql + ' ORDER BY id LIMIT ?', parameters + [batch_size]).fetchall()
+            connection.executemany("UPDATE records SET status = 'sending', updated = ? WHERE id = ?",
+                                   [(now, i) for i, _ in rows])
+        return [(i, json.loads(record)) for i, record in rows]
+
+    def set_status(self, list_ids, status, message=''):
+        connection = self.connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('UPDATE records SET status = ?, message = ?, attempts = attempts + 1, updated = ? '
+                                   'WHERE id = ?', [(status, message, time.time(), i) for i in list_ids])
+
+    def replay(self, status='error'):
+        """
+        Send records with given status again, return number of records
+        """
+        connection = self.connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            cursor = connection.execute("UPDATE records SET status = 'pending', message = '' WHERE status = ?", (status,))
+        return cursor.rowcount
+
+    def purge(self, retention=None):
+        """
+        Delete records delivered to Redcap more than retention seconds ago, return number of records
+        """
+        retention = self.retention if retention is None else retention
+        connection = self.connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            cursor = connection.execute("DELETE FROM records WHERE status = 'done' AND updated <= ?",
+                                        (time.time() - retention,))
+        return cursor.rowcount
+
+    def send_batch(self, client, list_rows):
+        """
+        Send one batch of records
+        Redcap rejects the whole batch if one record is invalid: records are then sent one by one,
+        so that only invalid records are marked as errors
+        If Redcap is not available, records of the batch that have not been sent are pending again
+        """
+        try:
+            client.import_records([record for _, record in list_rows])
+            self.set_status([i for i, _ in list_rows], 'done')
+            logger.info('Records sent to Redcap: %d', len(list_rows))
+        except RedcapError as e:
+            if e.retryable:
+                self.set_status([i for i, _ in list_rows], 'pending', MESSAGE_PENDING)
+                raise
+            if len(list_rows) == 1:
+                self.set_status([list_rows[0][0]], 'error', str(e))
+                logger.error('Record rejected by Redcap: %s', e)
+            else:
+                for position, row in enumerate(list_rows):
+                    try:
+                        self.send_batch(client, [row])
+                    except RedcapError: # retryable: other records are not claimed until CLAIM_TIMEOUT
+                        self.set_status([i for i, _ in list_rows[position+1:]], 'pending', MESSAGE_PENDING)
+                        raise
+
+    def send_submission(self, client, submission_id):
+        """
+        Send the records of one submission (e.g. in the callback of the user who submitted it),
+        other pending records are left to flush
+        """
+        list_rows = self.claim(self.batch_size, submission_id)
+        if not list_rows:
+            return
+        try:
+            self.send_batch(client, list_rows)
+        except RedcapError as e:
+            logger.warning('Submission %s not sent: %s', submission_id, e)
+
+    def flush(self, client, batch_size=None):
+        """
+        Send pending records to Redcap in batches, until the outbox is empty or Redcap is not available
+        Return number of requests sent to Redcap (batches)
+        """
+        n_batches = 0
+        while True:
+            list_rows = self.claim(batch_size or self.batch_size)
+            if not list_rows:
+                return n_batches
+            n_batches += 1
+            try:
+                self.send_batch(client, list_rows)
+            except RedcapError as e:
+                logger.warning('Outbox not flushed: %s', e)
+                return n_batches
+
+
+###################################################
+# Background delivery
+###################################################
+
+class OutboxWorker:
+    """
+    Flush outbox from a background thread
+    The thread waits batch_delay after a submission (to send several submissions in one batch),
+    and tries again every retry_interval while records are pending. Delivered records are purged after each flush
+    """
+
+    def __init__(self, outbox, client, batch_delay=1, retry_interval=30, **kwargs):
+        self.outbox = outbox
+        self.client = client
+        self.batch_delay = batch_delay
+        self.retry_interval = retry_interval
+        self.event = threading.Event()
+        self.event_stop = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        """
+        Start thread (if needed), this is done when first record is submitted (after gunicorn has forked)
+        No thread is started if the Redcap project is not configured (records stay in the outbox)
+        """
+        if not self.client.is_configured():
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive() or self.pid != os.getpid():
+                self.event_stop.clear()
+                self.thread = threading.Thread(target=self.run, name='outbox-worker', daemon=True)
+                self.pid = os.getpid()
+                self.thread.start()
+
+    def notify(self):
+        self.start()
+        self.event.set()
+
+    def stop(self):
+        """
+        Stop thread once its current flush is done, e.g. before the outbox is flushed by the caller
+        (records claimed by the thread are sent or pending again when this returns)
+        """
+        with self.lock:
+            thread, self.thread = self.thread, None
+            self.event_stop.set()
+            self.event.set()
+        if thread is not None and self.pid == os.getpid():
+            thread.join()
+
+    def run(self):
+        while True:
+            self.event.wait(self.retry_interval)
+            self.event.clear()
+            if self.event_stop.is_set():
+                return
+            time.sleep(self.batch_delay)
+            try:
+                self.outbox.flush(self.client)
+                self.outbox.purge()
+            except Exception as e: # thread must keep running
+                logger.exception('Outbox not flushed: %r', e)
+
+
+###################################################
+# Command line
+###################################################
+
+def main(list_args=None):
+    parser = argparse.ArgumentParser(description='Outbox of records submitted to Redcap')
+    parser.add_argument('command', choices=['status', 'flush', 'replay', 'purge'])
+    parser.add_argument('--path', help='path of outbox database (default: DELECTABLE_OUTBOX)')
+    parser.add_argument('--batch-size', type=int, help='maximum number of records per Redcap request')
+    parser.add_argument('--status', default='error', help='status of records to replay (default: error)')
+    parser.add_argument('--flush', action='store_true', help='flush outbox after replay')
+    parser.add_argument('--retention', type=float, help='purge records delivered before (seconds, default: OUTBOX_RETENTION)')
+    args = parser.parse_args(list_args)
+
+    config_outbox = get_config_outbox_from_env()
+    outbox = Outbox(args.path or config_outbox['path'], config_outbox['batch_size'], config_outbox['retention'])
+    if args.command == 'replay':
+        print(f'Records to send again: {outbox.replay(args.status)}')
+    if args.command == 'flush' or args.flush:
+        client = RedcapClient(**get_config_from_env())
+        if not client.is_configured():
+            parser.error('Redcap project not configured: set REDCAP_API_URL and REDCAP_API_TOKEN')
+        print(f'Requests sent to Redcap: {outbox.flush(client, args.batch_size)}')
+    if args.command == 'purge':
+        print(f'Records deleted: {outbox.purge(args.retention)}')
+    print(f'Records per status: {outbox.count()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Client for the Redcap API
+
+Records are sent through a pooled requests.Session, with timeouts and
+exponential backoff. Submitted records are first saved in the outbox
+(outbox.py), which delivers them to Redcap in batches.
+
+Environment variables:
+    - REDCAP_API_URL, REDCAP_API_TOKEN: Redcap project (no default: records are not delivered,
+      they stay in the outbox, until both are set)
+    - REDCAP_TIMEOUT: timeout of one request (seconds)
+    - REDCAP_RETRIES: number of retries after a failed request
+    - REDCAP_BACKOFF: delay before first retry (seconds), doubled after each retry
+    - REDCAP_ASYNC: '1' to deliver records from a background thread, '0' to deliver them in the callback
+"""
+
+import json
+import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import get_logger, redcap_errors, redcap_seconds
+
+
+###################################################
+# Configuration
+###################################################
+
+LIST_STATUS_RETRY = [429, 500, 502, 503, 504]
+
+logger = get_logger('redcap')
+
+
+def get_config_from_env():
+    """
+    Return configuration of Redcap client from environment variables
+    """
+    return dict(
+        api_url = os.environ.get('REDCAP_API_URL') or None,
+        api_token = os.environ.get('REDCAP_API_TOKEN') or None,
+        timeout = float(os.environ.get('REDCAP_TIMEOUT', 10)),
+        retries = int(os.environ.get('REDCAP_RETRIES', 3)),
+        backoff = float(os.environ.get('REDCAP_BACKOFF', 0.5)),
+        bool_async = os.environ.get('REDCAP_ASYNC', '1') == '1',
+    )
+
+
+###################################################
+# Client
+###################################################
+
+class RedcapError(Exception):
+    """
+    Raised when Redcap does not accept a request (after retries)
+    retryable is True if the request may succeed later (Redcap not reachable or overloaded)
+    """
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class RedcapClient:
+    """
+    Redcap API client with connection pooling, timeouts and retries
+    """
+
+    def __init__(self, api_url, api_token, timeout=10, retries=3, backoff=0.5, pool_size=10, **kwargs):
+        self.api_url = api_url
+        self.api_token = api_token
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def is_configured(self):
+        """
+        Return True if the Redcap project is known (API URL and token), nothing is sent to Redcap otherwise
+        """
+        return bool(self.api_url and self.api_token)
+
+    def post(self, fields, headers=None):
+        """
+        Send request to Redcap API
+        Connection errors, timeouts and server errors (5xx, 429) are retried with exponential backoff
+        Other errors (e.g. 400 for invalid data, 403 for invalid token) are not retried
+        A response 304 (conditional request, see export_metadata) is returned as a success
+        If the Redcap project is not configured, nothing is sent (error is retryable: records stay in the outbox)
+        """
+        if not self.is_configured():
+            raise RedcapError('Redcap project not configured (REDCAP_API_URL, REDCAP_API_TOKEN)', retryable=True)
+        fields = {'token': self.api_token, **fields}
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                r = self.session.post(self.api_url, data=fields, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = RedcapError(f'Redcap not reachable: {e.__class__.__name__}', retryable=True)
+            else:
+                redcap_seconds.observe(time.perf_counter() - start, content=fields.get('content'))
+                if r.status_code in [200, 304]:
+                    return r
+                error = RedcapError(f'HTTP Status {r.status_code}: {r.text[:200]}',
+                                    retryable=r.status_code in LIST_STATUS_RETRY)
+            redcap_errors.inc(content=fields.get('content'), retryable=error.retryable)
+            logger.warning('Redcap request failed (attempt %d): %s', attempt+1, error)
+            if not error.retryable:
+                raise error
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2**attempt)
+        raise error
+
+    def import_records(self, list_records):
+        """
+        Import records (list of flat dictionaries), return number of records imported
+        """
+        r = self.post({
+            'content': 'record',
+            'format': 'json',
+            'type': 'flat',
+            'returnContent': 'count',
+            'data': json.dumps(list_records),
+        })
+        try:
+            return int(r.json()['count'])
+        except (ValueError, KeyError, TypeError):
+            return len(list_records)
+
+    def export_metadata(self, etag=None):
+        """
+        Export the data dictionary of the project (list of fields, keys of the Redcap metadata API)
+        The request is conditional if etag (of the previous export) is given: Redcap servers that send an ETag
+        answer 304 if the data dictionary has not changed
+        Return two outputs:
+            - list of fields, or None if the data dictionary has not changed
+            - ETag of the response (None if the server sends no ETag)
+        """
+        r = self.post({'content': 'metadata', 'format': 'json'}, headers={'If-None-Match': etag} if etag else None)
+        if r.status_code == 304:
+            return None, etag
+        try:
+            list_metadata = r.json()
+        except ValueError:
+            raise RedcapError('Metadata is not valid JSON') from None
+        if not isinstance(list_metadata, list):
+            raise RedcapError(f'Unexpected metadata: {str(list_metadata)[:200]}')
+        return list_metadata, r.headers.get('ETag')
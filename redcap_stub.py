@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Local stub of the Redcap API, to run the app and the outbox without a Redcap project
+
+Supported requests:
+    - import of records (content=record, format=json, type=flat): records are kept in memory
+      (last import of a record_id wins)
+    - export of the data dictionary (content=metadata, format=json), read from a file of fields
+      (Excel or CSV, read again when the file changes), with an ETag: requests with the same
+      If-None-Match get a 304
+
+Usage (from the root of the repository):
+    python redcap_stub.py --port 8051
+    REDCAP_API_URL=http://127.0.0.1:8051/api/ REDCAP_API_TOKEN=stub python app.py
+
+Data dictionary (edit the file to test hot reload, see metadata.py):
+    python redcap_stub.py --metadata resources/list_fields_v3.xlsx
+
+Failures can be injected to test retries and the outbox:
+    python redcap_stub.py --fail 5 --status 503    # 5 next requests fail with HTTP 503
+    python redcap_stub.py --delay 2                # every request takes 2 seconds
+    python redcap_stub.py --invalid patient_x      # records with this record_id are rejected (HTTP 400)
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from dictionary import get_metadata_from_fields, read_dictionary, read_source
+
+
+class RedcapStub:
+    """
+    State of the stub: imported records, list of requests, and failures to inject
+    """
+
+    def __init__(self, fail=0, status=503, delay=0, list_invalid=(), metadata=None):
+        self.dict_records = {}
+        self.metadata = metadata # list of fields (keys of the metadata API), or path of a file of fields
+        self.cache_metadata = (None, None) # modification time of file, list of fields
+        self.list_requests = []
+        self.fail = fail
+        self.status = status
+        self.delay = delay
+        self.set_invalid = set(list_invalid)
+        self.lock = threading.Lock()
+
+    def get_metadata(self):
+        """
+        Return data dictionary (keys of the Redcap metadata API), or None if stub has no data dictionary
+        """
+        if self.metadata is None or isinstance(self.metadata, list):
+            return self.metadata
+        mtime = os.path.getmtime(self.metadata)
+        if self.cache_metadata[0] != mtime:
+            df_fields = read_dictionary(self.metadata, read_source(self.metadata))
+            self.cache_metadata = (mtime, get_metadata_from_fields(df_fields))
+        return self.cache_metadata[1]
+
+    def handle(self, fields, headers=None):
+        """
+        Return (HTTP status, response body, response headers) for a request (fields of the POST form, request headers)
+        """
+        with self.lock:
+            self.list_requests.append(fields)
+            if self.fail > 0:
+                self.fail -= 1
+                return self.status, {'error': 'Failure injected by stub'}, {}
+        if self.delay:
+            time.sleep(self.delay)
+        if fields.get('content') == 'metadata':
+            list_metadata = self.get_metadata()
+            if list_metadata is None:
+                return 400, {'error': 'Stub has no data dictionary'}, {}
+            etag = '"' + hashlib.sha256(json.dumps(list_metadata).encode()).hexdigest()[:32] + '"'
+            if (headers or {}).get('If-None-Match') == etag:
+                return 304, None, {'ETag': etag}
+            return 200, list_metadata, {'ETag': etag}
+        if fields.get('content') != 'record' or 'data' not in fields:
+            return 400, {'error': 'Only import of records and export of metadata are supported by stub'}, {}
+        try:
+            list_records = json.loads(fields['data'])
+        except ValueError:
+            return 400, {'error': 'Data is not valid JSON'}, {}
+        list_invalid = [str(record.get('record_id')) for record in list_records
+                        if str(record.get('record_id')) in self.set_invalid or 'record_id' not in record]
+        if list_invalid: # Redcap rejects the whole import
+            return 400, {'error': f'Invalid records: {", ".join(list_invalid)}'}, {}
+        with self.lock:
+            for record in list_records:
+                self.dict_records.setdefault(str(record['record_id']), {}).update(record)
+        return 200, {'count': len(list_records)}, {}
+
+    def serve(self, host='127.0.0.1', port=0):
+        """
+        Start server in a background thread, return server (server.server_port is the port)
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                fields = {key: values[0] for key, values in parse_qs(body).items()}
+                status, response, headers = stub.handle(fields, {'If-None-Match': self.headers.get('If-None-Match')})
+                content = b'' if response is None else json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def main(list_args=None):
+    parser = argparse.ArgumentParser(description='Local stub of the Redcap API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8051)
+    parser.add_argument('--fail', type=int, default=0, help='number of requests that fail')
+    parser.add_argument('--status', type=int, default=503, help='HTTP status of failed requests')
+    parser.add_argument('--delay', type=float, default=0, help='delay of each request (seconds)')
+    parser.add_argument('--invalid', nargs='*', default=[], help='record ids rejected by the stub')
+    parser.add_argument('--metadata', default=None, help='file of fields (Excel or CSV) exported as metadata')
+    args = parser.parse_args(list_args)
+
+    stub = RedcapStub(args.fail, args.status, args.delay, args.invalid, args.metadata)
+    server = stub.serve(args.host, args.port)
+    print(f'Redcap stub: http://{args.host}:{server.server_port}/api/')
+    try:
+        while True:
+            time.sleep(10)
+            print(f'Requests: {len(stub.list_requests)}, records: {len(stub.dict_records)}')
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
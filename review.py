@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Builder of the review table (answers entered before submission)
+
+Questions and choice labels of all fields are collected once when the app is
+started, so that the review table is built in one pass over the answers,
+without filtering the data dictionary or growing a dataframe row by row.
+"""
+
+
+LIST_COLUMNS_REVIEW = ['Question', 'Answer', 'Field Name', 'Value']
+
+
+class ReviewTable:
+    """
+    Lookup tables of the review form
+    Inputs:
+        - field_index: field name -> FieldSpec (see fields.build_field_index)
+    """
+
+    def __init__(self, field_index):
+        self.dict_questions = {}
+        self.set_choices = set() # fields whose answer is a code (label is shown)
+        self.dict_choice_labels = {} # (field name, code) -> label
+        for field in field_index.values():
+            self.dict_questions[field.name] = field.label
+            if field.dict_options: # choices are compiled once (see fields.compile_choices)
+                self.set_choices.add(field.name)
+                for code, label in field.dict_options.items():
+                    self.dict_choice_labels[(field.name, code)] = label
+        self.columns = [{'name': i, 'id': i} for i in LIST_COLUMNS_REVIEW]
+
+    def get_answer_label(self, field_name, value):
+        """
+        Return label of a code (fields with choices) or the value itself
+        """
+        if field_name in self.set_choices:
+            try:
+                return self.dict_choice_labels.get((field_name, value), '')
+            except TypeError: # unhashable answer (list of codes)
+                return ''
+        return '' if value is None else value
+
+    def get_records(self, dict_answers_final):
+        """
+        Return rows of the review table (list of dictionaries, as expected by DataTable.data)
+        Inputs:
+            - dict_answers_final: answers to show (field name -> value), in the order of the data dictionary
+        """
+        return [{'Question': self.dict_questions[field_name],
+                 'Answer': self.get_answer_label(field_name, value),
+                 'Field Name': field_name,
+                 'Value': value}
+                for field_name, value in dict_answers_final.items()]
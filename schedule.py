@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Schedule of visits: forms available on each visit day
+
+The schedule is compiled once from the list of forms into a table
+day -> ordered forms, which is used for the options of the main dropdown,
+previous/next navigation and rendering of forms.
+
+If the list of forms has a column "Visit Days", it gives the days of each form:
+    - "1-6", "7", "1, 3, 5-7": days (ranges are inclusive)
+    - empty: every day
+Otherwise, days are taken from form names (former convention of the app):
+    - "cdai_d3": daily form, answered on day 3 only
+    - other forms: answered on the last day (day after the last daily form, e.g. day 7)
+The forms "home" and "review" are available on every day.
+"""
+
+import re
+
+import pandas as pd
+
+
+COL_FORM_NAME = 'Form Name'
+COL_VISIT_DAYS = 'Visit Days'
+LIST_FORMS_ALWAYS = ['home', 'review']
+N_DAYS_DEFAULT = 7
+REGEX_DAILY = re.compile(r'_d(\d+)$')
+
+
+class ScheduleError(ValueError):
+    """
+    Raised when the column "Visit Days" cannot be read
+    """
+
+
+def get_days_from_string(string):
+    """
+    Return set of days from a string such as "1, 3, 5-7"
+    """
+    set_days = set()
+    for part in str(string).replace(';', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                first, last = part.split('-')
+                set_days.update(range(int(first), int(last) + 1))
+            else:
+                set_days.add(int(float(part)))
+        except ValueError:
+            raise ScheduleError(f'Invalid visit days: {string!r}') from None
+    return set_days
+
+
+def get_days_from_column(df_forms):
+    """
+    Return number of days and dictionary form -> set of days (None: every day), from column "Visit Days"
+    """
+    dict_days = {}
+    for form, days in zip(df_forms[COL_FORM_NAME].values, df_forms[COL_VISIT_DAYS].values):
+        dict_days[form] = None if pd.isna(days) or str(days).strip() == '' else get_days_from_string(days)
+    n_days = max([max(days) for days in dict_days.values() if days] or [N_DAYS_DEFAULT])
+    return n_days, dict_days
+
+
+def get_days_from_names(df_forms):
+    """
+    Return number of days and dictionary form -> set of days, from names of forms ("_d3": day 3)
+    """
+    dict_daily = {}
+    for form in df_forms[COL_FORM_NAME].values:
+        match = REGEX_DAILY.search(form)
+        if match:
+            dict_daily[form] = int(match.group(1))
+    n_days = max(dict_daily.values()) + 1 if dict_daily else N_DAYS_DEFAULT
+    dict_days = {form: {dict_daily[form]} if form in dict_daily else {n_days} for form in df_forms[COL_FORM_NAME].values}
+    return n_days, dict_days
+
+
+class Schedule:
+    """
+    Forms available on each visit day (in the order of the list of forms)
+    """
+
+    def __init__(self, df_forms):
+        if COL_VISIT_DAYS in df_forms.columns:
+            self.n_days, dict_days = get_days_from_column(df_forms)
+        else:
+            self.n_days, dict_days = get_days_from_names(df_forms)
+        self.list_days = list(range(1, self.n_days + 1))
+        self.dict_forms = {None: tuple(form for form in df_forms[COL_FORM_NAME].values if form == 'home')}
+        for day in self.list_days:
+            self.dict_forms[day] = tuple(form for form in df_forms[COL_FORM_NAME].values
+                                         if form in LIST_FORMS_ALWAYS or dict_days[form] is None or day in dict_days[form])
+        self.dict_options = {day: [{'label':form.upper(), 'value':form} for form in forms]
+                             for day, forms in self.dict_forms.items()}
+        self.dict_index = {day: {form: i for i, form in enumerate(forms)} for day, forms in self.dict_forms.items()}
+
+    def get_forms(self, day):
+        """
+        Return forms available on a day (only "home" if day is not selected or outside the schedule)
+        """
+        return self.dict_forms.get(day, self.dict_forms[None])
+
+    def get_options(self, day):
+        """
+        Return options of the main dropdown for a day
+        """
+        return self.dict_options.get(day, self.dict_options[None])
+
+    def is_available(self, form, day):
+        return form in self.dict_index.get(day, self.dict_index[None])
+
+    def get_next_form(self, form, day, step):
+        """
+        Return form before (step=-1) or after (step=1) form, on a day
+        """
+        list_forms = self.get_forms(day)
+        index = self.dict_index.get(day, self.dict_index[None]).get(form, 0)
+        return list_forms[min(max(index + step, 0), len(list_forms) - 1)]
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Server-side store of the answers of each respondent (session)
+
+By default, answers are kept in the browser (one dcc.Store per field) and the
+full record is posted back when reviewing or submitting. With a session store,
+the browser only carries a session id, and the callbacks read and update the
+answers on the server.
+
+Backends (environment variable DELECTABLE_SESSION):
+    - '' (default): no session store, answers are kept in the browser
+    - 'memory': in-process LRU store with TTL (one gunicorn worker only)
+    - 'redis://host:port/db': Redis (shared by all gunicorn workers), requires the redis package
+    - 'fake': in-process stand-in for Redis (tests, no server needed)
+
+Environment variables:
+    - SESSION_TTL: sessions not updated for this time are deleted (seconds)
+    - SESSION_MAX: maximum number of sessions of the memory backend
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+import uuid
+
+
+def get_config_session_from_env():
+    """
+    Return configuration of session store from environment variables
+    """
+    return dict(
+        url = os.environ.get('DELECTABLE_SESSION', ''),
+        ttl = float(os.environ.get('SESSION_TTL', 24*3600)),
+        max_sessions = int(os.environ.get('SESSION_MAX', 10000)),
+    )
+
+
+def get_session_id():
+    return uuid.uuid4().hex
+
+
+###################################################
+# In-process backend
+###################################################
+
+class MemorySessionStore:
+    """
+    Least recently used sessions are deleted when there are more than max_sessions,
+    sessions not updated for ttl seconds are deleted when they are read
+    """
+
+    def __init__(self, ttl=24*3600, max_sessions=10000, **kwargs):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.dict_sessions = collections.OrderedDict() # session id -> (expiry, answers)
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        """
+        Return answers of a session (field name -> value), empty if session is unknown or expired
+        """
+        with self.lock:
+            item = self.dict_sessions.get(session_id)
+            if item is None:
+                return {}
+            if item[0] < time.monotonic():
+                del self.dict_sessions[session_id]
+                return {}
+            self.dict_sessions.move_to_end(session_id)
+            return dict(item[1])
+
+    def update(self, session_id, dict_delta):
+        """
+        Save answers that have changed (field name -> value)
+        """
+        with self.lock:
+            item = self.dict_sessions.pop(session_id, None)
+            dict_answers = {} if item is None or item[0] < time.monotonic() else item[1]
+            dict_answers.update(dict_delta)
+            self.dict_sessions[session_id] = (time.monotonic() + self.ttl, dict_answers)
+            while len(self.dict_sessions) > self.max_sessions:
+                self.dict_sessions.popitem(last=False)
+
+    def reset(self, session_id):
+        with self.lock:
+            self.dict_sessions.pop(session_id, None)
+
+
+###################################################
+# Redis backend
+###################################################
+
+class RedisSessionStore:
+    """
+    One Redis hash per session (field name -> JSON value), expired by Redis after ttl seconds
+    Inputs:
+        - client: redis.Redis, or any object with the same hset/hgetall/expire/delete methods (e.g. FakeRedis)
+    """
+
+    def __init__(self, client, ttl=24*3600, prefix='delectable:session:', **kwargs):
+        self.client = client
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def get(self, session_id):
+        dict_raw = self.client.hgetall(self.prefix + session_id)
+        return {get_text(key): json.loads(value) for key, value in dict_raw.items()}
+
+    def update(self, session_id, dict_delta):
+        if not dict_delta:
+            return
+        key = self.prefix + session_id
+        self.client.hset(key, mapping={field_name: json.dumps(value) for field_name, value in dict_delta.items()})
+        self.client.expire(key, self.ttl)
+
+    def reset(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+
+def get_text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class FakeRedis:
+    """
+    In-process stand-in for the subset of redis.Redis used by RedisSessionStore
+    """
+
+    def __init__(self):
+        self.dict_hashes = {}
+        self.dict_expiry = {}
+        self.lock = threading.Lock()
+
+    def get_hash(self, name):
+        if self.dict_expiry.get(name, float('inf')) < time.monotonic():
+            self.dict_hashes.pop(name, None)
+            self.dict_expiry.pop(name, None)
+        return self.dict_hashes.get(name)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self.lock:
+            dict_hash = self.get_hash(name)
+            if dict_hash is None:
+                dict_hash = self.dict_hashes[name] = {}
+            n_before = len(dict_hash)
+            if key is not None:
+                dict_hash[get_text(key)] = str(value).encode()
+            for k, v in (mapping or {}).items():
+                dict_hash[get_text(k)] = str(v).encode()
+            return len(dict_hash) - n_before
+
+    def hgetall(self, name):
+        with self.lock:
+            return {k.encode(): v for k, v in (self.get_hash(name) or {}).items()}
+
+    def expire(self, name, seconds):
+        with self.lock:
+            if self.get_hash(name) is None:
+                return False
+            self.dict_expiry[name] = time.monotonic() + seconds
+            return True
+
+    def delete(self, *names):
+        with self.lock:
+            n = 0
+            for name in names:
+                n += self.dict_hashes.pop(name, None) is not None
+                self.dict_expiry.pop(name, None)
+            return n
+
+
+###################################################
+# Factory
+###################################################
+
+def create_session_store(url, ttl=24*3600, max_sessions=10000, **kwargs):
+    """
+    Return session store for url (see module docstring), or None if url is empty
+    """
+    if not url:
+        return None
+    if url == 'memory':
+        return MemorySessionStore(ttl, max_sessions)
+    if url == 'fake':
+        return RedisSessionStore(FakeRedis(), ttl)
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError('DELECTABLE_SESSION uses Redis but the redis package is not installed') from None
+        return RedisSessionStore(redis.Redis.from_url(url), ttl)
+    raise ValueError(f'Unknown session store: {url!r}')
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+Studies served by the app
+
+A study is a data dictionary (forms and fields) with its Redcap project. Each
+study is compiled once (field index, branching logic, schedule...) and mounted
+at its own URL prefix, so that several studies share one process (and its
+workers, assets and snapshots of data dictionaries).
+
+By default, one study is served at "/" (data dictionary and Redcap project from
+the environment variables of dictionary.py and redcap.py). Several studies are
+configured by a JSON file (path in environment variable DELECTABLE_STUDIES):
+    [
+        {"name": "ibd", "prefix": "/ibd/",
+         "forms": "resources/list_forms_v3.xlsx", "fields": "resources/list_fields_v3.xlsx",
+         "redcap_api_url": "https://.../api/", "redcap_api_token_env": "IBD_REDCAP_TOKEN"},
+        {"name": "other", "prefix": "/other/", ...}
+    ]
+Keys other than "name" and "prefix" are optional:
+    - forms, fields: path (or URL) of the data dictionary
+    - redcap_api_url, redcap_api_token: Redcap project (or redcap_api_token_env: name of the
+      environment variable that holds the token, so that the file has no credentials)
+    - outbox: path of the outbox database (by default, next to the outbox of the default study,
+      named after the study)
+    - drafts: folder of draft logs (by default, a subfolder of DELECTABLE_DRAFTS named after
+      the study, autosave is disabled if neither is set)
+Relative paths are relative to the current directory.
+
+The compiled data dictionary is a version (DataDictionary), which can be replaced
+while the app runs (fields reloaded from the Redcap metadata API, see metadata.py).
+Attributes of the data dictionary are read through the study (e.g. study.dict_fields
+is the current version), and callbacks read the version of the page of the session
+(study.get_version), so that a session keeps the data dictionary it started with.
+"""
+
+import collections
+import copy
+import datetime
+import json
+import os
+import threading
+import types
+
+from branching import BranchingLogic
+from calculations import Calculations
+from dictionary import DICT_COLUMNS_METADATA, load_data_dictionary, load_version
+from drafts import create_draft_store, get_config_drafts_from_env
+from fields import COL_FIELD_NAME, COL_FORM_NAME, build_field_index, build_form_index, get_value_or_none
+from metrics import get_logger
+from outbox import Outbox, OutboxWorker, get_config_outbox_from_env
+from redcap import RedcapClient, get_config_from_env
+from review import ReviewTable
+from schedule import Schedule
+from validation import Validator
+
+
+LIST_FORMS_EAGER = ['home', 'review'] # forms rendered when app is started (other forms are rendered when selected)
+MAX_VERSIONS = 5 # versions of the data dictionary kept in memory (sessions in progress)
+
+logger = get_logger('study')
+
+
+def get_studies_from_env():
+    """
+    Return list of configurations of studies (one study at "/" if DELECTABLE_STUDIES is not set)
+    """
+    path = os.environ.get('DELECTABLE_STUDIES')
+    if not path:
+        return [{'name': 'default', 'prefix': '/'}]
+    with open(path, 'r', encoding='utf-8') as f:
+        list_configs = json.load(f)
+    set_prefixes = set()
+    for config in list_configs:
+        prefix = config.get('prefix', '/')
+        if not (prefix.startswith('/') and prefix.endswith('/')):
+            raise ValueError(f'Prefix of study {config.get("name")} must start and end with "/": {prefix!r}')
+        if prefix in set_prefixes:
+            raise ValueError(f'Several studies have the same prefix: {prefix!r}')
+        set_prefixes.add(prefix)
+    return list_configs
+
+
+def get_dict_answers(dict_fields):
+    """
+    Return one output:
+        - dict: a dictionary that summarizes the state of answers for all questions
+    """
+    dict_answers = {}
+    for i in dict_fields:
+        dict_answers[i] = None
+    return dict_answers
+
+
+def get_dict_answers_final(dict_answers, dict_hide):
+    """
+    Get dictionary of answers without None (and without answers of fields hidden by branching logic)
+    """
+    return {key: value for key, value in dict_answers.items() if value is not None and not dict_hide[key]}
+
+
+def get_branching_logic(dict_fields):
+    """
+    Return one output:
+        - BranchingLogic: compiled branching logic of all fields (with dependency graph)
+    """
+    dict_logic = {}
+    for field in dict_fields.values():
+        if field.branching_logic is not None:
+            dict_logic[field.name] = field.branching_logic
+    return BranchingLogic(dict_logic)
+
+
+def get_calculations(dict_fields):
+    """
+    Return one output:
+        - Calculations: compiled equations of all calc fields (with dependency index)
+    """
+    dict_equations = {}
+    for field in dict_fields.values():
+        if field.field_type == 'calc' and field.calculation is not None:
+            dict_equations[field.name] = field.calculation
+    return Calculations(dict_equations)
+
+
+def get_string_from_cell(value):
+    """
+    Return a cell of the data dictionary as a string (None if empty), so that cells read from Excel files
+    and from the Redcap metadata API compare equal (e.g. 0 and '0')
+    """
+    value = get_value_or_none(value)
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d' if value.time() == datetime.time() else '%Y-%m-%d %H:%M')
+    return str(value)
+
+
+def get_form_rows(df_fields):
+    """
+    Return dict: form -> tuple of rows of its fields (cells as strings), to find forms that differ between two versions
+    """
+    dict_rows = {}
+    for row in df_fields.to_dict('records'):
+        dict_rows.setdefault(get_value_or_none(row.get(COL_FORM_NAME)), []).append(
+            tuple(get_string_from_cell(row.get(column)) for column in DICT_COLUMNS_METADATA.values()))
+    return {form: tuple(list_rows) for form, list_rows in dict_rows.items()}
+
+
+def get_changes(dictionary_old, dictionary_new):
+    """
+    Return dict: form -> {'added': [...], 'removed': [...], 'changed': [...]} (names of fields), only forms that differ
+    """
+    dict_changes = {}
+    for form in dict.fromkeys(list(dictionary_old.dict_form_rows) + list(dictionary_new.dict_form_rows)):
+        if dictionary_old.dict_form_rows.get(form) == dictionary_new.dict_form_rows.get(form):
+            continue
+        dict_old = {row[0]: row for row in dictionary_old.dict_form_rows.get(form, ())} # field name -> row
+        dict_new = {row[0]: row for row in dictionary_new.dict_form_rows.get(form, ())}
+        dict_changes[form] = {
+            'added': [name for name in dict_new if name not in dict_old],
+            'removed': [name for name in dict_old if name not in dict_new],
+            'changed': [name for name in dict_new if name in dict_old and dict_new[name] != dict_old[name]],
+        }
+    return dict_changes
+
+
+class DataDictionary:
+    """
+    One version of the compiled data dictionary of a study (fields, branching logic, calc fields, validation, schedule...)
+    A version is not modified once it is built (except templates of forms, rendered when first selected)
+    Inputs:
+        - df_forms, df_fields: data dictionary
+        - version: content hash of the data dictionary (see dictionary.py)
+        - previous: version loaded before, whose fields and templates are reused for forms that have not changed
+    """
+
+    def __init__(self, df_forms, df_fields, version, previous=None):
+        self.version = version
+        self.df_forms = df_forms
+        self.df_fields = df_fields
+        self.dict_form_rows = get_form_rows(df_fields)
+        if previous is None:
+            set_changed = set(self.dict_form_rows)
+            self.dict_fields = build_field_index(df_fields)
+        else: # only fields of forms that have changed are compiled again
+            set_changed = {form for form, rows in self.dict_form_rows.items() if previous.dict_form_rows.get(form) != rows}
+            dict_changed = build_field_index(df_fields[df_fields[COL_FORM_NAME].isin(set_changed)])
+            self.dict_fields = types.MappingProxyType({
+                name: dict_changed[name] if form in set_changed else previous.dict_fields[name]
+                for name, form in zip(df_fields[COL_FIELD_NAME], df_fields[COL_FORM_NAME])
+            })
+        self.dict_form_fields = build_form_index(self.dict_fields)
+        if previous is not None:
+            self.dict_form_fields = types.MappingProxyType({
+                form: previous.dict_form_fields[form] if form not in set_changed else fields
+                for form, fields in self.dict_form_fields.items()
+            })
+        self.branching_logic = get_branching_logic(self.dict_fields)
+        self.calculations = get_calculations(self.dict_fields)
+        self.set_sources = set(self.branching_logic.get_sources()) | set(self.calculations.get_sources()) # answers copied for the browser
+        self.review_table = ReviewTable(self.dict_fields)
+        self.validator = Validator(self.dict_fields)
+        self.schedule = Schedule(self.df_forms) # forms available on each visit day
+        self.dict_day_fields = {day: tuple(field.name for form in forms for field in self.dict_form_fields.get(form, ()))
+                                for day, forms in self.schedule.dict_forms.items()}
+        self.list_forms = list(self.df_forms['Form Name'].values)
+        self.list_forms_lazy = [form for form in self.list_forms if form not in LIST_FORMS_EAGER]
+        self.dict_hide = self.branching_logic.get_dict_hide(get_dict_answers(self.dict_fields), self.dict_fields)
+
+        # Templates of forms (rendered when first selected, see app.get_form_template)
+        # Templates of forms that have not changed are reused, unless the initial branching logic of their fields has changed,
+        # or their fields are not the same sources of branching logic and calc fields (logic of another form may use them)
+        self.dict_form_cache = {}
+        if previous is not None:
+            for form, template in list(previous.dict_form_cache.items()):
+                list_names = [field.name for field in self.dict_form_fields.get(form, ())]
+                if (form not in set_changed and all(self.dict_hide[i] == previous.dict_hide[i] for i in list_names)
+                        and self.set_sources.intersection(list_names) == previous.set_sources.intersection(list_names)):
+                    self.dict_form_cache[form] = template
+
+    def get_fields(self, day):
+        """
+        Return names of the fields of the forms available on a day
+        """
+        return self.dict_day_fields.get(day, self.dict_day_fields[None])
+
+
+class Study:
+    """
+    Compiled data dictionary of a study (fields, branching logic, calc fields, validation, schedule...), and its Redcap client, outbox and drafts
+    This object is created once when app is started, and is shared by all user sessions
+    """
+
+    def __init__(self, name='default', prefix='/', forms=None, fields=None, redcap_api_url=None,
+                 redcap_api_token=None, redcap_api_token_env=None, outbox=None, drafts=None, **kwargs):
+        self.name = name
+        self.prefix = prefix
+        bool_default = prefix == '/' # default study keeps default paths of outbox and drafts
+
+        # Data dictionary (current version, and versions of sessions in progress)
+        df_forms, df_fields, version = load_data_dictionary(forms, fields)
+        self.dictionary = DataDictionary(df_forms, df_fields, version)
+        self.dict_versions = collections.OrderedDict([(version, self.dictionary)]) # least recently loaded first
+        self.lock_versions = threading.Lock()
+        self.list_reload_hooks = [] # functions called when a new version is loaded (e.g. layout of the app)
+
+        # Redcap project
+        self.config_redcap = get_config_from_env()
+        if redcap_api_url:
+            self.config_redcap['api_url'] = redcap_api_url
+        if redcap_api_token_env:
+            redcap_api_token = os.environ[redcap_api_token_env]
+        if redcap_api_token:
+            self.config_redcap['api_token'] = redcap_api_token
+        self.redcap_client = RedcapClient(**self.config_redcap)
+        if not self.redcap_client.is_configured():
+            logger.error('Study %s: Redcap project not configured (REDCAP_API_URL, REDCAP_API_TOKEN), '
+                         'submitted records are kept in the outbox and not delivered', name)
+
+        # Outbox and drafts (one per study)
+        config_outbox = get_config_outbox_from_env()
+        if outbox or not bool_default: # e.g. outbox_ibd.sqlite3 next to the default outbox
+            root, ext = os.path.splitext(config_outbox['path'])
+            config_outbox['path'] = outbox or f'{root}_{name}{ext}'
+        self.outbox = Outbox(**config_outbox)
+        self.outbox_worker = OutboxWorker(self.outbox, self.redcap_client, **config_outbox)
+        config_drafts = get_config_drafts_from_env()
+        if drafts:
+            config_drafts['path'] = drafts
+        elif config_drafts['path'] and not bool_default:
+            config_drafts['path'] = os.path.join(config_drafts['path'], name)
+        self.draft_store = create_draft_store(**config_drafts)
+
+    def __getattr__(self, name):
+        """
+        Attributes of the data dictionary (e.g. dict_fields, schedule), from the version of this object
+        """
+        dictionary = self.__dict__.get('dictionary')
+        if dictionary is None:
+            raise AttributeError(name)
+        return getattr(dictionary, name)
+
+    def get_version(self, version=None):
+        """
+        Return the study with a version of the data dictionary, e.g. the version of the page of a session
+        (current version if version is None, or if it is neither in memory nor in a snapshot)
+        The returned object keeps its version when a new version is loaded, so that a callback reads one version
+        """
+        dictionary = self.dictionary if version is None else self.dict_versions.get(version)
+        if dictionary is None:
+            dictionary = self.load_version(version)
+        study_version = copy.copy(self)
+        study_version.dictionary = dictionary
+        return study_version
+
+    def load_version(self, version):
+        """
+        Load a version from its snapshot (e.g. page loaded by another worker, which has already loaded a new version)
+        """
+        with self.lock_versions:
+            dictionary = self.dict_versions.get(version)
+            if dictionary is not None:
+                return dictionary
+            snapshot = load_version(version)
+            if snapshot is None:
+                logger.warning('Study %s: version %s of the data dictionary is not available, current version is used',
+                               self.name, version)
+                return self.dictionary
+            dictionary = DataDictionary(*snapshot, version, previous=self.dictionary)
+            self.add_version(dictionary)
+            return dictionary
+
+    def add_version(self, dictionary):
+        self.dict_versions[dictionary.version] = dictionary
+        self.dict_versions.move_to_end(dictionary.version)
+        while len(self.dict_versions) > MAX_VERSIONS:
+            version = next(iter(self.dict_versions))
+            if version == self.dictionary.version:
+                self.dict_versions.move_to_end(version)
+            else:
+                del self.dict_versions[version]
+
+    def reload(self, df_fields, version):
+        """
+        Make a new version of the fields the current version (e.g. fields read from the Redcap metadata API)
+        The list of forms is not reloaded (callbacks of the app are registered for each form)
+        Return dict of changes (form -> added/removed/changed fields), empty if version is already the current version
+        """
+        with self.lock_versions:
+            if version == self.dictionary.version:
+                return {}
+            dictionary = self.dict_versions.get(version)
+            if dictionary is None:
+                dictionary = DataDictionary(self.dictionary.df_forms, df_fields, version, previous=self.dictionary)
+            dict_changes = get_changes(self.dictionary, dictionary)
+            self.dictionary = dictionary
+            self.add_version(dictionary)
+        for function in self.list_reload_hooks:
+            function()
+        return dict_changes
+
+    def __repr__(self):
+        return f'Study({self.name!r}, prefix={self.prefix!r}, fields={len(self.dict_fields)})'
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Templates of forms, rendered once and patched for each user session
+
+A form (list of Dash components) is serialized once to JSON (nested dicts and
+lists, as sent to the browser), with an index of the rows of its fields. The
+contents of a form for a session are the template where only the rows that
+differ are replaced by patched copies:
+    - rows shown/hidden by branching logic (answers in other forms)
+    - rows of answers restored from a draft (value, answer stores, border), and values of calc fields
+Other rows are shared by all sessions: components are not built again, and
+Dash encodes plain JSON instead of calling to_plotly_json on each component.
+Templates are never modified, so they are shared by the threads of a worker.
+"""
+
+import json
+
+import plotly
+
+
+# Types of ids (see app.get_component_id) -> property that holds the answer
+DICT_PROPS_ANSWER = {
+    'field': 'value',
+    'field_date': 'date',
+    'store_answer': 'data',
+    'store_source': 'data',
+    'calc': 'value',
+}
+LIST_TYPES_ROW = ['row_outer', 'row_logic']
+
+
+def get_json_from_components(contents):
+    """
+    Return components as JSON (same encoding as the responses of Dash)
+    """
+    return json.loads(json.dumps(contents, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def get_id(node):
+    """
+    Return id of a component (JSON) if it is a pattern-matching id, otherwise None
+    """
+    if isinstance(node, dict):
+        id_node = node.get('props', {}).get('id')
+        if isinstance(id_node, dict):
+            return id_node
+    return None
+
+
+def copy_patched(node, dict_patches):
+    """
+    Return copy of a component (JSON) and its children, where properties of components are replaced
+    Inputs:
+        - dict_patches: type of id -> dict of properties, e.g. {'row_inner': {'style': {...}}, 'field': {'value': 1}}
+    """
+    if isinstance(node, list):
+        return [copy_patched(i, dict_patches) for i in node]
+    if not isinstance(node, dict) or 'props' not in node:
+        return node
+    props = dict(node['props'])
+    id_node = get_id(node)
+    if id_node is not None and id_node.get('type') in dict_patches:
+        props.update(dict_patches[id_node['type']])
+    if 'children' in props:
+        props['children'] = copy_patched(props['children'], dict_patches)
+    return {**node, 'props': props}
+
+
+class FormTemplate:
+    """
+    Contents of a form rendered once (initial branching logic, no answers), patched for each session
+    Inputs:
+        - contents: list of components of the form (see app.add_html_form)
+        - dict_hide: show/hide state of all questions used to render contents
+        - style_visible, style_hidden: styles of rows shown/hidden by branching logic
+        - style_empty, style_answered: borders of rows without/with an answer (other borders, e.g. descriptive rows, are kept)
+    """
+
+    def __init__(self, contents, dict_hide, style_visible, style_hidden, style_empty, style_answered):
+        self.list_nodes = get_json_from_components(contents)
+        self.style_visible = style_visible
+        self.style_hidden = style_hidden
+        self.style_answered = style_answered
+        self.dict_rows = {} # field name -> index of its row in list_nodes
+        self.list_logic = [] # fields with branching logic (rows that can be shown/hidden)
+        self.set_borders = set() # fields whose border shows if they are answered
+        for i, node in enumerate(self.list_nodes):
+            id_node = get_id(node)
+            if id_node is not None and id_node.get('type') in LIST_TYPES_ROW:
+                self.dict_rows[id_node['name']] = i
+                if id_node['type'] == 'row_logic':
+                    self.list_logic.append(id_node['name'])
+                if node['props']['children'][0]['props'].get('style') == style_empty:
+                    self.set_borders.add(id_node['name'])
+        self.dict_hide = {name: dict_hide[name] for name in self.list_logic}
+
+    def render(self, dict_hide, dict_answers=None):
+        """
+        Return contents of the form (JSON) for a session
+        Inputs:
+            - dict_hide: current show/hide state of all questions
+            - dict_answers: answers restored from a draft (None: form is empty)
+        """
+        dict_patches = {}
+        for name in self.list_logic:
+            if dict_hide[name] != self.dict_hide[name]:
+                dict_patches[name] = {'row_logic': {'style': self.style_hidden if dict_hide[name] else self.style_visible}}
+        for name, value in (dict_answers or {}).items():
+            if name in self.dict_rows and value is not None:
+                dict_row = dict_patches.setdefault(name, {})
+                if name in self.set_borders:
+                    dict_row['row_inner'] = {'style': self.style_answered}
+                for type_id, prop in DICT_PROPS_ANSWER.items():
+                    dict_row[type_id] = {prop: value}
+        list_nodes = list(self.list_nodes)
+        for name, dict_row in dict_patches.items():
+            i = self.dict_rows[name]
+            list_nodes[i] = copy_patched(list_nodes[i], dict_row)
+        return list_nodes
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Tests are run from the root of the repository (python -m pytest), modules of the app are top-level modules
+"""
+
+import os
+import sys
+import threading
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from redcap_stub import RedcapStub
+
+
+@pytest.fixture
+def stub():
+    """
+    Redcap stub served on a free port (stub.api_url)
+    """
+    stub = RedcapStub()
+    server = stub.serve()
+    stub.api_url = f'http://127.0.0.1:{server.server_port}/api/'
+    yield stub
+    threading.Thread(target=server.shutdown, daemon=True).start() # without waiting for the poll interval
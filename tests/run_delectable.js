@@ -0,0 +1,78 @@
+/*
+Evaluate compiled rules with assets/delectable.js (run by tests/test_parity.py with node)
+
+Input (JSON on stdin):
+    - expressions: list of {ast, answers}
+    - validation: list of {rule, value}, and messages
+    - callbacks: list of {triggers, answers, calcs} (answers of source stores, values of rendered
+      calc fields) and config (store "store_client")
+Output (JSON on stdout): result of each expression, error message of each answer, and for each
+change of answers, what update_calc and then update_style do in the browser (calc_delta, hide_delta)
+*/
+
+var fs = require('fs');
+var path = require('path');
+
+global.window = {};
+var delectable = require(path.join(__dirname, '..', 'assets', 'delectable.js'));
+
+var callbacks = window.dash_clientside.delectable;
+var NO_UPDATE = {};
+window.dash_clientside.no_update = NO_UPDATE;
+
+var input = JSON.parse(fs.readFileSync(0, 'utf-8'));
+
+function getItems(type, values) {
+    return Object.keys(values).map(function(name) {
+        return {id: {type: type, name: name}, value: values[name]};
+    });
+}
+
+function getPropId(type, name) {
+    return JSON.stringify({name: name, type: type}) + (type === 'calc' ? '.value' : '.data');
+}
+
+function runCallbacks(item, config) {
+    // update_calc: answers of source stores changed (triggers) -> values of calc fields
+    window.dash_clientside.callback_context = {
+        triggered: item.triggers.map(function(name) { return {prop_id: getPropId('store_source', name)}; }),
+        inputs_list: [getItems('store_source', item.answers)],
+        states_list: [getItems('calc', item.calcs)]
+    };
+    var calcs = Object.assign({}, item.calcs);
+    var calcDelta = {};
+    callbacks.update_calc(null, null, config).forEach(function(value, i) {
+        var name = Object.keys(item.calcs)[i];
+        if (value !== NO_UPDATE) {
+            calcs[name] = calcDelta[name] = value;
+        }
+    });
+    // update_style: answers of source stores and values of calc fields changed -> rows shown/hidden
+    var listRows = Object.keys(config.rules.conditions).map(function(name) { return {type: 'row_logic', name: name}; });
+    window.dash_clientside.callback_context = {
+        triggered: item.triggers.map(function(name) { return {prop_id: getPropId('store_source', name)}; })
+            .concat(Object.keys(calcDelta).map(function(name) { return {prop_id: getPropId('calc', name)}; })),
+        inputs_list: [getItems('store_source', item.answers), getItems('calc', calcs)]
+    };
+    var hideDelta = {};
+    callbacks.update_style(null, null, listRows, config).forEach(function(style, i) {
+        if (style !== NO_UPDATE) {
+            hideDelta[listRows[i].name] = style === config.style_hidden;
+        }
+    });
+    return {calc_delta: calcDelta, hide_delta: hideDelta};
+}
+
+var output = {
+    expressions: input.expressions.map(function(item) {
+        return delectable.evaluate(item.ast, function(name) { return item.answers[name]; });
+    }),
+    validation: input.validation.map(function(item) {
+        return item.rule === null ? null : delectable.checkRule(item.rule, item.value, input.messages);
+    }),
+    callbacks: input.callbacks.map(function(item) {
+        return runCallbacks(item, input.config);
+    })
+};
+
+process.stdout.write(JSON.stringify(output));
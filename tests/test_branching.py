@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the compiler of branching logic (tokenizer, parser, compiled rules)
+Results of expressions are tested in test_parity.py
+"""
+
+import json
+
+import pytest
+
+from branching import BranchingLogic, BranchingLogicError, get_fields_from_ast, parse_expression, tokenize
+
+
+###################################################
+# Tokenizer
+###################################################
+
+def test_tokenize():
+    assert tokenize("[cb(2)] <> 'x' && not [a]>=2.5") == [
+        ('field', '[cb(2)]'), ('op', '<>'), ('string', "'x'"), ('op', 'and'), ('op', 'not'),
+        ('field', '[a]'), ('op', '>='), ('number', '2.5'),
+    ]
+
+
+def test_tokenize_keywords_and_functions():
+    assert tokenize('[a] OR [b] || ROUND(.5)') == [
+        ('field', '[a]'), ('op', 'or'), ('field', '[b]'), ('op', 'or'),
+        ('function', 'round'), ('op', '('), ('number', '.5'), ('op', ')'),
+    ]
+
+
+def test_tokenize_strings():
+    assert tokenize('"it\'s" = \'say "hi"\'') == [('string', '"it\'s"'), ('op', '='), ('string', '\'say "hi"\'')]
+
+
+@pytest.mark.parametrize('expression', ['[a] = 1 ; 2', '[a] = 1 xor [b] = 2', "[a] = 'unclosed"])
+def test_tokenize_errors(expression):
+    with pytest.raises(BranchingLogicError):
+        tokenize(expression)
+
+
+###################################################
+# Parser
+###################################################
+
+@pytest.mark.parametrize(('expression', 'ast'), [
+    ("[a] = '1'", ('cmp', '=', ('field', 'a', None), ('literal', '1'))),
+    ("[a] != 1", ('cmp', '<>', ('field', 'a', None), ('literal', '1'))),
+    ("[a] = -1", ('cmp', '=', ('field', 'a', None), ('neg', ('literal', '1')))),
+    ("[ cb (2)] = '1'", ('cmp', '=', ('field', 'cb', '2'), ('literal', '1'))),
+    ('[a] or [b] and [c]', ('or', ('field', 'a', None), ('and', ('field', 'b', None), ('field', 'c', None)))),
+    ('not not [a]', ('not', ('not', ('field', 'a', None)))),
+    ('1 - 2 - 3', ('arith', '-', ('arith', '-', ('literal', '1'), ('literal', '2')), ('literal', '3'))),
+    ('1 + 2 * 3', ('arith', '+', ('literal', '1'), ('arith', '*', ('literal', '2'), ('literal', '3')))),
+    ('2 ^ 3 ^ 2', ('arith', '^', ('literal', '2'), ('arith', '^', ('literal', '3'), ('literal', '2')))),
+    ('-2 ^ 2', ('neg', ('arith', '^', ('literal', '2'), ('literal', '2')))),
+    ('2 ^ -1', ('arith', '^', ('literal', '2'), ('neg', ('literal', '1')))),
+    ('-[a] * 2', ('arith', '*', ('neg', ('field', 'a', None)), ('literal', '2'))),
+    ('sum([a], 1 + 2)', ('call', 'sum', [('field', 'a', None), ('arith', '+', ('literal', '1'), ('literal', '2'))])),
+    ("if([a] = '1', 'x', 'y')", ('call', 'if', [('cmp', '=', ('field', 'a', None), ('literal', '1')),
+                                                 ('literal', 'x'), ('literal', 'y')])),
+])
+def test_parse(expression, ast):
+    assert parse_expression(expression) == ast
+
+
+@pytest.mark.parametrize('expression', [
+    '', '   ', '([a] = 1', '[a] = 1)', '[a] =', "if([a], 'x')", 'sum(', '[a] [b]', '= 1',
+])
+def test_parse_errors(expression):
+    with pytest.raises(BranchingLogicError):
+        parse_expression(expression)
+
+
+def test_get_fields_from_ast():
+    ast = parse_expression("[a] = '1' and (sum([b], -[c]) > 2 or not [cb(1)] = '1')")
+    assert get_fields_from_ast(ast) == {'a', 'b', 'c', 'cb'}
+
+
+###################################################
+# Branching logic of a data dictionary
+###################################################
+
+@pytest.fixture
+def branching_logic():
+    # b depends on a, c on b, d on a and c, e on x (x has no logic)
+    return BranchingLogic({
+        'b': "[a] = '1'",
+        'c': "[b] = '1'",
+        'd': "[a] = '1' or [c] <> ''",
+        'e': "[x] > 2",
+    })
+
+
+def test_indexes(branching_logic):
+    assert branching_logic.get_affected_fields('a') == ('b', 'c', 'd')
+    assert branching_logic.get_affected_fields('c') == ('d',)
+    assert branching_logic.get_affected_fields('d') == ()
+    assert branching_logic.dict_evaluation['c'] == ('b', 'c', 'd') # parents of c are evaluated before d
+    assert sorted(branching_logic.get_sources()) == ['a', 'b', 'c', 'x']
+
+
+def test_get_rules_is_json(branching_logic):
+    dict_rules = json.loads(json.dumps(branching_logic.get_rules()))
+    assert dict_rules['conditions']['b'] == ['cmp', '=', ['field', 'a', None], ['literal', '1']]
+    assert dict_rules['affected']['a'] == ['b', 'c', 'd']
+
+
+def test_hidden_parent_hides_children(branching_logic):
+    # c is answered, but b is hidden (a is not 1): c is hidden, and its answer counts as empty for d
+    dict_answers = {'a': '2', 'b': '1', 'c': '1'}
+    assert branching_logic.get_hide_delta('a', dict_answers) == {'b': True, 'c': True, 'd': True}
+    dict_answers['a'] = '1'
+    assert branching_logic.get_hide_delta('a', dict_answers) == {'b': False, 'c': False, 'd': False}
+
+
+def test_get_dict_hide(branching_logic):
+    dict_hide = branching_logic.get_dict_hide({'x': '3'}, ['a', 'b', 'c', 'd', 'e', 'f'])
+    assert dict_hide == {'a': False, 'b': True, 'c': True, 'd': True, 'e': False, 'f': False}
+
+
+def test_circular_logic():
+    with pytest.raises(BranchingLogicError, match='Circular'):
+        BranchingLogic({'a': "[b] = '1'", 'b': "[a] = '1'"})
+
+
+def test_error_names_field():
+    with pytest.raises(BranchingLogicError, match='Field b:'):
+        BranchingLogic({'b': '[a] = '})
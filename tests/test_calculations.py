@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the engine of calc fields
+"""
+
+import pytest
+
+from branching import BranchingLogicError
+from calculations import Calculations, get_value_from_string
+
+
+@pytest.fixture
+def calculations():
+    # total depends on a and b, double on total, ratio on a (defined before total: order is not the order of the file)
+    return Calculations({
+        'double': '[total] * 2',
+        'total': 'sum([a], [b])',
+        'ratio': 'round([a] / 3, 2)',
+    })
+
+
+def test_get_value_from_string():
+    assert get_value_from_string('3') == 3 and isinstance(get_value_from_string('3'), int)
+    assert get_value_from_string('0.5') == 0.5
+    assert get_value_from_string('') is None
+    assert get_value_from_string('x') is None
+
+
+def test_affected(calculations):
+    list_affected = list(calculations.dict_affected['a'])
+    assert sorted(list_affected) == ['double', 'ratio', 'total']
+    assert list_affected.index('total') < list_affected.index('double') # evaluation order
+    assert calculations.dict_affected['b'] == ('total', 'double')
+    assert calculations.dict_affected['total'] == ('double',)
+    assert sorted(calculations.get_sources()) == ['a', 'b', 'total']
+
+
+def test_get_delta(calculations):
+    dict_answers = {'a': 1, 'b': 2, 'total': None, 'double': None}
+    assert calculations.get_delta('b', dict_answers) == {'total': 3, 'double': 6}
+    assert dict_answers['total'] is None # answers are not modified
+
+
+def test_get_values(calculations):
+    assert calculations.get_values({'a': '2'}) == {'total': 2, 'double': 4, 'ratio': 0.67}
+    assert calculations.get_values({}) == {'total': None, 'double': None, 'ratio': None}
+
+
+def test_get_rules(calculations):
+    dict_rules = calculations.get_rules()
+    assert dict_rules['equations']['double'] == ('arith', '*', ('field', 'total', None), ('literal', '2'))
+    assert dict_rules['affected']['total'] == ['double']
+
+
+def test_circular_equations():
+    with pytest.raises(BranchingLogicError, match='Calc fields'):
+        Calculations({'a': '[b] + 1', 'b': '[a] + 1'})
+
+
+def test_error_names_field():
+    with pytest.raises(BranchingLogicError, match='Calc field a:'):
+        Calculations({'a': 'sum([b]'})
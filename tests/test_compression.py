@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the precompressed layout and dependencies (Flask test client)
+"""
+
+import gzip
+import itertools
+import json
+
+import brotli
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+import flask
+import pytest
+from dash.dependencies import Input, Output
+
+from compression import init_app
+
+
+def get_layout(text):
+    return html.Div([dcc.Input(id='input', value=text), html.Div(id='output')])
+
+
+def get_app():
+    app = dash.Dash(__name__, server=flask.Flask(__name__), url_base_pathname='/study/')
+    app.layout = get_layout('v1')
+    app.callback(Output('output', 'children'), [Input('input', 'value')])(lambda value: value)
+    return app
+
+
+def get_json(response):
+    body = response.get_data()
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'br':
+        body = brotli.decompress(body)
+    elif encoding == 'gzip':
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+@pytest.fixture
+def app():
+    app = get_app()
+    app.routes = init_app(app, app.layout, ['br', 'gzip'])
+    return app
+
+
+@pytest.mark.parametrize(('accept_encoding', 'encoding'), [
+    ('gzip, deflate, br', 'br'),
+    ('gzip', 'gzip'),
+    ('br;q=0, gzip', 'gzip'),
+    ('', None),
+])
+def test_encoding(app, accept_encoding, encoding):
+    response = app.server.test_client().get('/study/_dash-layout', headers={'Accept-Encoding': accept_encoding})
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding') == encoding
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert get_json(response)['props']['children'][0]['props']['value'] == 'v1'
+
+
+def test_dependencies(app):
+    response = app.server.test_client().get('/study/_dash-dependencies', headers={'Accept-Encoding': 'br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert [item['output'] for item in get_json(response)] == ['output.children']
+
+
+def test_etag(app):
+    client = app.server.test_client()
+    response_br = client.get('/study/_dash-layout', headers={'Accept-Encoding': 'br'})
+    response_gzip = client.get('/study/_dash-layout', headers={'Accept-Encoding': 'gzip'})
+    etag = response_br.headers['ETag']
+    assert etag.startswith('"') and etag.endswith('-br"') # strong ETag, one per encoding
+    assert response_gzip.headers['ETag'] != etag
+    assert response_br.headers['Cache-Control'] == 'no-cache'
+    response = client.get('/study/_dash-layout', headers={'Accept-Encoding': 'br', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert response.headers['ETag'] == etag
+    # ETag of another encoding: full response
+    response = client.get('/study/_dash-layout', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+def test_etag_changes_after_reload(app):
+    client = app.server.test_client()
+    etag = client.get('/study/_dash-layout', headers={'Accept-Encoding': 'br'}).headers['ETag']
+    etag_dependencies = client.get('/study/_dash-dependencies', headers={'Accept-Encoding': 'br'}).headers['ETag']
+    app.routes.update(get_layout('v2')) # new version of the data dictionary
+    response = client.get('/study/_dash-layout', headers={'Accept-Encoding': 'br', 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert get_json(response)['props']['children'][0]['props']['value'] == 'v2'
+    response = client.get('/study/_dash-dependencies', headers={'Accept-Encoding': 'br', 'If-None-Match': etag_dependencies})
+    assert response.status_code == 304 # callbacks have not changed
+
+
+def test_placeholder():
+    # layout with a new session id for each page: compressed for each request, no ETag
+    app = get_app()
+    counter = itertools.count()
+    init_app(app, get_layout('__session__'), ['gzip'], placeholder='__session__', get_value=lambda: f'id{next(counter)}')
+    client = app.server.test_client()
+    list_responses = [client.get('/study/_dash-layout', headers={'Accept-Encoding': 'gzip'}) for _ in range(2)]
+    assert [get_json(r)['props']['children'][0]['props']['value'] for r in list_responses] == ['id0', 'id1']
+    assert 'ETag' not in list_responses[0].headers
+
+
+def test_disabled():
+    app = get_app()
+    assert init_app(app, app.layout, []) is None
+    response = app.server.test_client().get('/study/_dash-layout')
+    assert 'ETag' not in response.headers
+    assert get_json(response)['props']['children'][0]['props']['value'] == 'v1'
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the draft logs (autosave)
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+import drafts
+from drafts import DraftStore, create_draft_store, get_config_drafts_from_env
+
+
+@pytest.fixture
+def store(tmp_path):
+    # thread that syncs logs does nothing during the test
+    return DraftStore(str(tmp_path), fsync_interval=3600, compact_lines=5)
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+def test_append_load(store):
+    assert store.load('patient 1', 7) == {}
+    store.append('patient 1', 7, {'a': '1', 'b': None})
+    store.append('patient 1', 7, {'a': '2', 'c': ['1', '2']})
+    store.append('patient 1', 1, {'a': '3'})
+    assert store.load('patient 1', 7) == {'a': '2', 'b': None, 'c': ['1', '2']}
+    assert store.load('patient 1', 1) == {'a': '3'}
+    assert store.load('patient_1', 7) == {} # same sanitized name, different patient
+    path = store.get_path('patient 1', 7)
+    assert os.path.basename(path).startswith('patient_1_') and path.endswith('_d7.jsonl')
+    assert read_lines(path) == ['{"a": "1", "b": null}', '{"a": "2", "c": ["1", "2"]}'] # append-only
+
+
+def test_delete(store):
+    store.append('p', 7, {'a': '1'})
+    store.delete('p', 7)
+    assert store.load('p', 7) == {}
+    store.delete('p', 7) # no draft
+    store.append('p', 7, {'b': '2'})
+    assert store.load('p', 7) == {'b': '2'}
+
+
+def test_partial_line_is_ignored(store):
+    # a crash while a line is written leaves a partial line
+    store.append('p', 7, {'a': '1'})
+    with open(store.get_path('p', 7), 'a', encoding='utf-8') as f:
+        f.write('{"b": "tru')
+    assert store.load('p', 7) == {'a': '1'}
+
+
+def test_recover_after_restart(tmp_path):
+    # answers are written to the OS at once: a new process reads them, even if the first one did not sync them
+    store = DraftStore(str(tmp_path), fsync_interval=3600)
+    store.append('p', 7, {'a': '1'})
+    store.append('p', 7, {'b': '2'})
+    store_restarted = DraftStore(str(tmp_path), fsync_interval=3600)
+    assert store_restarted.load('p', 7) == {'a': '1', 'b': '2'}
+    store_restarted.append('p', 7, {'a': '3'})
+    assert store.load('p', 7) == {'a': '3', 'b': '2'}
+
+
+def test_concurrent_appends(tmp_path):
+    # two stores (e.g. two gunicorn workers) append to the same log from several threads: no line is lost or mixed
+    list_stores = [DraftStore(str(tmp_path), fsync_interval=3600, compact_lines=10**6) for _ in range(2)]
+
+    def append(store, i):
+        for j in range(50):
+            store.append('p', 7, {f'field_{i}_{j}': 'x' * 100})
+
+    list_threads = [threading.Thread(target=append, args=(list_stores[i % 2], i)) for i in range(4)]
+    for thread in list_threads:
+        thread.start()
+    for thread in list_threads:
+        thread.join()
+    assert len(list_stores[0].load('p', 7)) == 200
+    assert len(read_lines(list_stores[0].get_path('p', 7))) == 200
+
+
+def test_compaction(store):
+    for i in range(8):
+        store.append('p', 7, {'a': str(i)})
+    store.append('p', 7, {'b': '1'})
+    store.flush() # more than compact_lines lines: one line per field
+    path = store.get_path('p', 7)
+    assert read_lines(path) == ['{"a": "7"}', '{"b": "1"}']
+    assert path not in store.dict_files
+    store.append('p', 7, {'b': '2'}) # log is opened again
+    assert read_lines(path) == ['{"a": "7"}', '{"b": "1"}', '{"b": "2"}']
+    assert [name for name in os.listdir(store.path) if name.endswith('.tmp')] == []
+
+
+def test_compaction_by_another_process(tmp_path):
+    store = DraftStore(str(tmp_path), fsync_interval=3600, compact_lines=2)
+    other = DraftStore(str(tmp_path), fsync_interval=3600, compact_lines=2)
+    for i in range(3):
+        store.append('p', 7, {'a': str(i)})
+    other.append('p', 7, {'b': '1'}) # file of other is replaced by the compaction
+    store.flush()
+    other.append('p', 7, {'c': '1'}) # written to the compacted log, not to the replaced file
+    assert store.load('p', 7) == {'a': '2', 'b': '1', 'c': '1'}
+
+
+def test_fsync_thread(tmp_path, monkeypatch):
+    list_synced = []
+    monkeypatch.setattr(drafts.os, 'fsync', list_synced.append)
+    store = DraftStore(str(tmp_path), fsync_interval=0.01)
+    store.append('p', 7, {'a': '1'})
+    assert store.thread is not None and store.thread.is_alive()
+    deadline = time.monotonic() + 5
+    while not list_synced and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert list_synced == [store.dict_files[store.get_path('p', 7)][0].fileno()]
+    assert store.dict_files[store.get_path('p', 7)][2] is False # not dirty: not synced again
+
+
+def test_create_draft_store(tmp_path, monkeypatch):
+    monkeypatch.delenv('DELECTABLE_DRAFTS', raising=False)
+    assert create_draft_store(**get_config_drafts_from_env()) is None # autosave is opt-in
+    monkeypatch.setenv('DELECTABLE_DRAFTS', str(tmp_path / 'drafts'))
+    monkeypatch.setenv('DRAFTS_COMPACT_LINES', '10')
+    store = create_draft_store(**get_config_drafts_from_env())
+    assert os.path.isdir(store.path) and store.compact_lines == 10
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the bulk ingestion of offline records (bundled data dictionary, records of tests/data/records.csv)
+"""
+
+import csv
+import json
+import os
+
+import pytest
+
+from fields import FieldSpec
+from ingest import check_record, get_answer, main, read_records, write_batches
+from study import Study
+
+
+PATH_RECORDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'records.csv')
+
+
+@pytest.fixture(scope='module')
+def study(tmp_path_factory):
+    return Study(outbox=str(tmp_path_factory.mktemp('ingest') / 'outbox.sqlite3'))
+
+
+@pytest.fixture
+def environ(tmp_path, monkeypatch):
+    monkeypatch.setenv('DELECTABLE_OUTBOX', str(tmp_path / 'outbox.sqlite3'))
+    monkeypatch.delenv('DELECTABLE_STUDIES', raising=False)
+
+
+def get_rejects(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.mark.parametrize(('field_name', 'value', 'answer'), [
+    ('cdai_abdopain_d7', 'Mild', 1), # label of a choice
+    ('cdai_abdopain_d7', ' 2 ', 2),
+    ('cdai_abdopain_d7', 2.0, 2),
+    ('cdai_abdopain_d7', 'unknown', 'unknown'), # kept, reported by validation
+    ('cdai_date', '31/12/2020', '2020-12-31'), # display format of the date picker (dmy)
+    ('cdai_date', '2020-1-5', '2020-01-05'),
+    ('cdai_date', '31/02/2020', '31/02/2020'),
+    ('cdai_totalstools', '12.0', 12),
+    ('cdai_totalstools', '2.5', 2.5),
+    ('cdai_totalstools', 'nan', 'nan'),
+    ('cdai_totalstools', '  ', None),
+])
+def test_get_answer(study, field_name, value, answer):
+    assert get_answer(study.dict_fields[field_name], value) == answer
+
+
+def test_get_answer_checkbox():
+    field = FieldSpec(name='cb', field_type='checkbox', type_component='checkbox', dict_options={1: 'A', 2: 'B'})
+    assert get_answer(field, '1;b') == [1, 2]
+    assert get_answer(field, ['2']) == [2]
+    assert get_answer(field, '') is None
+
+
+def test_read_records(tmp_path):
+    list_lines = read_records(PATH_RECORDS)
+    assert [line for line, _ in list_lines] == [2, 3, 4, 5, 6, 7] # line numbers of the file (header is line 1)
+    assert list_lines[0][1]['cdai_abdopain_d7'] == 'Mild'
+    path = tmp_path / 'records.jsonl'
+    path.write_text('{"record_id": "p1", "cdai_totalstools": 3}\n\n{"record_id": "p2"}\n', encoding='utf-8')
+    assert read_records(str(path)) == [(1, {'record_id': 'p1', 'cdai_totalstools': 3}), (3, {'record_id': 'p2'})]
+
+
+def test_check_record(study):
+    dict_results = {line: check_record(study, record) for line, record in read_records(PATH_RECORDS)}
+    record, list_errors = dict_results[2]
+    assert list_errors == []
+    assert {k: v for k, v in record.items() if v not in ['', None]} == {
+        'record_id': 'p1', 'cdai_date': '2020-12-31', 'cdai_totalstools': 12, 'cdai_abdopain_d7': 1,
+        'cdai_gender': 1, 'cho_1': 1, 'time_1': 1}
+    # answer of a field hidden by branching logic (time_1, cho_1 is not 1) is not checked
+    assert dict_results[3] == (None, [('cdai_date', 'yesterday', 'Expected a date'),
+                                      ('cdai_totalstools', 'abc', 'Expected a number'),
+                                      ('cdai_abdopain_d7', '5', 'Answer is not one of the choices')])
+    assert dict_results[4][0]['cdai_abdopain_d1'] == 0
+    assert dict_results[5] == (None, [('cdai_abdopain_d7', '2', 'Form cdai is not available on day 1')])
+    assert dict_results[6] == (None, [('record_id', None, 'Patient code is required')])
+    assert dict_results[7] == (None, [('visit_day', '9', 'Expected a visit day (1-7)')])
+
+
+def test_check_record_jsonl_types(study):
+    # JSONL keeps numbers and lists, answers are normalized in the same way
+    record, list_errors = check_record(study, {'record_id': 7, 'cdai_totalstools': 12.0, 'cdai_gender': 'Other'}, 7)
+    assert list_errors == []
+    assert (record['record_id'], record['cdai_totalstools'], record['cdai_gender']) == ('7', 12, 2)
+
+
+def test_write_batches(tmp_path):
+    (tmp_path / 'records_00009.json').write_text('[]') # batches of a previous run are removed
+    list_paths = write_batches(str(tmp_path), [{'record_id': str(i)} for i in range(5)], 2)
+    assert [os.path.basename(path) for path in list_paths] == ['records_00001.json', 'records_00002.json', 'records_00003.json']
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(path) for path in list_paths]
+    with open(list_paths[2], encoding='utf-8') as f:
+        assert json.load(f) == [{'record_id': '4'}]
+
+
+def test_main(environ, study, tmp_path, capsys):
+    path_out = tmp_path / 'out'
+    main([PATH_RECORDS, '--out', str(path_out), '--workers', '1', '--batch-size', '1', '--outbox'])
+    list_batches = sorted(name for name in os.listdir(path_out) if name.startswith('records_'))
+    assert list_batches == ['records_00001.json', 'records_00002.json']
+    # one row per invalid answer, with the line of the file and the reason
+    assert [(row['line'], row['record_id'], row['field'], row['form'], row['message'])
+            for row in get_rejects(path_out / 'rejects.csv')] == [
+        ('3', 'p2', 'cdai_date', 'cdai', 'Expected a date'),
+        ('3', 'p2', 'cdai_totalstools', 'cdai', 'Expected a number'),
+        ('3', 'p2', 'cdai_abdopain_d7', 'cdai', 'Answer is not one of the choices'),
+        ('5', 'p4', 'cdai_abdopain_d7', 'cdai', 'Form cdai is not available on day 1'),
+        ('6', '', 'record_id', '', 'Patient code is required'),
+        ('7', 'p6', 'visit_day', '', 'Expected a visit day (1-7)'),
+    ]
+    output = capsys.readouterr().out
+    assert 'Valid records: 2 in 2 batch(es)' in output and '(added to the outbox)' in output
+    assert 'Rejected records: 4' in output
+    assert 'Columns ignored (not fields of the data dictionary): comment' in output
+    assert Study().outbox.count() == {'pending': 2}
+
+
+def test_main_day(environ, tmp_path, capsys):
+    # records without visit_day are checked with the forms of --day
+    path = tmp_path / 'records.jsonl'
+    path.write_text('{"record_id": "p1", "cdai_abdopain_d1": "None"}\n', encoding='utf-8')
+    main([str(path), '--day', '7', '--workers', '1'])
+    assert 'Rejected records: 1' in capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        main([str(path), '--day', '8', '--workers', '1'])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the hot reload of the data dictionary, against the Redcap stub (redcap_stub.py)
+"""
+
+import copy
+
+import pytest
+
+from dictionary import get_metadata_from_fields
+from metadata import MetadataSync
+from redcap import RedcapError
+from study import Study
+
+
+@pytest.fixture
+def study(stub, tmp_path, monkeypatch):
+    monkeypatch.setenv('DELECTABLE_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setenv('REDCAP_RETRIES', '0')
+    study = Study(redcap_api_url=stub.api_url, redcap_api_token='stub', outbox=str(tmp_path / 'outbox.sqlite3'))
+    stub.metadata = get_metadata_from_fields(study.dictionary.df_fields) # Redcap project is up to date
+    return study
+
+
+def get_field(list_metadata, field_name):
+    return next(item for item in list_metadata if item['field_name'] == field_name)
+
+
+def test_no_change(stub, study):
+    sync = MetadataSync(study)
+    dictionary = study.dictionary
+    assert sync.sync() == {}
+    assert study.dictionary is dictionary # first export: version of the app is kept
+    assert sync.etag is not None
+    assert sync.sync() == {} # 304
+    assert stub.list_requests[-1]['content'] == 'metadata'
+    assert study.dictionary is dictionary
+
+
+def test_changed_label(stub, study):
+    sync = MetadataSync(study)
+    sync.sync()
+    version = study.version
+    stub.metadata = copy.deepcopy(stub.metadata)
+    get_field(stub.metadata, 'cdai_date')['field_label'] = 'Start date of CDAI'
+    assert sync.sync() == {'cdai': {'added': [], 'removed': [], 'changed': ['cdai_date']}}
+    assert study.version != version
+    assert study.dict_fields['cdai_date'].label == 'Start date of CDAI'
+    assert study.get_version(version).dict_fields['cdai_date'].label != 'Start date of CDAI' # sessions in progress
+    assert sync.sync() == {}
+
+
+def test_added_field(stub, study):
+    sync = MetadataSync(study)
+    item = {**get_field(stub.metadata, 'cdai_date'), 'field_name': 'cdai_comment', 'field_label': 'Comment',
+            'text_validation_type_or_show_slider_number': ''}
+    stub.metadata = stub.metadata + [item]
+    dict_changes = sync.sync()
+    assert dict_changes == {'cdai': {'added': ['cdai_comment'], 'removed': [], 'changed': []}}
+    assert 'cdai_comment' in study.dict_fields
+
+
+def test_failed_export(stub, study):
+    sync = MetadataSync(study)
+    dictionary = study.dictionary
+    stub.fail = 1
+    with pytest.raises(RedcapError):
+        sync.sync()
+    assert (sync.version, sync.etag) == (None, None) # exported again at the next interval
+    assert study.dictionary is dictionary
+    assert sync.sync() == {}
+    assert sync.version is not None
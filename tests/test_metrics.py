@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the metrics of callbacks, scraped on /metrics with the Flask test client
+"""
+
+import json
+import re
+
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+import pytest
+from dash.dependencies import Input, Output
+
+import metrics
+
+
+REGEX_SAMPLE = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+
+
+@pytest.fixture
+def dash_app():
+    dash_app = dash.Dash(__name__, url_base_pathname='/metrics_test/')
+    dash_app.layout = html.Div([dcc.Input(id='input', value=''), html.Div(id='output'), html.Div(id='output_error')])
+
+    @dash_app.callback(Output('output', 'children'), [Input('input', 'value')])
+    def echo(value):
+        return value
+
+    @dash_app.callback(Output('output_error', 'children'), [Input('input', 'value')])
+    def fail(value):
+        raise ValueError(value)
+
+    metrics.init_app(dash_app, study='metrics_test')
+    return dash_app
+
+
+def get_samples(text, study):
+    """
+    Return list of (name, dict of labels, value) of the samples of a study
+    """
+    list_samples = []
+    for line in text.splitlines():
+        match = REGEX_SAMPLE.match(line)
+        if match:
+            dict_labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2)))
+            if dict_labels.get('study') == study:
+                list_samples.append((match.group(1), dict_labels, float(match.group(3))))
+    return list_samples
+
+
+def update(client, output):
+    body = {'output': f'{output}.children', 'outputs': {'id': output, 'property': 'children'},
+            'inputs': [{'id': 'input', 'property': 'value', 'value': 'x'}], 'changedPropIds': ['input.value']}
+    return client.post('/metrics_test/_dash-update-component', data=json.dumps(body), content_type='application/json')
+
+
+def test_callback_metrics(dash_app):
+    client = dash_app.server.test_client()
+    assert update(client, 'output').status_code == 200
+    assert update(client, 'output').status_code == 200
+    assert update(client, 'output_error').status_code == 500
+    response = client.get('/metrics_test/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    list_samples = get_samples(response.get_data(as_text=True), 'metrics_test')
+
+    dict_counts = {labels['callback']: value for name, labels, value in list_samples
+                   if name == 'delectable_callback_seconds_count'}
+    assert dict_counts == {'echo': 2, 'fail': 1}
+    list_buckets = [(labels['le'], value) for name, labels, value in list_samples
+                    if name == 'delectable_callback_seconds_bucket' and labels['callback'] == 'echo']
+    assert list_buckets[-1] == ('+Inf', 2)
+    assert [value for _, value in list_buckets] == sorted(value for _, value in list_buckets) # cumulative buckets
+    assert all(set(labels) == {'callback', 'le', 'pid', 'study'} for name, labels, _ in list_samples
+               if name.endswith('_bucket'))
+    assert [(labels['callback'], value) for name, labels, value in list_samples
+            if name == 'delectable_callback_errors_total'] == [('fail', 1)]
+    assert any(name == 'delectable_callback_response_bytes_sum' and value > 0 for name, _, value in list_samples)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the outbox and of the delivery of records to Redcap, against the Redcap stub (redcap_stub.py)
+"""
+
+import time
+import types
+
+import pytest
+
+import outbox as module_outbox
+import redcap
+from outbox import MESSAGE_PENDING, Outbox, main
+from redcap import RedcapClient
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(str(tmp_path / 'outbox.sqlite3'), batch_size=2)
+
+
+@pytest.fixture
+def list_sleeps(monkeypatch):
+    # backoff of the Redcap client, without waiting (time.sleep of other threads is not replaced)
+    list_sleeps = []
+    monkeypatch.setattr(redcap, 'time', types.SimpleNamespace(perf_counter=time.perf_counter, sleep=list_sleeps.append))
+    return list_sleeps
+
+
+def get_client(stub, retries=3):
+    return RedcapClient(stub.api_url, 'stub', retries=retries, backoff=0.5)
+
+
+def get_records(*list_ids):
+    return [{'record_id': record_id, 'field': 'x'} for record_id in list_ids]
+
+
+def test_claim(outbox):
+    submission_a = outbox.add(get_records('p1', 'p2'))
+    submission_b = outbox.add(get_records('p3'))
+    assert [record['record_id'] for _, record in outbox.claim(2)] == ['p1', 'p2'] # oldest records first
+    assert outbox.claim(10, submission_a) == [] # already claimed
+    assert [record['record_id'] for _, record in outbox.claim(10, submission_b)] == ['p3']
+    assert outbox.count() == {'sending': 3}
+    assert outbox.get_status(submission_a)['status'] == 'pending'
+
+
+def test_claim_timeout(outbox, monkeypatch):
+    # records claimed by a worker that died are claimed again
+    outbox.add(get_records('p1'))
+    assert len(outbox.claim(10)) == 1
+    assert outbox.claim(10) == []
+    monkeypatch.setattr(module_outbox, 'CLAIM_TIMEOUT', -1)
+    assert len(outbox.claim(10)) == 1
+
+
+def test_flush(stub, outbox):
+    submission_id = outbox.add(get_records('p1', 'p2', 'p3'))
+    assert outbox.flush(get_client(stub)) == 2 # batches of 2 records
+    assert sorted(stub.dict_records) == ['p1', 'p2', 'p3']
+    assert outbox.count() == {'done': 3}
+    assert outbox.get_status(submission_id) == {'status': 'done', 'message': 'Redcap confirmed 3 record(s)'}
+    assert outbox.flush(get_client(stub)) == 0
+
+
+def test_send_batch_invalid_record(stub, outbox):
+    # Redcap rejects the whole batch: records are sent one by one, only the invalid record is an error
+    stub.set_invalid = {'p2'}
+    outbox.batch_size = 3
+    submission_id = outbox.add(get_records('p1', 'p2', 'p3'))
+    outbox.send_batch(get_client(stub), outbox.claim(3))
+    assert sorted(stub.dict_records) == ['p1', 'p3']
+    assert outbox.count() == {'done': 2, 'error': 1}
+    assert outbox.get_status(submission_id)['status'] == 'error'
+    assert 'Invalid records: p2' in outbox.get_status(submission_id)['message']
+
+
+def test_send_submission(stub, outbox):
+    submission_a = outbox.add(get_records('p1'))
+    submission_b = outbox.add(get_records('p2'))
+    outbox.send_submission(get_client(stub), submission_b)
+    assert list(stub.dict_records) == ['p2']
+    assert outbox.get_status(submission_a)['status'] == 'pending'
+    assert outbox.get_status(submission_b)['status'] == 'done'
+
+
+@pytest.mark.parametrize('status', [503, 429])
+def test_retry(stub, outbox, list_sleeps, status):
+    stub.fail, stub.status = 2, status
+    outbox.add(get_records('p1'))
+    assert outbox.flush(get_client(stub)) == 1
+    assert list_sleeps == [0.5, 1.0] # exponential backoff
+    assert len(stub.list_requests) == 3
+    assert outbox.count() == {'done': 1}
+
+
+def test_retry_exhausted(stub, outbox, list_sleeps):
+    # Redcap not available: records are pending again, other batches are not sent
+    stub.fail = 10
+    submission_id = outbox.add(get_records('p1', 'p2', 'p3'))
+    assert outbox.flush(get_client(stub, retries=2)) == 1
+    assert list_sleeps == [0.5, 1.0]
+    assert outbox.count() == {'pending': 3}
+    assert outbox.get_status(submission_id) == {'status': 'pending', 'message': MESSAGE_PENDING}
+    stub.fail = 0
+    assert outbox.flush(get_client(stub)) == 2
+    assert outbox.count() == {'done': 3}
+
+
+def test_no_retry_client_error(stub, outbox, list_sleeps):
+    stub.fail, stub.status = 1, 403
+    outbox.add(get_records('p1'))
+    outbox.flush(get_client(stub))
+    assert list_sleeps == []
+    assert outbox.count() == {'error': 1}
+
+
+def test_replay(stub, outbox):
+    stub.set_invalid = {'p1'}
+    outbox.add(get_records('p1'))
+    outbox.flush(get_client(stub))
+    assert outbox.count() == {'error': 1}
+    stub.set_invalid = set()
+    assert outbox.replay() == 1
+    assert outbox.count() == {'pending': 1}
+    outbox.flush(get_client(stub))
+    assert outbox.count() == {'done': 1}
+
+
+def test_purge(stub, outbox):
+    stub.set_invalid = {'p2'}
+    outbox.add(get_records('p1'))
+    outbox.add(get_records('p2'))
+    outbox.flush(get_client(stub))
+    outbox.add(get_records('p3'))
+    assert outbox.purge(3600) == 0 # delivered records are kept during the retention period
+    time.sleep(0.01)
+    assert outbox.purge(0) == 1
+    assert outbox.count() == {'error': 1, 'pending': 1}
+
+
+def test_cli(stub, outbox, monkeypatch, capsys):
+    monkeypatch.setenv('DELECTABLE_OUTBOX', outbox.path)
+    monkeypatch.setenv('REDCAP_API_URL', stub.api_url)
+    monkeypatch.setenv('REDCAP_API_TOKEN', 'stub')
+    stub.set_invalid = {'p2'}
+    outbox.add(get_records('p1', 'p2'))
+    main(['flush', '--batch-size', '1'])
+    assert capsys.readouterr().out.splitlines() == [
+        'Requests sent to Redcap: 2', "Records per status: {'done': 1, 'error': 1}"]
+    stub.set_invalid = set()
+    main(['replay', '--flush'])
+    assert capsys.readouterr().out.splitlines() == [
+        'Records to send again: 1', 'Requests sent to Redcap: 1', "Records per status: {'done': 2}"]
+    time.sleep(0.01)
+    main(['purge', '--retention', '0'])
+    assert capsys.readouterr().out.splitlines() == ['Records deleted: 2', 'Records per status: {}']
+
+
+def test_cli_not_configured(outbox, monkeypatch):
+    monkeypatch.setenv('REDCAP_API_URL', '')
+    with pytest.raises(SystemExit):
+        main(['flush', '--path', outbox.path])
+
+
+def test_worker(stub, outbox):
+    worker = module_outbox.OutboxWorker(outbox, get_client(stub), batch_delay=0, retry_interval=30)
+    outbox.add(get_records('p1'))
+    worker.notify()
+    thread = worker.thread
+    worker.stop() # the thread has sent the record, or has not claimed it
+    assert not thread.is_alive()
+    outbox.flush(get_client(stub))
+    assert list(stub.dict_records) == ['p1']
+    assert outbox.count() == {'done': 1}
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Parity of the Python and browser implementations of compiled rules
+
+Each expression and each answer of expressions.json has an expected result, checked
+with branching.py / validation.py and with assets/delectable.js (run with node, tests
+of the browser are skipped if node is not installed).
+
+Changes of answers ("callbacks") are checked with the clientside callbacks update_calc and
+update_style, and with their Python copies used by benchmarks (Calculations.get_delta,
+BranchingLogic.get_hide_delta).
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from branching import BranchingLogic, compile_ast, parse_expression
+from calculations import Calculations
+from fields import FieldSpec
+from validation import DICT_MESSAGES, check_rule, compile_rule
+
+
+PATH_TESTS = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(PATH_TESTS, 'expressions.json'), encoding='utf-8') as f:
+    DICT_TABLE = json.load(f)
+LIST_EXPRESSIONS = DICT_TABLE['expressions']
+LIST_VALIDATION = DICT_TABLE['validation']
+DICT_CALLBACKS = DICT_TABLE['callbacks']
+LIST_CALLBACKS = DICT_CALLBACKS['cases']
+BRANCHING_LOGIC = BranchingLogic(DICT_CALLBACKS['logic'])
+CALCULATIONS = Calculations(DICT_CALLBACKS['equations'])
+
+
+def get_rule(item):
+    return compile_rule(FieldSpec(name='field', **item['field']))
+
+
+def run_node(path_script, dict_input):
+    """
+    Return output (JSON) of a node script that reads its input (JSON) on stdin
+    """
+    node = shutil.which('node')
+    if node is None:
+        pytest.skip('node is not installed')
+    output = subprocess.run([node, path_script], input=json.dumps(dict_input), check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output)
+
+
+def assert_same(value, expected):
+    """
+    Results of expressions are strings or booleans (True is not '1')
+    """
+    assert (type(value), value) == (type(expected), expected)
+
+
+@pytest.fixture(scope='module')
+def dict_results_js():
+    return run_node(os.path.join(PATH_TESTS, 'run_delectable.js'), {
+        'expressions': [{'ast': parse_expression(item['expression']), 'answers': item['answers']}
+                        for item in LIST_EXPRESSIONS],
+        'validation': [{'rule': get_rule(item), 'value': item['value']} for item in LIST_VALIDATION],
+        'messages': DICT_MESSAGES,
+        'callbacks': LIST_CALLBACKS,
+        'config': {'rules': BRANCHING_LOGIC.get_rules(), 'calculations': CALCULATIONS.get_rules(),
+                   'style_hidden': {'display': 'none'}, 'style_visible': {'display': 'block'}},
+    })
+
+
+###################################################
+# Expressions (branching logic and calc fields)
+###################################################
+
+@pytest.mark.parametrize('i', range(len(LIST_EXPRESSIONS)), ids=[item['expression'] for item in LIST_EXPRESSIONS])
+def test_expression_python(i):
+    item = LIST_EXPRESSIONS[i]
+    function = compile_ast(parse_expression(item['expression']))
+    assert_same(function(item['answers'].get), item['result'])
+
+
+@pytest.mark.parametrize('i', range(len(LIST_EXPRESSIONS)), ids=[item['expression'] for item in LIST_EXPRESSIONS])
+def test_expression_js(dict_results_js, i):
+    assert_same(dict_results_js['expressions'][i], LIST_EXPRESSIONS[i]['result'])
+
+
+###################################################
+# Validation
+###################################################
+
+@pytest.mark.parametrize('i', range(len(LIST_VALIDATION)))
+def test_validation_python(i):
+    item = LIST_VALIDATION[i]
+    rule = get_rule(item)
+    message = None if rule is None else check_rule(rule, re.compile(rule['regex']) if 'regex' in rule else None,
+                                                   item['value'])
+    assert message == item['message']
+
+
+@pytest.mark.parametrize('i', range(len(LIST_VALIDATION)))
+def test_validation_js(dict_results_js, i):
+    assert dict_results_js['validation'][i] == LIST_VALIDATION[i]['message']
+
+
+###################################################
+# Callbacks (calc fields, then branching logic)
+###################################################
+
+def run_callbacks_python(item):
+    """
+    Return calc_delta and hide_delta of a change of answers, as the benchmarks do what the browser does
+    """
+    dict_answers = {**item['answers'], **item['calcs']}
+    dict_calc = {}
+    for field_name in item['triggers']:
+        dict_delta = CALCULATIONS.get_delta(field_name, dict_answers)
+        dict_answers.update(dict_delta)
+        dict_calc.update(dict_delta)
+    dict_calc = {name: value for name, value in dict_calc.items() if name in item['calcs']} # rendered calc fields
+    dict_hide = {}
+    for field_name in item['triggers'] + list(dict_calc):
+        dict_hide.update(BRANCHING_LOGIC.get_hide_delta(field_name, dict_answers))
+    return {'calc_delta': dict_calc, 'hide_delta': dict_hide}
+
+
+@pytest.mark.parametrize('i', range(len(LIST_CALLBACKS)))
+def test_callbacks_python(i):
+    item = LIST_CALLBACKS[i]
+    assert run_callbacks_python(item) == {'calc_delta': item['calc_delta'], 'hide_delta': item['hide_delta']}
+
+
+@pytest.mark.parametrize('i', range(len(LIST_CALLBACKS)))
+def test_callbacks_js(dict_results_js, i):
+    item = LIST_CALLBACKS[i]
+    assert dict_results_js['callbacks'][i] == {'calc_delta': item['calc_delta'], 'hide_delta': item['hide_delta']}
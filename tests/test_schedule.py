@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the schedule of visits
+"""
+
+import pandas as pd
+import pytest
+
+from schedule import N_DAYS_DEFAULT, Schedule, ScheduleError, get_days_from_string
+
+
+def get_df_forms(list_forms, list_days=None):
+    df_forms = pd.DataFrame({'Form Name': list_forms})
+    if list_days is not None:
+        df_forms['Visit Days'] = list_days
+    return df_forms
+
+
+def test_days_from_string():
+    assert get_days_from_string('1, 3, 5-7') == {1, 3, 5, 6, 7}
+    assert get_days_from_string('2; 4') == {2, 4}
+    assert get_days_from_string(3.0) == {3} # numbers read by pandas
+    with pytest.raises(ScheduleError):
+        get_days_from_string('day 1')
+
+
+def test_visit_days_column():
+    schedule = Schedule(get_df_forms(['home', 'diary', 'quality', 'notes', 'review'], ['', '1-9', '5, 10', None, '']))
+    assert schedule.n_days == 10 # last day of the column
+    assert schedule.list_days == list(range(1, 11))
+    assert schedule.get_forms(1) == ('home', 'diary', 'notes', 'review')
+    assert schedule.get_forms(5) == ('home', 'diary', 'quality', 'notes', 'review')
+    assert schedule.get_forms(10) == ('home', 'quality', 'notes', 'review')
+
+
+def test_form_names():
+    # days taken from names: daily forms on their day, other forms on the day after the last daily form
+    schedule = Schedule(get_df_forms(['home', 'cdai_d1', 'cdai_d2', 'cdai', 'ibdq9', 'review']))
+    assert schedule.n_days == 3
+    assert schedule.get_forms(1) == ('home', 'cdai_d1', 'review')
+    assert schedule.get_forms(2) == ('home', 'cdai_d2', 'review')
+    assert schedule.get_forms(3) == ('home', 'cdai', 'ibdq9', 'review')
+    assert Schedule(get_df_forms(['home', 'cdai', 'review'])).n_days == N_DAYS_DEFAULT # no daily form
+
+
+def test_navigation():
+    schedule = Schedule(get_df_forms(['home', 'cdai_d1', 'cdai_d2', 'cdai', 'review']))
+    assert schedule.get_forms(None) == schedule.get_forms(9) == ('home',) # day not selected or outside the schedule
+    assert [option['value'] for option in schedule.get_options(3)] == ['home', 'cdai', 'review']
+    assert schedule.is_available('cdai_d2', 2) and not schedule.is_available('cdai_d2', 3)
+    assert schedule.get_next_form('home', 3, 1) == 'cdai'
+    assert schedule.get_next_form('review', 3, 1) == 'review'
+    assert schedule.get_next_form('cdai_d1', 3, -1) == 'home' # form not available on the day
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the server-side session stores
+"""
+
+import sys
+
+import pytest
+
+import session
+from session import FakeRedis, MemorySessionStore, RedisSessionStore, create_session_store, get_config_session_from_env
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # time.monotonic of the session stores, moved forward by the tests
+    clock = {'now': 1000.0}
+    monkeypatch.setattr(session.time, 'monotonic', lambda: clock['now'])
+    return clock
+
+
+def test_memory_store():
+    store = MemorySessionStore()
+    assert store.get('s1') == {}
+    store.update('s1', {'a': '1', 'b': None})
+    store.update('s1', {'b': ['1', '2']})
+    assert store.get('s1') == {'a': '1', 'b': ['1', '2']}
+    store.get('s1')['a'] = 'changed' # a copy is returned
+    assert store.get('s1')['a'] == '1'
+    store.reset('s1')
+    assert store.get('s1') == {}
+
+
+def test_memory_store_lru():
+    store = MemorySessionStore(max_sessions=2)
+    store.update('s1', {'a': '1'})
+    store.update('s2', {'a': '2'})
+    store.get('s1') # s2 is now the least recently used session
+    store.update('s3', {'a': '3'})
+    assert list(store.dict_sessions) == ['s1', 's3']
+    assert store.get('s2') == {}
+
+
+def test_memory_store_ttl(clock):
+    store = MemorySessionStore(ttl=60)
+    store.update('s1', {'a': '1'})
+    clock['now'] += 59
+    store.update('s1', {'b': '2'}) # expiry is postponed by each update
+    clock['now'] += 59
+    assert store.get('s1') == {'a': '1', 'b': '2'}
+    clock['now'] += 2
+    assert store.get('s1') == {}
+    assert 's1' not in store.dict_sessions
+    store.update('s1', {'c': '3'}) # answers of an expired session are not restored
+    assert store.get('s1') == {'c': '3'}
+
+
+def test_redis_store(clock):
+    client = FakeRedis()
+    store = RedisSessionStore(client, ttl=60)
+    store.update('s1', {'a': '1', 'b': ['1', '2'], 'c': None, 'd': 2.5})
+    store.update('s1', {})
+    assert store.get('s1') == {'a': '1', 'b': ['1', '2'], 'c': None, 'd': 2.5}
+    assert list(client.dict_hashes) == ['delectable:session:s1']
+    clock['now'] += 61
+    assert store.get('s1') == {}
+    store.update('s2', {'a': '1'})
+    store.reset('s2')
+    assert store.get('s2') == {}
+    assert client.dict_hashes == {}
+
+
+@pytest.mark.parametrize(('url', 'cls'), [('', type(None)), ('memory', MemorySessionStore), ('fake', RedisSessionStore)])
+def test_create_session_store(monkeypatch, url, cls):
+    monkeypatch.setenv('DELECTABLE_SESSION', url)
+    monkeypatch.setenv('SESSION_TTL', '60')
+    monkeypatch.setenv('SESSION_MAX', '5')
+    store = create_session_store(**get_config_session_from_env())
+    assert type(store) is cls
+    if url == 'memory':
+        assert (store.ttl, store.max_sessions) == (60, 5)
+
+
+def test_create_session_store_errors():
+    with pytest.raises(ValueError, match='Unknown session store'):
+        create_session_store('memcached://localhost')
+
+
+def test_create_session_store_redis_not_installed(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'redis', None) # import redis fails
+    with pytest.raises(ImportError, match='redis package is not installed'):
+        create_session_store('redis://localhost:6379/0')
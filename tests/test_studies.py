@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Test of several studies served by one process (DELECTABLE_STUDIES), with the Flask test client
+"""
+
+import importlib
+import json
+import sys
+import threading
+
+import pytest
+
+from benchmarks.dash_client import DashClient
+from redcap_stub import RedcapStub
+
+
+@pytest.fixture
+def module_app(tmp_path, monkeypatch):
+    # app.py reads the studies when it is imported
+    list_stubs = [RedcapStub(), RedcapStub()]
+    list_servers = [stub.serve() for stub in list_stubs]
+    path_studies = tmp_path / 'studies.json'
+    path_studies.write_text(json.dumps([
+        {'name': 'ibd', 'prefix': '/ibd/', 'redcap_api_url': f'http://127.0.0.1:{list_servers[0].server_port}/api/',
+         'redcap_api_token': 'token_ibd'},
+        {'name': 'other', 'prefix': '/other/', 'redcap_api_url': f'http://127.0.0.1:{list_servers[1].server_port}/api/',
+         'redcap_api_token_env': 'OTHER_REDCAP_TOKEN'},
+    ]))
+    monkeypatch.setenv('DELECTABLE_STUDIES', str(path_studies))
+    monkeypatch.setenv('OTHER_REDCAP_TOKEN', 'token_other')
+    monkeypatch.setenv('DELECTABLE_OUTBOX', str(tmp_path / 'outbox.sqlite3'))
+    monkeypatch.setenv('DELECTABLE_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setenv('REDCAP_ASYNC', '0') # records are sent in the callback
+    monkeypatch.setenv('REDCAP_METADATA_INTERVAL', '0')
+    monkeypatch.delitem(sys.modules, 'app', raising=False)
+    module_app = importlib.import_module('app')
+    module_app.list_stubs = list_stubs
+    yield module_app
+    sys.modules.pop('app', None)
+    for server in list_servers:
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+
+def submit(dash_app, patient_code):
+    client = DashClient(dash_app)
+    client.set('home_patient_code', 'value', patient_code)
+    client.set('home_visit_day', 'value', 1)
+    client.set('button_next', 'children', 'Submit')
+    client.set('button_next', 'n_clicks', 1)
+    return client.call('on_click_button_previous_next', [('button_next', 'n_clicks')])
+
+
+def test_studies_are_separate(module_app):
+    study_ibd, study_other = module_app.list_studies
+    app_ibd, app_other = module_app.list_apps
+    assert [study.prefix for study in module_app.list_studies] == ['/ibd/', '/other/']
+    assert [app.config.requests_pathname_prefix for app in module_app.list_apps] == ['/ibd/', '/other/']
+    assert study_ibd.outbox.path.endswith('outbox_ibd.sqlite3')
+    assert study_other.outbox.path.endswith('outbox_other.sqlite3')
+    assert (study_ibd.config_redcap['api_token'], study_other.config_redcap['api_token']) == ('token_ibd', 'token_other')
+
+    assert 'Record submitted (id = p_ibd)' in str(submit(app_ibd, 'p_ibd'))
+    assert 'Record submitted (id = p_other)' in str(submit(app_other, 'p_other'))
+    stub_ibd, stub_other = module_app.list_stubs
+    assert list(stub_ibd.dict_records) == ['p_ibd']
+    assert list(stub_other.dict_records) == ['p_other']
+    assert [request['token'] for request in stub_ibd.list_requests] == ['token_ibd']
+    assert [request['token'] for request in stub_other.list_requests] == ['token_other']
+    assert study_ibd.outbox.count() == study_other.outbox.count() == {'done': 1}
+    client = module_app.server.test_client()
+    assert client.get('/ibd/').status_code == client.get('/other/').status_code == 200
+    assert b'<a href="/ibd/">ibd</a>' in client.get('/').data # index of the studies
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the compiler of validation rules
+Checks of answers are tested in test_parity.py
+"""
+
+import datetime
+
+import pytest
+
+from fields import FieldSpec
+from validation import Validator, compile_rule, get_bound
+
+
+def get_field(**kwargs):
+    return FieldSpec(**{'name': 'field', 'field_type': 'text', **kwargs})
+
+
+@pytest.mark.parametrize(('value', 'compare', 'bound'), [
+    (datetime.datetime(2020, 1, 31), 'date', '2020-01-31'),
+    (datetime.datetime(2020, 1, 31, 8, 30), 'date', '2020-01-31 08:30'),
+    (datetime.date(2020, 1, 31), 'date', '2020-01-31'),
+    (datetime.time(8, 30), 'string', '08:30'),
+    ('2020/01/31', 'date', '2020-01-31'),
+    (' Today ', 'date', 'today'),
+    (5.0, 'number', '5'),
+    ('2.50', 'number', '2.5'),
+    ('', 'number', None),
+    (None, 'date', None),
+])
+def test_get_bound(value, compare, bound):
+    assert get_bound(value, compare) == bound
+
+
+def test_compile_rule_text():
+    assert compile_rule(get_field(validation='integer', validation_min=1, validation_max='10', required=True)) == {
+        'required': True, 'regex': r'^[-+]?\d+$', 'message': 'Expected an integer',
+        'min': '1', 'max': '10', 'compare': 'number',
+    }
+    # no range: no comparison
+    assert 'compare' not in compile_rule(get_field(validation='number'))
+    # no comparison of emails, range is ignored
+    assert compile_rule(get_field(validation='email', validation_min='a')) == {
+        'regex': r'^[^\s@]+@[^\s@]+\.[^\s@]+$', 'message': 'Expected an email address'}
+
+
+def test_compile_rule_choices():
+    assert compile_rule(get_field(field_type='checkbox', dict_options={2: 'B', 1: 'A', 'unk': 'Unknown'})) == {
+        'choices': ['1', '2', 'unk'], 'multiple': True}
+    assert compile_rule(get_field(field_type='slider')) == {'compare': 'number', 'min': '0', 'max': '100'}
+
+
+def test_compile_rule_none():
+    assert compile_rule(get_field()) is None
+    assert compile_rule(get_field(validation='unknown_type')) is None
+
+
+def test_compile_rule_invalid_range():
+    with pytest.raises(ValueError, match='Field field: invalid range'):
+        compile_rule(get_field(validation='integer', validation_min='one'))
+
+
+def test_validator_get_errors():
+    validator = Validator({
+        'a': get_field(name='a', validation='integer', required=True),
+        'b': get_field(name='b', required=True),
+        'c': get_field(name='c'),
+    })
+    assert sorted(validator.get_rules()['fields']) == ['a', 'b']
+    assert validator.get_errors({'a': 'x'}, {}) == {'a': 'Expected an integer', 'b': 'This field is required'}
+    assert validator.get_errors({'a': 'x'}, {'b': True}, ['a']) == {'a': 'Expected an integer'}
+    assert validator.get_errors({'a': '1', 'b': 'x'}, {}) == {}
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Validation of answers, compiled once from the Redcap data dictionary
+
+Each field becomes a rule (JSON) built from its columns:
+    - "Text Validation Type OR Show Slider Number": format of text fields (regex),
+      e.g. integer, number, number_2dp, date_dmy, time, email
+    - "Text Validation Min", "Text Validation Max": range of numbers, dates and times
+      ("today" and "now" are replaced by the current date/time when the answer is checked)
+    - "Required Field?": an answer is required (unless the field is hidden by branching logic)
+    - choices of dropdown, radio, checkbox, yesno and truefalse fields: answer is one of the codes
+The same rules are checked in the browser when an answer changes (assets/delectable.js),
+and on the server for the whole record before it is submitted to Redcap.
+
+Answers are checked as they are stored by the app: dates as YYYY-MM-DD (date picker),
+codes of choices, numbers or strings.
+"""
+
+import datetime
+import re
+
+from branching import get_string_from_answer
+
+
+###################################################
+# Formats of Redcap text validation types
+###################################################
+
+REGEX_DATE = r'^\d{4}-\d{2}-\d{2}$' # answers of date pickers, whatever the display format
+REGEX_DATETIME = r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}$'
+REGEX_DATETIME_SECONDS = r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}$'
+REGEX_NUMBER = r'^[-+]?(\d+(\.\d*)?|\.\d+)$'
+
+# Validation type -> (regex, type of comparison for min/max, message)
+DICT_VALIDATION_TYPES = {
+    'integer': (r'^[-+]?\d+$', 'number', 'Expected an integer'),
+    'number': (REGEX_NUMBER, 'number', 'Expected a number'),
+    'number_1dp': (r'^[-+]?\d+\.\d$', 'number', 'Expected a number with 1 decimal place'),
+    'number_2dp': (r'^[-+]?\d+\.\d{2}$', 'number', 'Expected a number with 2 decimal places'),
+    'date_dmy': (REGEX_DATE, 'date', 'Expected a date'),
+    'date_mdy': (REGEX_DATE, 'date', 'Expected a date'),
+    'date_ymd': (REGEX_DATE, 'date', 'Expected a date'),
+    'datetime_dmy': (REGEX_DATETIME, 'date', 'Expected a date and time (HH:MM)'),
+    'datetime_mdy': (REGEX_DATETIME, 'date', 'Expected a date and time (HH:MM)'),
+    'datetime_ymd': (REGEX_DATETIME, 'date', 'Expected a date and time (HH:MM)'),
+    'datetime_seconds_dmy': (REGEX_DATETIME_SECONDS, 'date', 'Expected a date and time (HH:MM:SS)'),
+    'datetime_seconds_mdy': (REGEX_DATETIME_SECONDS, 'date', 'Expected a date and time (HH:MM:SS)'),
+    'datetime_seconds_ymd': (REGEX_DATETIME_SECONDS, 'date', 'Expected a date and time (HH:MM:SS)'),
+    'time': (r'^([01]\d|2[0-3]):[0-5]\d$', 'string', 'Expected a time (HH:MM)'),
+    'email': (r'^[^\s@]+@[^\s@]+\.[^\s@]+$', None, 'Expected an email address'),
+    'alpha_only': (r'^[A-Za-z]+$', None, 'Expected letters only'),
+    'zipcode': (r'^\d{5}(-\d{4})?$', None, 'Expected a zip code'),
+    'postalcode_australia': (r'^\d{4}$', None, 'Expected a postcode (4 digits)'),
+    'phone_australia': (r'^(\+61 ?|0)[2-578]( ?\d){8}$', None, 'Expected a phone number'),
+}
+LIST_TYPES_CHOICES = ['dropdown', 'radio', 'checkbox', 'yesno', 'truefalse']
+SLIDER_MIN = 0
+SLIDER_MAX = 100
+
+# Messages of checks that do not depend on the validation type (also used by the browser)
+DICT_MESSAGES = {
+    'required': 'This field is required',
+    'choice': 'Answer is not one of the choices',
+    'number': 'Expected a number',
+    'min': 'Must be at least {}',
+    'max': 'Must be at most {}',
+}
+
+
+###################################################
+# Compiler (field -> rule)
+###################################################
+
+def get_bound(value, compare):
+    """
+    Return bound of a range as it is compared with answers (None if empty)
+    Dates and times read from Excel files are datetime objects, other bounds are strings or numbers
+    """
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d' if value.time() == datetime.time() else '%Y-%m-%d %H:%M')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, datetime.time):
+        return value.strftime('%H:%M')
+    if value is None or str(value).strip() == '':
+        return None
+    value = str(value).strip()
+    if value.lower() in ['today', 'now']:
+        return value.lower()
+    if compare == 'number':
+        return get_string_from_answer(float(value))
+    return value.replace('/', '-') # dates of the data dictionary are Y-M-D (with or without time)
+
+
+def compile_rule(field):
+    """
+    Return rule of a field (JSON), or None if any answer is valid
+    Rule keys: required, regex, message (when regex does not match), compare (number/date/string), min, max,
+    choices (codes as strings), multiple (checkbox: list of codes)
+    """
+    rule = {}
+    if field.required:
+        rule['required'] = True
+    if field.field_type in LIST_TYPES_CHOICES and field.dict_options:
+        rule['choices'] = sorted(str(code) for code in field.dict_options)
+        rule['multiple'] = field.field_type == 'checkbox'
+    elif field.field_type == 'slider':
+        rule.update(compare='number', min=str(SLIDER_MIN), max=str(SLIDER_MAX))
+    elif field.field_type == 'text' and field.validation in DICT_VALIDATION_TYPES:
+        regex, compare, message = DICT_VALIDATION_TYPES[field.validation]
+        rule.update(regex=regex, message=message)
+        if compare is not None:
+            try:
+                bound_min = get_bound(field.validation_min, compare)
+                bound_max = get_bound(field.validation_max, compare)
+            except ValueError:
+                raise ValueError(f'Field {field.name}: invalid range {field.validation_min!r} - {field.validation_max!r}') from None
+            rule.update({key: value for key, value in [('min', bound_min), ('max', bound_max)] if value is not None})
+            if 'min' in rule or 'max' in rule:
+                rule['compare'] = compare
+    return rule or None
+
+
+###################################################
+# Checks (same as assets/delectable.js)
+###################################################
+
+def is_empty(value):
+    return value is None or value == '' or value == []
+
+
+def get_bound_value(bound, compare):
+    """
+    Return value of a bound when an answer is checked ("today" and "now" are replaced by the current date/time)
+    """
+    if bound == 'today':
+        return datetime.date.today().isoformat()
+    if bound == 'now':
+        return datetime.datetime.now().strftime('%H:%M' if compare == 'string' else '%Y-%m-%d %H:%M')
+    return bound
+
+
+def is_below(compare, value, bound):
+    if compare == 'number':
+        return float(value) < float(bound)
+    return value < bound
+
+
+def check_rule(rule, regex, value):
+    """
+    Return error message of an answer, or None if answer is valid
+    Inputs:
+        - regex: compiled regex of rule (None if rule has no regex)
+    """
+    if is_empty(value):
+        return DICT_MESSAGES['required'] if rule.get('required') else None
+    if 'choices' in rule:
+        list_values = value if rule['multiple'] and isinstance(value, list) else [value]
+        if any(str(i) not in rule['choices'] for i in list_values):
+            return DICT_MESSAGES['choice']
+        return None
+    if isinstance(value, list): # same as String() of an array in the browser
+        string = ','.join(get_string_from_answer(i) for i in value)
+    else:
+        string = get_string_from_answer(value)
+    if regex is not None and not regex.match(string):
+        return rule['message']
+    compare = rule.get('compare')
+    if compare is None:
+        return None
+    if compare == 'number' and not re.match(REGEX_NUMBER, string):
+        return DICT_MESSAGES['number']
+    if 'min' in rule and is_below(compare, string, get_bound_value(rule['min'], compare)):
+        return DICT_MESSAGES['min'].format(rule['min'])
+    if 'max' in rule and is_below(compare, get_bound_value(rule['max'], compare), string):
+        return DICT_MESSAGES['max'].format(rule['max'])
+    return None
+
+
+class Validator:
+    """
+    Compiled validation rules of all fields
+    Inputs:
+        - dict_fields: field name -> FieldSpec
+    """
+
+    def __init__(self, dict_fields):
+        self.dict_rules = {}
+        self.dict_regex = {}
+        for field in dict_fields.values():
+            rule = compile_rule(field)
+            if rule is not None:
+                self.dict_rules[field.name] = rule
+                self.dict_regex[field.name] = re.compile(rule['regex']) if 'regex' in rule else None
+
+    def get_rules(self):
+        """
+        Return rules of all fields and messages as JSON (checked in the browser by assets/delectable.js)
+        """
+        return {'fields': self.dict_rules, 'messages': DICT_MESSAGES}
+
+    def check(self, field_name, value):
+        """
+        Return error message of the answer of one field, or None if answer is valid
+        """
+        rule = self.dict_rules.get(field_name)
+        if rule is None:
+            return None
+        return check_rule(rule, self.dict_regex[field_name], value)
+
+    def get_errors(self, dict_answers, dict_hide, list_fields=None):
+        """
+        Check the whole record before it is submitted (fields hidden by branching logic are not checked)
+        Inputs:
+            - list_fields: fields to check, e.g. fields of the forms of the visit day (default: all fields)
+        Return dict: field name -> error message (empty if record is valid)
+        """
+        dict_errors = {}
+        for field_name in self.dict_rules if list_fields is None else list_fields:
+            if field_name not in self.dict_rules or dict_hide.get(field_name):
+                continue
+            message = self.check(field_name, dict_answers.get(field_name))
+            if message is not None:
+                dict_errors[field_name] = message
+        return dict_errors